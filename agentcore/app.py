@@ -4,9 +4,10 @@ AgentCore Runtime用エントリーポイント
 Gateway経由でナレッジベース検索を実行（IAM認証）
 短期記憶（STM）対応、ストリーミングレスポンス対応
 """
-import json
 from bedrock_agentcore.runtime import BedrockAgentCoreApp
-from main import build_agent
+from main import TOOL_FLIGHTS, build_agent, logger
+import json_codec
+from structured_log import RequestLog
 
 app = BedrockAgentCoreApp()
 
@@ -27,10 +28,12 @@ async def invoke(payload: dict, context=None):
         ストリーミングイベント（思考過程、ツール呼び出し、結果を含む）
     """
     global agent
+    request_log = RequestLog(logger)
     
     # 初回呼び出し時にエージェントを構築
     if agent is None:
-        agent = build_agent()
+        with request_log.stage("build_agent"):
+            agent = build_agent()
     
     # セッションIDを取得（AgentCore Runtimeが自動管理）
     session_id = "default"
@@ -38,7 +41,7 @@ async def invoke(payload: dict, context=None):
         session_id = getattr(context, "session_id", None) or \
                      getattr(context, "sessionId", None) or \
                      "default"
-        print(f"Session ID from context: {session_id}")
+    request_log.set(sessionId=session_id)
     
     # エージェントのセッションIDを更新
     agent.state.set("session_id", session_id)
@@ -48,21 +51,36 @@ async def invoke(payload: dict, context=None):
     # ストリーミングでエージェントを実行
     agent_stream = agent.stream_async(user_text)
     
-    async for event in agent_stream:
-        # イベントの種類をログ出力（デバッグ用）
-        event_type = type(event).__name__
-        print(f"[Stream Event] {event_type}")
-        
-        # ツール呼び出しの詳細をログ
-        if hasattr(event, 'tool_name'):
-            print(f"  Tool: {event.tool_name}")
-        if hasattr(event, 'tool_input'):
-            print(f"  Input: {json.dumps(event.tool_input, ensure_ascii=False)[:200]}")
-        if hasattr(event, 'tool_result'):
-            print(f"  Result: {str(event.tool_result)[:200]}")
-        
-        yield event
-
+    event_count = 0
+    tool_calls = 0
+    coalesced_before = TOOL_FLIGHTS.coalesced
+    try:
+        async for event in agent_stream:
+            event_count += 1
+            if event_count == 1:
+                request_log.timings["first_event"] = request_log.elapsed_ms()
+            
+            # イベントの種類・ツール呼び出しの詳細（DEBUG のときだけ整形する）
+            if hasattr(event, 'tool_name'):
+                tool_calls += 1
+            logger.debug(
+                "stream event",
+                type=lambda: type(event).__name__,
+                tool=lambda: getattr(event, "tool_name", None),
+                input=lambda: json_codec.dumps(event.tool_input)[:200] if hasattr(event, "tool_input") else None,
+                result=lambda: str(event.tool_result)[:200] if hasattr(event, "tool_result") else None
+            )
+            
+            yield event
+    except Exception as e:
+        request_log.emit("ERROR", error=str(e), events=event_count, toolCalls=tool_calls)
+        raise
+    
+    request_log.emit(
+        events=event_count,
+        toolCalls=tool_calls,
+        coalescedToolCalls=TOOL_FLIGHTS.coalesced - coalesced_before
+    )
 
 if __name__ == "__main__":
     app.run()
@@ -10,6 +10,12 @@ Write-Host "Agent: $AGENT_NAME"
 Write-Host "Region: $REGION"
 Write-Host ""
 
+# Shared modules (source of truth: kbquery/)
+# The copies are committed so that a plain `agentcore launch` also works; commit them if this changes them
+Copy-Item "..\kbquery\json_codec.py" "json_codec.py" -Force
+Copy-Item "..\kbquery\structured_log.py" "structured_log.py" -Force
+Copy-Item "..\kbquery\single_flight.py" "single_flight.py" -Force
+
 # Configure
 Write-Host "[1/2] Configuring..." -ForegroundColor Yellow
 agentcore configure --entrypoint app.py --name $AGENT_NAME --region $REGION --non-interactive
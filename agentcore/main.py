@@ -7,7 +7,6 @@ Gateway経由でナレッジベース検索ツールを使用するエージェ
 このコードはAgentCore Runtime上で動作します。
 """
 import os
-import json
 from typing import Optional, Any
 import boto3
 import requests  # type: ignore
@@ -17,13 +16,22 @@ from strands import Agent, tool
 from strands.models import BedrockModel
 from strands.hooks import AgentInitializedEvent, HookProvider, HookRegistry, MessageAddedEvent
 
+# JSONコーデック・構造化ログ・single-flight（kbquery/ の同名モジュールのコピーをコミットしている。
+# コンテナのビルドは agentcore/ だけを使うため。kbquery 側を変更したら deploy.ps1 で同期すること）
+import json_codec
+from single_flight import SingleFlight, make_key
+from structured_log import StructuredLogger
+
+# 構造化ログ（AGENT_LOG_LEVEL / AGENT_LOG_SAMPLE_RATE で設定）
+logger = StructuredLogger("agentcore", env_prefix="AGENT")
+
 # メモリクライアント（オプション）
 try:
     from bedrock_agentcore.memory import MemoryClient
     MEMORY_AVAILABLE = True
 except ImportError:
     MEMORY_AVAILABLE = False
-    print("Warning: bedrock_agentcore.memory not available")
+    logger.warning("bedrock_agentcore.memory not available")
 
 
 # Gateway設定（環境変数から取得）
@@ -40,11 +48,17 @@ MEMORY_ID = os.environ.get("MEMORY_ID", "kb_search_agent_mem-W9ODNgGzYW")
 # ツール名のプレフィックス（Gatewayのターゲット名）
 TOOL_PREFIX = "target-quick-start-234b89___"
 
+# Lambdaのレスポンス形式（KB_RESPONSE_MODE に合わせる）
+# auto: JSONとしてパースし、statusCode と body のキーがあればproxy形式としてbodyを取り出す（それ以外はそのまま返す）
+# native: パースせずにそのまま返す
+# proxy: 常にパースしてbodyを取り出す
+GATEWAY_RESPONSE_MODE = os.environ.get("GATEWAY_RESPONSE_MODE", "auto")
+
 # メモリクライアント初期化
 memory_client = None
 if MEMORY_AVAILABLE and MEMORY_ID:
     memory_client = MemoryClient(region_name=REGION)
-    print(f"Memory enabled: {MEMORY_ID}")
+    logger.info("memory enabled", memoryId=MEMORY_ID)
 
 
 # ========================================
@@ -90,10 +104,10 @@ class ShortTermMemoryHook(HookProvider):
                 if history_lines and event.agent.system_prompt:
                     context = "\n".join(history_lines)
                     event.agent.system_prompt = event.agent.system_prompt + f"\n\n## 直前の会話履歴\n{context}"
-                    print(f"Loaded {len(turns)} conversation turns from memory")
+                    logger.debug("loaded conversation turns from memory", turns=len(turns))
         
         except Exception as e:
-            print(f"Warning: Failed to load memory: {e}")
+            logger.warning("failed to load memory", error=str(e))
     
     def on_message_added(self, event: MessageAddedEvent) -> None:
         """メッセージをメモリに保存"""
@@ -126,7 +140,7 @@ class ShortTermMemoryHook(HookProvider):
             )
         
         except Exception as e:
-            print(f"Warning: Failed to save to memory: {e}")
+            logger.warning("failed to save to memory", error=str(e))
     
     def register_hooks(self, registry: HookRegistry, **kwargs: Any) -> None:
         """フックを登録"""
@@ -147,6 +161,8 @@ SYSTEM_PROMPT = """あなたは親切な日本語アシスタントです。
 - **list_kbs**: どんなナレッジベースがあるか確認したいとき
 - **kb_search**: 特定のナレッジベースを検索（kb_nameとqueryを指定）
 - **auto_search**: どのKBを使うか迷ったとき（自動選択）
+- **batch_search**: 複数のKBを比較したいときや、複数の検索をまとめて行いたいとき（1回の呼び出しで実行）
+- **federated_search**: どのKBに答えがあるかわからないとき（全KBを横断検索して1つのランキングで返す）
 
 ## 利用可能なナレッジベース
 - product_docs: 認証機能マニュアル
@@ -206,34 +222,79 @@ def call_mcp_method(method: str, params: Optional[dict] = None) -> dict:
         "params": params or {}
     }
     
-    body = json.dumps(payload)
+    body = json_codec.dumps(payload)
     headers = sign_request("POST", GATEWAY_URL, body)
     
-    response = requests.post(GATEWAY_URL, headers=headers, data=body, timeout=30)
-    return response.json()
+    response = requests.post(GATEWAY_URL, headers=headers, data=body.encode("utf-8"), timeout=30)
+    return json_codec.loads(response.content)
 
 
 def get_gateway_tools() -> list:
     """Gatewayからツール一覧を取得"""
     try:
         result = call_mcp_method("tools/list")
-        print(f"tools/list レスポンス: {json.dumps(result, ensure_ascii=False)[:500]}")
+        logger.debug("tools/list response", response=lambda: json_codec.dumps(result)[:500])
         
         if "result" in result and "tools" in result["result"]:
             return result["result"]["tools"]
         
         # エラーがあれば表示
         if "error" in result:
-            print(f"tools/list エラー: {result['error']}")
+            logger.error("tools/list error", error=result["error"])
         
         return []
     except Exception as e:
-        print(f"tools/list 例外: {e}")
+        logger.error("tools/list exception", error=str(e))
         return []
 
 
+def unwrap_lambda_response(text: str) -> str:
+    """
+    Gatewayが返したLambdaの出力（JSON文字列）からツールの結果を取り出す
+    
+    native形式はそれ自体がツールの結果なので、そのまま返す。ただしLambdaランタイムが
+    日本語を \\uXXXX にエスケープしている場合は、LLMの入力トークンが増えるので1回だけ復元する。
+    proxy形式（statusCode + body）の場合は body を返す。
+    auto ではJSONとしてパースし、statusCode と body のキーがあれば proxy形式とみなす
+    （キーの順序や空白には依存しない）。
+    """
+    # native形式でエスケープがなければ、パースせずにそのまま返す
+    if GATEWAY_RESPONSE_MODE == "native" and "\\u" not in text:
+        return text
+    try:
+        parsed = json_codec.loads(text)
+    except ValueError:
+        return text
+    
+    if isinstance(parsed, dict) and "body" in parsed and (
+        GATEWAY_RESPONSE_MODE == "proxy"
+        or (GATEWAY_RESPONSE_MODE == "auto" and "statusCode" in parsed)
+    ):
+        body = parsed["body"]
+        return body if isinstance(body, str) else json_codec.dumps(body)
+    if GATEWAY_RESPONSE_MODE == "proxy":
+        return text
+    
+    # native形式: エスケープされていれば1回だけ復元する
+    return json_codec.dumps(parsed) if "\\u" in text else text
+
+
+# モデルが同じツールを同じ引数で並列に呼んだ場合、Gatewayへの呼び出しを1回にまとめる
+TOOL_FLIGHTS = SingleFlight()
+
+
 def call_gateway_tool(tool_name: str, arguments: dict) -> str:
-    """Gatewayのツールを呼び出し"""
+    """Gatewayのツールを呼び出し（実行中の同一呼び出しとは結果を共有する）"""
+    result, coalesced = TOOL_FLIGHTS.do(
+        make_key(tool_name, arguments),
+        lambda: _call_gateway_tool(tool_name, arguments)
+    )
+    if coalesced:
+        logger.debug("coalesced tool call", tool=tool_name)
+    return result
+
+
+def _call_gateway_tool(tool_name: str, arguments: dict) -> str:
     # ツール名にプレフィックスを追加
     full_tool_name = f"{TOOL_PREFIX}{tool_name}"
     
@@ -251,20 +312,13 @@ def call_gateway_tool(tool_name: str, arguments: dict) -> str:
             content = tool_result["content"]
             if isinstance(content, list) and len(content) > 0:
                 text = content[0].get("text", str(content))
-                # Lambda関数のレスポンスをパース
-                try:
-                    parsed = json.loads(text)
-                    if "body" in parsed:
-                        return parsed["body"]
-                    return text
-                except:
-                    return text
-        return json.dumps(tool_result, ensure_ascii=False)
+                return unwrap_lambda_response(text)
+        return json_codec.dumps(tool_result)
     
     if "error" in result:
-        return f"エラー: {json.dumps(result['error'], ensure_ascii=False)}"
+        return f"エラー: {json_codec.dumps(result['error'])}"
     
-    return json.dumps(result, ensure_ascii=False)
+    return json_codec.dumps(result)
 
 
 def build_agent():
@@ -277,9 +331,9 @@ def build_agent():
         )
     
     # Gatewayからツール一覧を取得（確認用）
-    print(f"Gateway URL: {GATEWAY_URL}")
+    logger.info("gateway", url=GATEWAY_URL)
     gateway_tools = get_gateway_tools()
-    print(f"利用可能なツール: {[t['name'] for t in gateway_tools]}")
+    logger.info("gateway tools", tools=lambda: [t["name"] for t in gateway_tools])
     
     # Gatewayツールをラップする関数を定義
     @tool
@@ -288,7 +342,12 @@ def build_agent():
         return call_gateway_tool("list_kbs", {})
     
     @tool
-    def kb_search(kb_name: str, query: str, max_results: int = 5) -> str:
+    def kb_search(
+        kb_name: str,
+        query: str,
+        max_results: int = 5,
+        content_mode: Optional[str] = None
+    ) -> str:
         """
         指定したナレッジベースを検索
         
@@ -296,23 +355,61 @@ def build_agent():
             kb_name: 検索するナレッジベースの名前（product_docs または faq）
             query: 検索クエリ
             max_results: 取得する結果の最大数
+            content_mode: 本文の返し方（full / truncate / snippet、省略時はKBの既定値）
         """
-        return call_gateway_tool("kb_search", {
+        arguments = {
             "kb_name": kb_name,
             "query": query,
             "max_results": max_results
-        })
+        }
+        if content_mode:
+            arguments["content_mode"] = content_mode
+        return call_gateway_tool("kb_search", arguments)
     
     @tool
-    def auto_search(query: str, max_results: int = 5) -> str:
+    def auto_search(query: str, max_results: int = 5, content_mode: Optional[str] = None) -> str:
         """
         クエリから最適なナレッジベースを自動選択して検索
         
+        Args:
+            query: 検索クエリ
+            max_results: 取得する結果の最大数
+            content_mode: 本文の返し方（full / truncate / snippet、省略時はKBの既定値）
+        """
+        arguments = {
+            "query": query,
+            "max_results": max_results
+        }
+        if content_mode:
+            arguments["content_mode"] = content_mode
+        return call_gateway_tool("auto_search", arguments)
+    
+    @tool
+    def batch_search(query: str, kb_names: list[str], max_results: int = 5) -> str:
+        """
+        1つのクエリで複数のナレッジベースをまとめて検索
+        
+        Args:
+            query: 検索クエリ
+            kb_names: 検索するナレッジベース名のリスト（例: ["product_docs", "faq"]）
+            max_results: 各ナレッジベースから取得する結果の最大数
+        """
+        return call_gateway_tool("batch_search", {
+            "query": query,
+            "kb_names": kb_names,
+            "max_results": max_results
+        })
+    
+    @tool
+    def federated_search(query: str, max_results: int = 5) -> str:
+        """
+        全ナレッジベースを横断検索し、結果を1つのランキングに統合
+        
         Args:
             query: 検索クエリ
             max_results: 取得する結果の最大数
         """
-        return call_gateway_tool("auto_search", {
+        return call_gateway_tool("federated_search", {
             "query": query,
             "max_results": max_results
         })
@@ -327,13 +424,13 @@ def build_agent():
     hooks = []
     if memory_client and MEMORY_ID:
         hooks.append(ShortTermMemoryHook())
-        print("Short-term memory hook enabled")
+        logger.info("short-term memory hook enabled")
     
     # エージェント作成
     return Agent(
         model=model,
         system_prompt=SYSTEM_PROMPT,
-        tools=[list_kbs, kb_search, auto_search],
+        tools=[list_kbs, kb_search, auto_search, batch_search, federated_search],
         hooks=hooks,
         state={"session_id": "default"}
     )
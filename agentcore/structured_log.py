@@ -0,0 +1,134 @@
+# kbquery/structured_log.py
+"""
+構造化ログ（kbquery と agentcore で共通）
+
+- レベル（DEBUG / INFO / WARNING / ERROR）で出力を制御する
+- フィールドの値に呼び出し可能オブジェクトを渡すと、出力するときだけ評価する
+  （レベルが無効ならイベント本文などをシリアライズしない）
+- RequestLog でリクエストごとに1行のJSON（所要時間・段階ごとの時間付き）を出力する
+- リクエスト行はサンプリングできる（WARNING 以上は常に出力）
+
+設定は環境変数で行う（prefix は kbquery が KB、agentcore が AGENT）:
+    {prefix}_LOG_LEVEL: 出力するレベル（既定: INFO）
+    {prefix}_LOG_SAMPLE_RATE: リクエスト行を出力する割合（0〜1、既定: 1.0）
+
+agentcore へは deploy.ps1 がこのファイルをコピーする（正本は kbquery/structured_log.py）。
+"""
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import json_codec
+
+
+LEVELS = {"DEBUG": 10, "INFO": 20, "WARNING": 30, "ERROR": 40}
+
+
+def _resolve(value: Any) -> Any:
+    """遅延フィールド（呼び出し可能オブジェクト）を評価する"""
+    return value() if callable(value) else value
+
+
+class StructuredLogger:
+    """
+    1行1JSONで出力するロガー
+    
+    フィールドは出力が決まってから評価・シリアライズする。
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        env_prefix: str = "KB",
+        level: Optional[str] = None,
+        sample_rate: Optional[float] = None
+    ):
+        if level is None:
+            level = os.environ.get(f"{env_prefix}_LOG_LEVEL", "INFO")
+        if sample_rate is None:
+            sample_rate = float(os.environ.get(f"{env_prefix}_LOG_SAMPLE_RATE", "1.0"))
+        self.name = name
+        self.level = LEVELS.get(level.upper(), LEVELS["INFO"])
+        self.sample_rate = sample_rate
+    
+    def is_enabled(self, level: str) -> bool:
+        return LEVELS[level] >= self.level
+    
+    def should_sample(self) -> bool:
+        """このリクエストの行を出力するか（サンプリング）"""
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+    
+    def log(self, level: str, message: str, **fields: Any) -> None:
+        if not self.is_enabled(level):
+            return
+        record: Dict[str, Any] = {"level": level, "logger": self.name, "message": message}
+        for key, value in fields.items():
+            record[key] = _resolve(value)
+        try:
+            line = json_codec.dumps(record)
+        except TypeError:
+            # シリアライズできない値は文字列にして出力する
+            line = json_codec.dumps({key: str(value) for key, value in record.items()})
+        print(line)
+    
+    def debug(self, message: str, **fields: Any) -> None:
+        self.log("DEBUG", message, **fields)
+    
+    def info(self, message: str, **fields: Any) -> None:
+        self.log("INFO", message, **fields)
+    
+    def warning(self, message: str, **fields: Any) -> None:
+        self.log("WARNING", message, **fields)
+    
+    def error(self, message: str, **fields: Any) -> None:
+        self.log("ERROR", message, **fields)
+
+
+class RequestLog:
+    """
+    1リクエスト分のログをまとめて、最後に1行だけ出力する
+    
+    使い方:
+        request_log = RequestLog(logger, tool="kb_search")
+        with request_log.stage("search"):
+            ...
+        request_log.emit(status=200)
+    """
+    
+    def __init__(self, logger: StructuredLogger, **fields: Any):
+        self.logger = logger
+        self.fields: Dict[str, Any] = dict(fields)
+        self.timings: Dict[str, float] = {}
+        self.sampled = logger.should_sample()
+        self._start = time.perf_counter()
+    
+    def set(self, **fields: Any) -> None:
+        self.fields.update(fields)
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ブロックの所要時間をミリ秒で記録（同じ名前は加算）"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.timings[name] = round(self.timings.get(name, 0.0) + elapsed, 2)
+    
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self._start) * 1000, 2)
+    
+    def emit(self, level: str = "INFO", message: str = "request", **fields: Any) -> None:
+        """リクエスト行を出力（サンプリング対象外なら WARNING 未満は出さない）"""
+        if not self.sampled and LEVELS[level] < LEVELS["WARNING"]:
+            return
+        self.logger.log(
+            level,
+            message,
+            durationMs=self.elapsed_ms(),
+            timings=dict(self.timings),
+            **self.fields,
+            **fields
+        )
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# kbquery/bench_cold_start.py
+"""
+コールドスタートのベンチマーク（AWS不要）
+
+新しいPythonプロセスで lambda_function を読み込み（python -X importtime）、以下を計測する。
+
+- import lambda_function にかかる時間（Lambdaの初期化フェーズに相当）
+- 初回の list_kbs（boto3 を読み込まずに応答できているか）
+- Bedrockクライアントの生成（boto3 の読み込みを含む、最初の検索で発生する分。
+  boto3 がない・クライアントを生成できない環境では計測しない）
+- モジュールごとの import 時間（self / 累積）
+
+プロセスを --runs 回起動し、中央値を報告する。結果はJSONで保存でき、
+--baseline で以前の結果と比較できる。
+
+Lambdaのランタイム（awslambdaric）がハンドラーより先に読み込む標準ライブラリ
+（json, logging, traceback など）は、--preload で計測前に読み込んで対象から外す。
+
+使い方:
+    python bench_cold_start.py [--runs 5] [--top 15] [--preload json,logging,traceback]
+                               [--output cold_start.json] [--baseline previous.json]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import json_codec
+
+
+# 子プロセスで実行する計測コード（結果は最終行にJSONで出力する）
+PROBE = r"""
+import importlib, json, os, sys, time
+for name in filter(None, os.environ.get("BENCH_PRELOAD", "").split(",")):
+    importlib.import_module(name)
+sys.stderr.write("{marker}\n")
+start = time.perf_counter()
+import lambda_function
+init_ms = (time.perf_counter() - start) * 1000
+
+start = time.perf_counter()
+response = lambda_function.lambda_handler({"toolName": "list_kbs", "input": {}}, None)
+list_kbs_ms = (time.perf_counter() - start) * 1000
+boto3_loaded = "boto3" in sys.modules
+
+client_ms = None
+try:
+    start = time.perf_counter()
+    lambda_function.get_bedrock_client()
+    client_ms = (time.perf_counter() - start) * 1000
+except Exception:
+    pass  # boto3 がない・クライアントを生成できない環境
+
+print(json.dumps({
+    "initMs": init_ms,
+    "listKbsMs": list_kbs_ms,
+    "listKbsStatus": response.get("statusCode", 200),
+    "boto3LoadedByListKbs": boto3_loaded,
+    "clientMs": client_ms,
+}))
+"""
+
+PHASES = ("initMs", "listKbsMs", "clientMs")
+
+# これより後の import だけを集計する
+START_MARKER = "-- bench start --"
+DEFAULT_PRELOAD = "json,logging,traceback"
+
+
+def parse_importtime(stderr: str) -> Dict[str, Tuple[int, int]]:
+    """-X importtime の出力を {モジュール名: (self μs, 累積 μs)} に変換"""
+    timings: Dict[str, Tuple[int, int]] = {}
+    lines = stderr.splitlines()
+    if START_MARKER in lines:
+        lines = lines[lines.index(START_MARKER) + 1:]
+    for line in lines:
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # ヘッダー行
+        timings[parts[2].strip()] = (int(parts[0]), int(parts[1]))
+    return timings
+
+
+def run_probe(python: str, preload: str) -> Tuple[Dict[str, Any], Dict[str, Tuple[int, int]]]:
+    """新しいプロセスで1回計測する"""
+    env = dict(os.environ)
+    env.setdefault("AWS_REGION", "ap-northeast-1")
+    env.setdefault("KB_LOG_LEVEL", "ERROR")
+    env.setdefault("KB_METRICS_ENABLED", "false")
+    env["BENCH_PRELOAD"] = preload
+    completed = subprocess.run(
+        [python, "-X", "importtime", "-c", PROBE.replace("{marker}", START_MARKER)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"probe failed:\n{completed.stderr[-2000:]}")
+    phases = json_codec.loads(completed.stdout.strip().splitlines()[-1])
+    return phases, parse_importtime(completed.stderr)
+
+
+def run_benchmark(runs: int, python: str, preload: str = DEFAULT_PRELOAD) -> Dict[str, Any]:
+    samples: List[Dict[str, Any]] = []
+    module_samples: Dict[str, List[Tuple[int, int]]] = {}
+    for _ in range(runs):
+        phases, modules = run_probe(python, preload)
+        samples.append(phases)
+        for name, timing in modules.items():
+            module_samples.setdefault(name, []).append(timing)
+    
+    result: Dict[str, Any] = {"runs": runs, "preload": preload}
+    for phase in PHASES:
+        values = [s[phase] for s in samples if s[phase] is not None]
+        result[phase] = round(statistics.median(values), 2) if values else None
+    result["boto3LoadedByListKbs"] = any(s["boto3LoadedByListKbs"] for s in samples)
+    result["listKbsStatus"] = samples[-1]["listKbsStatus"]
+    result["modules"] = {
+        name: {
+            "selfMs": round(statistics.median(t[0] for t in timings) / 1000, 2),
+            "cumulativeMs": round(statistics.median(t[1] for t in timings) / 1000, 2),
+        }
+        for name, timings in module_samples.items()
+    }
+    return result
+
+
+def print_report(result: Dict[str, Any], top: int, baseline: Optional[Dict[str, Any]] = None) -> None:
+    def fmt(value: Optional[float]) -> str:
+        return "-" if value is None else f"{value:.2f} ms"
+    
+    print(f"\nコールドスタート（{result['runs']}回の中央値）")
+    print(f"  import lambda_function: {fmt(result['initMs'])}")
+    print(f"  初回 list_kbs:          {fmt(result['listKbsMs'])}"
+          f"（status {result['listKbsStatus']}, boto3 読み込み: "
+          f"{'あり' if result['boto3LoadedByListKbs'] else 'なし'}）")
+    print(f"  Bedrockクライアント生成: {fmt(result['clientMs'])}（boto3 の読み込みを含む）")
+    
+    # lambda_function の配下だけでなく、計測開始後に読み込んだ全モジュール（boto3 を含む）を対象にする
+    modules = sorted(result["modules"].items(), key=lambda kv: kv[1]["cumulativeMs"], reverse=True)
+    print(f"\nモジュールごとの import 時間（累積の上位{top}件）")
+    print(f"{'module':<40}{'self ms':>10}{'cum ms':>10}")
+    for name, timing in modules[:top]:
+        print(f"{name[:39]:<40}{timing['selfMs']:>10}{timing['cumulativeMs']:>10}")
+    
+    if baseline is not None:
+        print("\nベースラインとの比較:")
+        for phase in PHASES:
+            before, after = baseline.get(phase), result.get(phase)
+            if before is None or after is None:
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"  {phase}: {before} → {after}（{change:+.1f}%）")
+        print(f"  boto3LoadedByListKbs: {baseline.get('boto3LoadedByListKbs')} → "
+              f"{result['boto3LoadedByListKbs']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="cold start / import time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="表示するモジュール数")
+    parser.add_argument("--python", default=sys.executable, help="計測に使うPython")
+    parser.add_argument("--preload", default=DEFAULT_PRELOAD,
+                        help="計測前に読み込むモジュール（カンマ区切り、Lambdaランタイムが読み込み済みのもの）")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較する以前の結果（JSON）")
+    args = parser.parse_args()
+    
+    result = run_benchmark(max(1, args.runs), args.python, args.preload)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = json_codec.loads(f.read())
+    print_report(result, args.top, baseline)
+    
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(json_codec.dumps_bytes(result))
+        print(f"\n💾 結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
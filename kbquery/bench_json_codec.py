@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# kbquery/bench_json_codec.py
+"""
+JSONシリアライズのマイクロベンチマーク（AWS不要）
+
+kb_search の出力に近い合成データ（日本語チャンク）を、次の方式でエンコード/デコードして比較する。
+
+- stdlib: 従来の json.dumps(..., ensure_ascii=False)（区切りに空白あり）
+- compact: 標準の json + separators=(",", ":")（json_codec の既定）
+- orjson: orjson（インストールされている場合のみ。json_codec では KB_JSON_ORJSON=true のとき使う）
+
+使い方:
+    python bench_json_codec.py [--results 5,20,50] [--chars 1000] [--repeat 200]
+"""
+import argparse
+import json
+import time
+
+import json_codec
+from bench_response_encoding import make_output
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def measure(fn, repeat: int) -> float:
+    """repeat回実行した1回あたりの秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON codec micro-benchmark")
+    parser.add_argument("--results", default="5,20,50")
+    parser.add_argument("--chars", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    
+    codecs = {
+        "stdlib": (
+            lambda obj: json.dumps(obj, ensure_ascii=False),
+            json.loads,
+        ),
+        "compact": (
+            lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":")),
+            json.loads,
+        ),
+    }
+    if orjson is not None:
+        codecs["orjson"] = (lambda obj: orjson.dumps(obj).decode("utf-8"), orjson.loads)
+    
+    print(f"json_codec: {json_codec.backend_name()}, "
+          f"chars={args.chars}, repeat={args.repeat}")
+    print(f"{'results':>8}  {'codec':<10}{'dumps us':>12}{'loads us':>12}{'bytes':>12}")
+    for num_results in (int(n) for n in args.results.split(",")):
+        output = make_output(num_results, args.chars)
+        for name, (dumps, loads) in codecs.items():
+            text = dumps(output)
+            dumps_sec = measure(lambda: dumps(output), args.repeat)
+            loads_sec = measure(lambda: loads(text), args.repeat)
+            print(f"{num_results:>8}  {name:<10}{dumps_sec * 1e6:>12.1f}"
+                  f"{loads_sec * 1e6:>12.1f}{len(text.encode('utf-8')):>12,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# kbquery/bench_kb_router.py
+"""
+KBルーターのベンチマーク（AWS不要）
+
+合成したKB設定（デフォルト: 100KB × 300キーワード）に対して、
+従来の「KB × キーワードの in 判定」と KBRouter（Aho-Corasick + 転置インデックス）の
+1クエリあたりの時間を比較する。ルーター構築時間（コンテナ起動時に1回）も表示する。
+
+使い方:
+    python bench_kb_router.py [--kbs 100] [--terms 300] [--repeat 200]
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List, Tuple
+
+from kb_router import KBRouter
+
+
+SYLLABLES = list("アイウエオカキクケコサシスセソタチツテトナニヌネノハヒフヘホマミムメモラリルレロ")
+
+
+def make_synthetic_config(num_kbs: int, num_terms: int, seed: int = 7) -> Dict[str, Dict[str, Any]]:
+    """カタカナ語・英単語のキーワードを持つ合成KB設定"""
+    rng = random.Random(seed)
+    config = {}
+    for i in range(num_kbs):
+        terms = {}
+        while len(terms) < num_terms:
+            if rng.random() < 0.7:
+                term = "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+            else:
+                term = f"api{rng.randrange(100000)}"
+            terms[term] = rng.choice([0.5, 1.0, 2.0])
+        config[f"kb_{i:03d}"] = {
+            "id": f"KB{i:08d}",
+            "description": f"合成ナレッジベース{i}",
+            "routing_terms": terms,
+        }
+    return config
+
+
+def make_queries(config: Dict[str, Dict[str, Any]], count: int, seed: int = 11) -> List[str]:
+    """設定内のキーワードを2〜3個含む自然文風のクエリ"""
+    rng = random.Random(seed)
+    all_terms = [term for kb in config.values() for term in kb["routing_terms"]]
+    queries = []
+    for _ in range(count):
+        terms = rng.sample(all_terms, rng.randint(2, 3))
+        queries.append(f"{terms[0]}の設定方法と{terms[1]}について教えてください。" + "".join(terms[2:]))
+    return queries
+
+
+def legacy_rank(config: Dict[str, Dict[str, Any]], query: str) -> List[Tuple[str, float]]:
+    """従来方式: KBごとに全キーワードを in で判定"""
+    query_lower = query.lower()
+    ranked = []
+    for kb_name, kb in config.items():
+        score = sum(w for kw, w in kb["routing_terms"].items() if kw in query_lower)
+        if kb["description"].lower() in query_lower:
+            score += 2.0
+        ranked.append((kb_name, score))
+    return sorted(ranked, key=lambda x: x[1], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KB router benchmark")
+    parser.add_argument("--kbs", type=int, default=100)
+    parser.add_argument("--terms", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    
+    config = make_synthetic_config(args.kbs, args.terms)
+    queries = make_queries(config, 50)
+    
+    start = time.perf_counter()
+    router = KBRouter(config)
+    build_ms = (time.perf_counter() - start) * 1000
+    
+    mismatches = sum(
+        1 for q in queries
+        if [kb for kb, s in legacy_rank(config, q) if s > 0]
+        != [kb for kb, s in router.rank_query(q) if s > 0]
+    )
+    
+    def measure(fn) -> float:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for query in queries:
+                fn(query)
+        return (time.perf_counter() - start) / (args.repeat * len(queries))
+    
+    legacy = measure(lambda q: legacy_rank(config, q))
+    routed = measure(router.rank_query)
+    
+    print(f"KB数: {args.kbs}, KBあたりキーワード数: {args.terms}, クエリ数: {len(queries)}")
+    print(f"ルーター構築時間: {build_ms:.1f} ms（コンテナ起動時に1回）")
+    print(f"候補順位の不一致: {mismatches}件")
+    print(f"{'router':<12}{'us/query':>12}")
+    print(f"{'legacy':<12}{legacy * 1e6:>12.1f}")
+    print(f"{'KBRouter':<12}{routed * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
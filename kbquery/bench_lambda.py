@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# kbquery/bench_lambda.py
+"""
+lambda_handler のオフラインベンチマーク（AWS不要）
+
+bedrock-agent-runtime の偽クライアント（遅延・ジッター・エラー率・結果サイズを指定可能）を
+注入し、現実的なクエリの組み合わせで lambda_handler を呼び出して以下を計測する。
+
+- スループット（リクエスト/秒）
+- レイテンシの p50 / p95 / p99（全体とツールごと）
+- 1リクエストあたりのretrieve呼び出し数
+- エラー数・部分結果数
+
+結果はJSONで保存でき、--baseline で以前の結果と比較できる。
+
+使い方:
+    python bench_lambda.py [--requests 200] [--concurrency 1] [--latency-ms 80] [--jitter-ms 40]
+                           [--error-rate 0.0] [--results-per-call 10] [--content-chars 800]
+                           [--no-cache] [--output bench_result.json] [--baseline previous.json]
+"""
+import argparse
+import contextlib
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+
+# ベンチマーク中のログ・EMF出力を抑える（lambda_function の import より前に設定する）
+os.environ.setdefault("KB_LOG_LEVEL", "ERROR")
+os.environ.setdefault("KB_METRICS_ENABLED", "false")
+
+try:
+    from botocore.exceptions import ClientError
+except ImportError:
+    class ClientError(Exception):
+        """
+        botocore がない環境用の ClientError 相当
+        
+        resilience.is_retryable は response のエラーコードで判定するため、同じ形の response を持たせる。
+        """
+        
+        def __init__(self, error_response: Dict[str, Any], operation_name: str):
+            error = error_response.get("Error", {})
+            super().__init__(
+                f"An error occurred ({error.get('Code')}) when calling the {operation_name} "
+                f"operation: {error.get('Message')}"
+            )
+            self.response = error_response
+            self.operation_name = operation_name
+
+
+# クエリの組み合わせ（イベント, 重み）
+# 同じクエリが繰り返し来る（キャッシュが効く）場合と、長いクエリが分解される場合を含む
+QUERY_MIX = [
+    ({"toolName": "kb_search", "input": {"kb_name": "product_docs", "query": "ログインできない場合の対処方法"}}, 4),
+    ({"toolName": "kb_search", "input": {"kb_name": "faq", "query": "よくある質問の一覧を教えて"}}, 2),
+    ({"toolName": "kb_search", "input": {
+        "kb_name": "product_docs",
+        "query": "認証機能の使い方について教えてください。ログインAPIのエラーコードは何ですか？"
+                 "パスワードリセットの手順を知りたいです。また、SAMLの設定方法も教えて",
+    }}, 2),
+    ({"toolName": "auto_search", "input": {"query": "パスワードを忘れたときのリセット手順"}}, 3),
+    ({"toolName": "batch_search", "input": {"query": "二要素認証の設定", "kb_names": ["product_docs", "faq"]}}, 1),
+    ({"toolName": "federated_search", "input": {"query": "サンプルドキュメントの認証設定"}}, 1),
+    ({"toolName": "list_kbs", "input": {}}, 1),
+]
+
+
+class FakeBedrockAgentRuntime:
+    """
+    bedrock-agent-runtime の retrieve だけを模した偽クライアント
+    
+    呼び出しごとに latency_ms ± jitter_ms だけ待ち、error_rate の確率でスロットリングエラーを返す。
+    結果はクエリから決まる疑似乱数で作るため、同じクエリには同じ結果を返す。
+    """
+    
+    def __init__(
+        self,
+        latency_ms: float = 80.0,
+        jitter_ms: float = 40.0,
+        error_rate: float = 0.0,
+        results_per_call: int = 10,
+        content_chars: int = 800,
+        seed: int = 42
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.results_per_call = results_per_call
+        self.content_chars = content_chars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+    
+    def _sample_delay_and_error(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return max(0.0, delay) / 1000, failed
+    
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration):
+        delay, failed = self._sample_delay_and_error()
+        time.sleep(delay)
+        if failed:
+            error = {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}
+            raise ClientError(error, "Retrieve")
+        
+        query = retrievalQuery["text"]
+        limit = retrievalConfiguration["vectorSearchConfiguration"]["numberOfResults"]
+        rng = random.Random(f"{knowledgeBaseId}:{query}")
+        body = (query + "についての説明です。") * (self.content_chars // max(1, len(query) + 9) + 1)
+        results = []
+        for i in range(min(limit, self.results_per_call)):
+            doc = rng.randrange(50)
+            results.append({
+                "content": {"text": body[:self.content_chars]},
+                "score": round(1.0 - i * 0.05 - rng.random() * 0.01, 4),
+                "location": {"s3Location": {"uri": f"s3://bench/{knowledgeBaseId}/doc-{doc}.md"}},
+                "metadata": {"x-amz-bedrock-kb-chunk-id": f"{knowledgeBaseId}-{doc}-{i}"},
+            })
+        return {"retrievalResults": results}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """最近傍順位法のパーセンタイル"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies_ms: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(latencies_ms),
+        "p50Ms": round(percentile(latencies_ms, 50), 2),
+        "p95Ms": round(percentile(latencies_ms, 95), 2),
+        "p99Ms": round(percentile(latencies_ms, 99), 2),
+        "meanMs": round(sum(latencies_ms) / len(latencies_ms), 2) if latencies_ms else 0.0,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    import lambda_function
+    import json_codec
+    
+    client = FakeBedrockAgentRuntime(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        results_per_call=args.results_per_call,
+        content_chars=args.content_chars,
+        seed=args.seed
+    )
+    lambda_function.set_bedrock_client(client)
+    lambda_function.RETRIEVAL_CACHE.clear()
+    lambda_function.NEAR_DUPLICATE_INDEX.clear()
+    if args.no_cache:
+        # 毎回retrieveを呼ぶ状態を測る（KB設定の cache_ttl を無効にしたレジストリに差し替える）
+        lambda_function.KB_REGISTRY = lambda_function.KB_REGISTRY.with_overrides(cache_ttl=0)
+    
+    rng = random.Random(args.seed)
+    events = [event for event, _ in QUERY_MIX]
+    weights = [weight for _, weight in QUERY_MIX]
+    schedule = rng.choices(range(len(events)), weights=weights, k=args.requests)
+    
+    def invoke(index: int) -> Dict[str, Any]:
+        event = events[index]
+        calls_before = client.calls
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, None)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        status = response.get("statusCode", 200)
+        body = response.get("body")
+        output = json_codec.loads(body) if isinstance(body, str) else response
+        return {
+            "tool": event["toolName"],
+            "latencyMs": elapsed_ms,
+            "status": status,
+            "partial": bool(output.get("partial")) if isinstance(output, dict) else False,
+            "calls": client.calls - calls_before,
+        }
+    
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        wall_start = time.perf_counter()
+        if args.concurrency <= 1:
+            records = [invoke(index) for index in schedule]
+        else:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                records = list(executor.map(invoke, schedule))
+        wall_sec = time.perf_counter() - wall_start
+    
+    per_tool: Dict[str, Dict[str, Any]] = {}
+    for tool in sorted({record["tool"] for record in records}):
+        tool_records = [record for record in records if record["tool"] == tool]
+        summary = latency_summary([record["latencyMs"] for record in tool_records])
+        # 並列実行時は他のリクエストの呼び出しが混ざるため、呼び出し数は逐次実行時のみ
+        if args.concurrency <= 1:
+            summary["retrieveCallsPerRequest"] = round(
+                sum(record["calls"] for record in tool_records) / len(tool_records), 2
+            )
+        per_tool[tool] = summary
+    
+    return {
+        "revision": git_revision(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "latencyMs": args.latency_ms,
+            "jitterMs": args.jitter_ms,
+            "errorRate": args.error_rate,
+            "resultsPerCall": args.results_per_call,
+            "contentChars": args.content_chars,
+            "seed": args.seed,
+            "noCache": args.no_cache,
+        },
+        "throughputRps": round(len(records) / wall_sec, 2),
+        "latency": latency_summary([record["latencyMs"] for record in records]),
+        "retrieveCalls": client.calls,
+        "retrieveCallsPerRequest": round(client.calls / len(records), 2),
+        "injectedErrors": client.errors,
+        "errorResponses": sum(1 for record in records if record["status"] != 200),
+        "partialResponses": sum(1 for record in records if record["partial"]),
+        "cache": lambda_function.get_cache_stats(),
+        "perTool": per_tool,
+    }
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> None:
+    latency = result["latency"]
+    print(f"リクエスト: {latency['count']}件, 並列数: {result['config']['concurrency']}, "
+          f"リビジョン: {result['revision']}")
+    print(f"スループット: {result['throughputRps']} req/s")
+    print(f"レイテンシ: p50={latency['p50Ms']}ms p95={latency['p95Ms']}ms p99={latency['p99Ms']}ms")
+    print(f"retrieve呼び出し: {result['retrieveCalls']}回（{result['retrieveCallsPerRequest']}回/リクエスト）")
+    print(f"エラー応答: {result['errorResponses']}件, 部分結果: {result['partialResponses']}件, "
+          f"キャッシュヒット率: {result['cache']['hitRate']:.2f}")
+    print(f"\n{'tool':<18}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'calls/req':>11}")
+    for tool, summary in result["perTool"].items():
+        calls = summary.get("retrieveCallsPerRequest", "-")
+        print(f"{tool:<18}{summary['count']:>7}{summary['p50Ms']:>10}{summary['p95Ms']:>10}"
+              f"{summary['p99Ms']:>10}{calls:>11}")
+    
+    if baseline is not None:
+        print(f"\nベースライン（{baseline.get('revision')}）との比較:")
+        for key in ("p50Ms", "p95Ms", "p99Ms"):
+            before = baseline["latency"][key]
+            after = latency[key]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"  {key}: {before} → {after}（{change:+.1f}%）")
+        before = baseline["throughputRps"]
+        change = (result["throughputRps"] - before) / before * 100 if before else 0.0
+        print(f"  throughputRps: {before} → {result['throughputRps']}（{change:+.1f}%）")
+        print(f"  retrieveCallsPerRequest: {baseline['retrieveCallsPerRequest']} → "
+              f"{result['retrieveCallsPerRequest']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline lambda_handler benchmark")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=80.0)
+    parser.add_argument("--jitter-ms", type=float, default=40.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--results-per-call", type=int, default=10)
+    parser.add_argument("--content-chars", type=int, default=800)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-cache", action="store_true", help="検索結果キャッシュを無効にする")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較する以前の結果（JSON）")
+    args = parser.parse_args()
+    
+    import json_codec
+    
+    result = run_benchmark(args)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            baseline = json_codec.loads(f.read())
+    print_report(result, baseline)
+    
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(json_codec.dumps_bytes(result))
+        print(f"\n💾 結果を保存しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
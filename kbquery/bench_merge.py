@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# kbquery/bench_merge.py
+"""
+マージエンジンのマイクロベンチマーク（AWS不要）
+
+10,000件の合成検索結果（サブクエリ5本 × 2,000件）を各戦略でマージし、
+従来の「全件dict化 + 全件ソート」方式とスループットを比較する。
+
+従来方式はソースURI単位で重複除去するためキーの種類が少なく（同じドキュメントの別チャンクを
+1つにまとめてしまう）、チャンク単位の max とは結果が異なる。max の処理時間は従来方式と
+同程度で、高速化ではなく重複判定の正しさのための変更である。
+
+使い方:
+    python bench_merge.py [--results 10000] [--lists 5] [--top-k 5] [--repeat 20]
+"""
+import argparse
+import random
+import time
+from typing import Any, Dict, List
+
+from result_merge import MERGE_STRATEGIES, merge_ranked_lists
+
+
+def make_synthetic_lists(total: int, num_lists: int, seed: int = 42) -> List[List[Dict[str, Any]]]:
+    """サブクエリごとのスコア順結果リストを合成（同じチャンクが複数リストに出る）"""
+    rng = random.Random(seed)
+    per_list = total // num_lists
+    num_docs = max(1, total // 4)
+    lists = []
+    for _ in range(num_lists):
+        results = []
+        for _ in range(per_list):
+            doc = rng.randrange(num_docs)
+            chunk = rng.randrange(4)
+            results.append({
+                "content": f"document {doc} chunk {chunk}",
+                "score": rng.random(),
+                "source": f"s3://bench-bucket/doc-{doc}.md",
+                "chunkId": f"doc-{doc}-chunk-{chunk}",
+            })
+        results.sort(key=lambda r: r["score"], reverse=True)
+        lists.append(results)
+    return lists
+
+
+def legacy_merge(all_results: List[Dict[str, Any]], max_results: int) -> List[Dict[str, Any]]:
+    """従来の merge_results（ソースURIで重複除去し、全件ソート）"""
+    seen: Dict[str, Dict[str, Any]] = {}
+    for result in all_results:
+        source = result.get("source", "")
+        if source not in seen or result.get("score", 0) > seen[source].get("score", 0):
+            seen[source] = result
+    merged = sorted(seen.values(), key=lambda x: x.get("score", 0), reverse=True)
+    return merged[:max_results]
+
+
+def measure(fn, repeat: int) -> float:
+    """repeat回実行した1回あたりの秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="merge engine micro-benchmark")
+    parser.add_argument("--results", type=int, default=10000)
+    parser.add_argument("--lists", type=int, default=5)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    
+    lists = make_synthetic_lists(args.results, args.lists)
+    flat = [r for results in lists for r in results]
+    total = len(flat)
+    
+    print(f"合成結果: {total}件（{args.lists}リスト）, top-k={args.top_k}, repeat={args.repeat}")
+    print(f"{'strategy':<12}{'ms/merge':>12}{'results/sec':>16}")
+    
+    timings = {"legacy": measure(lambda: legacy_merge(flat, args.top_k), args.repeat)}
+    for strategy in MERGE_STRATEGIES:
+        timings[strategy] = measure(
+            lambda: merge_ranked_lists(lists, args.top_k, strategy),
+            args.repeat
+        )
+    
+    for name, seconds in timings.items():
+        print(f"{name:<12}{seconds * 1000:>12.2f}{total / seconds:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# kbquery/bench_query_analyzer.py
+"""
+クエリ解析のベンチマーク（AWS不要）
+
+現実的なクエリのコーパスに対して、従来の処理
+（split_query の3回の re.split + extract_keywords の3回の re.findall
+ + auto_select_kb のキーワードごとの in 判定）と、
+analyze_query による1回の走査 + Aho-Corasick でのルーティングを比較する。
+結果が一致することも確認する。
+
+使い方:
+    python bench_query_analyzer.py [--repeat 2000]
+
+※ lambda_function を読み込むため boto3 が必要
+"""
+import argparse
+import re
+import time
+from typing import Dict, List
+
+from kb_config import KNOWLEDGE_BASES, list_available_kbs
+from lambda_function import (
+    QUERY_SPLIT_THRESHOLD,
+    SUBQUERY_OVERLAP_THRESHOLD,
+    analyze_query,
+    rank_kbs,
+)
+from query_fingerprint import char_ngrams, normalize_text
+
+
+CORPUS = [
+    "認証機能の使い方",
+    "ログイン方法について教えて",
+    "パスワードを忘れた場合の手順は？",
+    "よくある質問を見たい",
+    "サンプルドキュメントの例を教えてください",
+    "LoginAPI のエラーコード AUTH_401 が出ます",
+    "「シングルサインオン」の設定方法",
+    "認証機能の使い方について教えてください。ログインAPIのエラーコードは何ですか？"
+    "パスワードリセットの手順を知りたいです。また、SAMLの設定方法も教えて",
+    "多要素認証（MFA）について、設定手順と、そしてリカバリーコードの扱いに関して詳しく知りたいです。"
+    "管理者向けマニュアルはありますか？",
+    "OAuthトークンの有効期限を変更したい。リフレッシュトークンについても知りたい。"
+    "また、APIゲートウェイ経由で呼び出す場合の注意点は？",
+    "FAQに載っているサンプルコードが動きません。エラーメッセージは「InvalidSignature」です",
+    "パスワードポリシーの設定について",
+    "ユーザー登録からログインまでの流れ、そして退会手順についてまとめて教えてほしいです。"
+    "スクリーンショット付きのドキュメントがあれば助かります",
+]
+
+
+def legacy_is_redundant_fragment(fragment: str, kept: List[str]) -> bool:
+    """従来の冗長判定（比較のたびに正規化し直す）"""
+    normalized = normalize_text(fragment)
+    grams = char_ngrams(normalized)
+    for other in kept:
+        other_normalized = normalize_text(other)
+        if normalized in other_normalized:
+            return True
+        other_grams = char_ngrams(other_normalized)
+        union = grams | other_grams
+        if union and len(grams & other_grams) / len(union) >= SUBQUERY_OVERLAP_THRESHOLD:
+            return True
+    return False
+
+
+def legacy_split_query(query: str) -> List[str]:
+    """従来の split_query（パターンごとに re.split を繰り返す）"""
+    if len(query) < QUERY_SPLIT_THRESHOLD:
+        return [query]
+    patterns = [
+        r'[。！？\n]',
+        r'(?:、また|、そして)',
+        r'(?:について|に関して)',
+    ]
+    sub_queries = [query]
+    for pattern in patterns:
+        new_queries = []
+        for q in sub_queries:
+            parts = re.split(pattern, q)
+            new_queries.extend([p.strip() for p in parts if p.strip()])
+        sub_queries = new_queries
+    candidates = list(dict.fromkeys(q for q in sub_queries if len(q) >= 5))
+    kept: List[str] = []
+    for fragment in sorted(candidates, key=len, reverse=True):
+        if not legacy_is_redundant_fragment(fragment, kept):
+            kept.append(fragment)
+    kept_set = set(kept)
+    sub_queries = [q for q in candidates if q in kept_set]
+    return sub_queries if len(sub_queries) > 1 else [query]
+
+
+def legacy_extract_keywords(query: str) -> List[str]:
+    """従来の extract_keywords（3回の re.findall）"""
+    keywords = []
+    keywords.extend(re.findall(r'[A-Za-z][A-Za-z0-9_]{2,}', query))
+    keywords.extend(re.findall(r'[ァ-ヶー]{3,}', query))
+    keywords.extend(re.findall(r'[「『\(]([^」』\)]+)[」』\)]', query))
+    return list(dict.fromkeys(keywords))
+
+
+def legacy_rank_kbs(query: str) -> List:
+    """従来の auto_select_kb のキーワード判定（KB × キーワードの in 判定）"""
+    query_lower = query.lower()
+    ranked = []
+    for kb in list_available_kbs():
+        keywords = KNOWLEDGE_BASES[kb["name"]].get("routing_terms", {})
+        score = sum(weight for kw, weight in keywords.items() if kw in query_lower)
+        if kb["description"].lower() in query_lower:
+            score += 2
+        ranked.append((kb["name"], score))
+    return sorted(ranked, key=lambda x: x[1], reverse=True)
+
+
+def legacy_pipeline(query: str) -> Dict:
+    return {
+        "subQueries": legacy_split_query(query),
+        "keywords": legacy_extract_keywords(query),
+        "ranking": legacy_rank_kbs(query),
+    }
+
+
+def analyzer_pipeline(query: str) -> Dict:
+    analysis = analyze_query(query)
+    return {
+        "subQueries": analysis.sub_queries(),
+        "keywords": analysis.keywords,
+        "ranking": rank_kbs(query, analysis),
+    }
+
+
+def measure(fn, repeat: int) -> float:
+    """コーパス全体をrepeat回処理した1クエリあたりの秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in CORPUS:
+            fn(query)
+    return (time.perf_counter() - start) / (repeat * len(CORPUS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query analyzer benchmark")
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+    
+    mismatches = [q for q in CORPUS if legacy_pipeline(q) != analyzer_pipeline(q)]
+    print(f"コーパス: {len(CORPUS)}クエリ, 結果の不一致: {len(mismatches)}件")
+    for query in mismatches:
+        print(f"  不一致: {query}")
+        print(f"    従来: {legacy_pipeline(query)}")
+        print(f"    新規: {analyzer_pipeline(query)}")
+    
+    legacy = measure(legacy_pipeline, args.repeat)
+    analyzer = measure(analyzer_pipeline, args.repeat)
+    print(f"{'pipeline':<12}{'us/query':>12}{'queries/sec':>16}")
+    print(f"{'legacy':<12}{legacy * 1e6:>12.1f}{1 / legacy:>16,.0f}")
+    print(f"{'analyzer':<12}{analyzer * 1e6:>12.1f}{1 / analyzer:>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
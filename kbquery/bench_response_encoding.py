@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# kbquery/bench_response_encoding.py
+"""
+Lambda → Gateway → エージェント間のエンコード/デコードのベンチマーク（AWS不要）
+
+大きな検索結果（日本語チャンク）について、次の2つの経路のCPU時間とサイズを比較する。
+
+- proxy: lambda_handler が body をJSON文字列にし、Lambdaランタイムが全体を再度JSONにする。
+  エージェントは MCP レスポンス → Lambda出力 → body の順にパースする
+- native: lambda_handler が出力をそのまま返し、Lambdaランタイムが1回だけJSONにする。
+  エージェントは MCP レスポンスをパースし、日本語が \\uXXXX にエスケープされていれば
+  1回だけ復元する（agentcore/main.py の unwrap_lambda_response と同じ処理）
+
+Lambdaランタイム・Gatewayのシリアライズは json.dumps（ensure_ascii=True）で近似する。
+
+使い方:
+    python bench_response_encoding.py [--results 50] [--chars 2000] [--repeat 50]
+"""
+import argparse
+import json
+import random
+import time
+from typing import Any, Dict
+
+
+def make_output(num_results: int, chars: int, seed: int = 42) -> Dict[str, Any]:
+    """kb_search の出力に近い合成データ（改行・引用符を含む日本語本文）"""
+    rng = random.Random(seed)
+    words = ["認証", "ログイン", "パスワード", "設定", "「SAML」", "\"API\"", "手順\n", "エラー"]
+    results = []
+    for i in range(num_results):
+        content = "".join(rng.choice(words) for _ in range(chars // 3))[:chars]
+        results.append({
+            "content": content,
+            "score": rng.random(),
+            "source": f"s3://bench-bucket/doc-{i}.md",
+            "chunkId": f"chunk-{i}",
+        })
+    return {"kbName": "product_docs", "query": "認証の設定", "results": results, "count": num_results}
+
+
+def mcp_wrap(lambda_payload: Any) -> str:
+    """Lambdaの戻り値をランタイムがJSONにし、GatewayがMCPの text に入れる"""
+    text = json.dumps(lambda_payload)
+    return json.dumps({"jsonrpc": "2.0", "id": 1, "result": {"content": [{"type": "text", "text": text}]}})
+
+
+def proxy_path(output: Dict[str, Any]) -> str:
+    lambda_payload = {"statusCode": 200, "body": json.dumps(output, ensure_ascii=False)}
+    wire = mcp_wrap(lambda_payload)
+    text = json.loads(wire)["result"]["content"][0]["text"]
+    return json.loads(text)["body"]
+
+
+def native_path(output: Dict[str, Any]) -> str:
+    wire = mcp_wrap(output)
+    text = json.loads(wire)["result"]["content"][0]["text"]
+    if "\\u" not in text:
+        return text
+    return json.dumps(json.loads(text), ensure_ascii=False)
+
+
+def measure(fn, repeat: int) -> float:
+    """repeat回実行した1回あたりの秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="response encoding benchmark")
+    parser.add_argument("--results", type=int, default=50)
+    parser.add_argument("--chars", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+    
+    output = make_output(args.results, args.chars)
+    # どちらの経路でもエージェントが受け取る内容は同じ
+    assert json.loads(proxy_path(output)) == json.loads(native_path(output))
+    
+    print(f"合成結果: {args.results}件 × {args.chars}文字, repeat={args.repeat}")
+    print(f"{'mode':<10}{'ms/call':>10}{'wire bytes':>14}{'agent bytes':>14}")
+    for name, fn, payload in [
+        ("proxy", proxy_path, {"statusCode": 200, "body": json.dumps(output, ensure_ascii=False)}),
+        ("native", native_path, output),
+    ]:
+        seconds = measure(lambda: fn(output), args.repeat)
+        wire_bytes = len(mcp_wrap(payload).encode("utf-8"))
+        agent_bytes = len(fn(output).encode("utf-8"))
+        print(f"{name:<10}{seconds * 1000:>10.2f}{wire_bytes:>14,}{agent_bytes:>14,}")
+
+
+if __name__ == "__main__":
+    main()
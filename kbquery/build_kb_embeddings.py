@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# kbquery/build_kb_embeddings.py
+"""
+埋め込みルーター用のKB重心インデックスを作成（オフラインで実行）
+
+kb_config.KNOWLEDGE_BASES の説明文・sample_queries・routing_terms から
+kb_centroids.npy / kb_centroids.json を作成する。
+kb_config を変更したら再実行してからパッケージングすること。
+
+使い方:
+    python build_kb_embeddings.py [--output kb_centroids.npy]
+"""
+import argparse
+
+from embedding_router import INDEX_PATH, build_centroids, save_index
+from kb_config import KB_REGISTRY
+
+
+def main():
+    parser = argparse.ArgumentParser(description="build KB centroid index")
+    parser.add_argument("--output", default=INDEX_PATH)
+    args = parser.parse_args()
+    
+    names, centroids = build_centroids(KB_REGISTRY)
+    save_index(args.output, names, centroids)
+    print(f"✅ {len(names)}件のKBのインデックスを作成しました: {args.output} {centroids.shape}")
+
+
+if __name__ == "__main__":
+    main()
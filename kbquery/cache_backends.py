@@ -0,0 +1,309 @@
+# kbquery/cache_backends.py
+"""
+検索結果キャッシュのバックエンド
+
+- MemoryCacheBackend: コンテナ内のTTL付きLRUキャッシュ
+- FileCacheBackend: キーごとに1ファイルで保存（EFSなどの共有ディレクトリに置けば複数コンテナで共有できる）
+- SqliteCacheBackend: /tmp のSQLiteファイルに保存（同じホストのプロセス間のみ、複数コンテナでは共有しない）
+
+どちらもAWSに依存しないため、ローカルでそのままテストできる。
+"""
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import json_codec
+
+
+# キャッシュの設定
+CACHE_BACKEND = os.environ.get("KB_CACHE_BACKEND", "memory")
+CACHE_PATH = os.environ.get("KB_CACHE_PATH", "/tmp/kbquery_cache.sqlite3")
+CACHE_DIR = os.environ.get("KB_CACHE_DIR", "/tmp/kbquery_cache")
+CACHE_MAX_ENTRIES = int(os.environ.get("KB_CACHE_MAX_ENTRIES", "256"))
+
+
+def serialize_results(results: List[Dict[str, Any]]) -> bytes:
+    """検索結果をコンパクトなバイト列に変換（区切り文字なしJSON + zlib圧縮）"""
+    return zlib.compress(json_codec.dumps_bytes(results))
+
+
+def deserialize_results(payload: bytes) -> List[Dict[str, Any]]:
+    """serialize_results の逆変換"""
+    return json_codec.loads(zlib.decompress(payload))
+
+
+class CacheBackend:
+    """
+    キャッシュバックエンドの共通インターフェース
+    
+    キーは文字列、値は検索結果（dictのリスト）。
+    """
+    
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """キャッシュから取得（なければ / 期限切れならNone）"""
+        raise NotImplementedError
+    
+    def put(self, key: str, results: List[Dict[str, Any]], ttl: float) -> None:
+        """キャッシュに保存（ttl秒後に期限切れ）"""
+        raise NotImplementedError
+    
+    def clear(self) -> None:
+        """全エントリを削除"""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    プロセス内のTTL付きLRUキャッシュ
+    
+    - エントリごとに有効期限を持ち、期限切れは参照時に破棄
+    - 上限件数を超えたら最も古く参照されたエントリから削除
+    """
+    
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[Dict[str, Any], ...]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, results = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return list(results)
+    
+    def put(self, key: str, results: List[Dict[str, Any]], ttl: float) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, tuple(results))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+class FileCacheBackend(CacheBackend):
+    """
+    キーごとに1ファイルで保存するキャッシュ
+    
+    directory を EFS のマウント先にすれば、複数のコンテナで同じキャッシュを共有できる。
+    ロックは使わず、同じディレクトリの一時ファイルに書いてから os.replace で置き換える
+    （NFSでもリネームは原子的なので、読み手が書きかけのファイルを読むことはない）。
+    同じキーへの同時書き込みは後から置き換えた方が残る。
+    
+    ファイルの先頭8バイトが有効期限（壁時計、time.time）、残りが serialize_results の値。
+    最終参照時刻はファイルの更新時刻で管理し、上限件数を超えたら古いものから削除する。
+    """
+    
+    _HEADER = struct.Struct("<d")
+    
+    def __init__(self, directory: str = CACHE_DIR, max_entries: int = CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+    
+    def _path(self, key: str) -> str:
+        name = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, name + ".cache")
+    
+    def _entries(self) -> List[os.DirEntry]:
+        """キャッシュファイルの一覧（書き込み中の一時ファイルは除く）"""
+        with os.scandir(self.directory) as entries:
+            return [entry for entry in entries if entry.name.endswith(".cache")]
+    
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        (expires_at,) = self._HEADER.unpack_from(data)
+        now = time.time()
+        if expires_at <= now:
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass  # 他のコンテナが削除・置き換えた場合は参照時刻を更新しない
+        return deserialize_results(data[self._HEADER.size:])
+    
+    def put(self, key: str, results: List[Dict[str, Any]], ttl: float) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        now = time.time()
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._HEADER.pack(now + ttl))
+            f.write(serialize_results(results))
+        os.utime(tmp_path, (now, now))
+        os.replace(tmp_path, path)
+        self._evict(now)
+    
+    def _evict(self, now: float) -> None:
+        """上限を超えていれば、期限切れと参照時刻の古いものを削除"""
+        entries = self._entries()
+        if len(entries) <= self.max_entries:
+            return
+        mtimes = []
+        for entry in entries:
+            try:
+                mtimes.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+        mtimes.sort(reverse=True)
+        for _, path in mtimes[self.max_entries:]:
+            self._remove(path)
+    
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # 他のコンテナが先に削除した
+    
+    def clear(self) -> None:
+        for entry in self._entries():
+            self._remove(entry.path)
+    
+    def __len__(self) -> int:
+        return len(self._entries())
+
+
+class SqliteCacheBackend(CacheBackend):
+    """
+    SQLiteファイルに保存するキャッシュ
+    
+    同じホスト上のプロセス間で共有できるが、/tmp はコンテナごとに別なので他のコンテナとは共有されない。
+    WALモードは共有メモリを使い、EFS などのネットワークファイルシステムでは正しく動かないため、
+    複数コンテナで共有する場合は FileCacheBackend を使うこと。
+    有効期限は壁時計（time.time）で管理し、値は serialize_results で圧縮して保存する。
+    上限件数を超えたら最後に参照された時刻が古いものから削除する。
+    """
+    
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # memory バックエンドでは使わないので、起動時には読み込まない
+        import sqlite3
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS retrieval_cache ("
+            " key TEXT PRIMARY KEY,"
+            " expires_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " payload BLOB NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS retrieval_cache_accessed ON retrieval_cache (accessed_at)"
+        )
+    
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, payload FROM retrieval_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            expires_at, payload = row
+            if expires_at <= now:
+                self._conn.execute("DELETE FROM retrieval_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE retrieval_cache SET accessed_at = ? WHERE key = ?",
+                (now, key)
+            )
+        return deserialize_results(payload)
+    
+    def put(self, key: str, results: List[Dict[str, Any]], ttl: float) -> None:
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        now = time.time()
+        payload = serialize_results(results)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO retrieval_cache (key, expires_at, accessed_at, payload)"
+                " VALUES (?, ?, ?, ?)",
+                (key, now + ttl, now, payload)
+            )
+            self._evict(now)
+    
+    def _evict(self, now: float) -> None:
+        """期限切れと上限超過分を削除"""
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM retrieval_cache").fetchone()
+        if count <= self.max_entries:
+            return
+        self._conn.execute("DELETE FROM retrieval_cache WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM retrieval_cache WHERE key IN ("
+            " SELECT key FROM retrieval_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM retrieval_cache")
+    
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM retrieval_cache").fetchone()
+            return count
+    
+    def close(self) -> None:
+        """DB接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+
+def create_cache_backend(
+    backend: str = CACHE_BACKEND,
+    path: str = CACHE_PATH,
+    max_entries: int = CACHE_MAX_ENTRIES,
+    directory: str = CACHE_DIR
+) -> CacheBackend:
+    """
+    設定名からキャッシュバックエンドを作成
+    
+    Args:
+        backend: "memory" / "file" / "sqlite"
+        path: SQLiteファイルのパス（sqliteのみ）
+        max_entries: 保持する最大件数
+        directory: キャッシュファイルを置くディレクトリ（fileのみ）
+    """
+    if backend == "memory":
+        return MemoryCacheBackend(max_entries=max_entries)
+    if backend == "file":
+        return FileCacheBackend(directory=directory, max_entries=max_entries)
+    if backend == "sqlite":
+        return SqliteCacheBackend(path=path, max_entries=max_entries)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,147 @@
+# kbquery/embedding_router.py
+"""
+埋め込みベクトルによるナレッジベースのルーティング（オプション）
+
+KBの説明文・サンプルクエリ・ルーティング用キーワードを、文字n-gramのハッシュベクトル
+（外部モデル不要）で埋め込み、KBごとの重心ベクトルを行列として事前計算しておく。
+実行時はクエリを同じ方法でベクトル化し、行列との内積（コサイン類似度）でKBを順位付けする。
+
+- 事前計算: python build_kb_embeddings.py（kb_centroids.npy / kb_centroids.json を出力）
+- 実行時: np.load(..., mmap_mode="r") で読み込むため、コールドスタートへの影響は小さい
+- numpy がない環境やインデックスファイルがない場合は無効（load_embedding_router が None を返す）
+"""
+import json
+import os
+import zlib
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from query_fingerprint import normalize_text
+from structured_log import StructuredLogger
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None  # type: ignore
+    NUMPY_AVAILABLE = False
+
+logger = StructuredLogger("kbquery.embedding_router")
+
+
+# ハッシュベクトルの次元数と文字n-gramの長さ
+EMBEDDING_DIM = 512
+NGRAM_SIZES = (2, 3)
+
+# インデックスファイル（Lambdaパッケージに同梱する）
+INDEX_PATH = os.environ.get(
+    "KB_EMBEDDING_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb_centroids.npy")
+)
+
+
+def _metadata_path(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + ".json"
+
+
+def hashed_ngram_indices(text: str, dim: int = EMBEDDING_DIM) -> List[int]:
+    """正規化したテキストの文字n-gramを、次元数内のインデックスにハッシュ"""
+    normalized = normalize_text(text)
+    indices = []
+    for n in NGRAM_SIZES:
+        if len(normalized) < n:
+            continue
+        for i in range(len(normalized) - n + 1):
+            indices.append(zlib.crc32(normalized[i:i + n].encode("utf-8")) % dim)
+    return indices
+
+
+def encode(texts: Sequence[str], dim: int = EMBEDDING_DIM) -> "np.ndarray":
+    """テキストをL2正規化したハッシュn-gramベクトル（float32の行列）に変換"""
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        indices = hashed_ngram_indices(text, dim)
+        if indices:
+            matrix[row] = np.bincount(indices, minlength=dim)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def kb_training_texts(config: Mapping[str, Any]) -> List[str]:
+    """KB設定から埋め込みに使うテキスト（説明文・サンプルクエリ・キーワード）を集める"""
+    texts = [str(config.get("description", ""))]
+    texts.extend(config.get("sample_queries", []))
+    texts.extend(config.get("routing_terms", []))
+    return [text for text in texts if text]
+
+
+def build_centroids(
+    knowledge_bases: Mapping[str, Mapping[str, Any]],
+    dim: int = EMBEDDING_DIM
+) -> Tuple[List[str], "np.ndarray"]:
+    """KBごとの重心ベクトル行列を計算（行の順序は返り値のKB名リストと同じ）"""
+    names = list(knowledge_bases)
+    centroids = np.zeros((len(names), dim), dtype=np.float32)
+    for row, name in enumerate(names):
+        vectors = encode(kb_training_texts(knowledge_bases[name]), dim)
+        if len(vectors):
+            centroids[row] = vectors.mean(axis=0)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    return names, centroids / np.maximum(norms, 1e-12)
+
+
+def save_index(path: str, names: List[str], centroids: "np.ndarray") -> None:
+    """重心行列（.npy）とメタデータ（.json）を保存"""
+    np.save(path, centroids.astype(np.float32))
+    with open(_metadata_path(path), "w", encoding="utf-8") as f:
+        json.dump(
+            {"kbNames": names, "dim": int(centroids.shape[1]), "ngramSizes": list(NGRAM_SIZES)},
+            f,
+            ensure_ascii=False,
+            indent=2
+        )
+
+
+class EmbeddingRouter:
+    """
+    重心ベクトル行列とクエリベクトルの内積でKBを順位付けする
+    """
+    
+    def __init__(self, kb_names: List[str], centroids: "np.ndarray"):
+        if centroids.shape[0] != len(kb_names):
+            raise ValueError("centroid rows must match kb_names")
+        self.kb_names = kb_names
+        self.centroids = centroids
+        self.dim = int(centroids.shape[1])
+    
+    @classmethod
+    def load(cls, path: str = INDEX_PATH) -> "EmbeddingRouter":
+        """保存済みインデックスをmmapで読み込む"""
+        with open(_metadata_path(path), encoding="utf-8") as f:
+            metadata = json.load(f)
+        centroids = np.load(path, mmap_mode="r")
+        return cls(metadata["kbNames"], centroids)
+    
+    def similarities(self, query: str) -> Dict[str, float]:
+        """KB名 → クエリとのコサイン類似度"""
+        scores = self.centroids @ encode([query], self.dim)[0]
+        return {name: float(score) for name, score in zip(self.kb_names, scores)}
+    
+    def rank(self, query: str, top_n: Optional[int] = None) -> List[Tuple[str, float]]:
+        """類似度の高い順に (KB名, 類似度) を返す"""
+        ranked = sorted(self.similarities(query).items(), key=lambda x: x[1], reverse=True)
+        return ranked[:top_n] if top_n is not None else ranked
+
+
+def load_embedding_router(path: str = INDEX_PATH) -> Optional[EmbeddingRouter]:
+    """
+    インデックスを読み込んでルーターを作成
+    
+    numpy がない場合やインデックスファイルがない場合は None を返す。
+    """
+    if not NUMPY_AVAILABLE:
+        logger.warning("numpy not available, embedding router disabled")
+        return None
+    if not os.path.exists(path) or not os.path.exists(_metadata_path(path)):
+        logger.warning("embedding index not found", path=path)
+        return None
+    return EmbeddingRouter.load(path)
@@ -0,0 +1,118 @@
+# kbquery/emf_metrics.py
+"""
+段階ごとの処理時間の計測と CloudWatch Embedded Metric Format（EMF）での出力
+
+StageTimer で段階（analyze / retrieve / merge / shape / serialize など）ごとの時間を記録し、
+emit_emf で1行のEMF（JSON）として標準出力に書く。Lambdaのログに出すだけで
+CloudWatch メトリクスになるため、PutMetricData の呼び出しは不要。
+
+メトリクス名は「段階名（先頭大文字）+ Latency」。同じ段階を複数回計測した場合
+（サブクエリごとの retrieve など）は値の配列として出力する。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional
+
+import json_codec
+
+
+# メトリクスの名前空間と有効/無効
+METRICS_NAMESPACE = os.environ.get("KB_METRICS_NAMESPACE", "KBQuery")
+METRICS_ENABLED = os.environ.get("KB_METRICS_ENABLED", "true").lower() == "true"
+
+
+class StageTimer:
+    """
+    段階ごとの処理時間（ミリ秒）を記録する（スレッドセーフ）
+    
+    サブクエリを並列実行するスレッドから同じインスタンスに記録できる。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, List[float]] = {}
+        self._counts: Dict[str, int] = {}
+    
+    def record(self, stage: str, elapsed_ms: float) -> None:
+        with self._lock:
+            self._samples.setdefault(stage, []).append(round(elapsed_ms, 3))
+    
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + value
+    
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """ブロックの処理時間を記録"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, (time.perf_counter() - start) * 1000)
+    
+    def samples(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {stage: list(values) for stage, values in self._samples.items()}
+    
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+    
+    def summary(self) -> Dict[str, Any]:
+        """レスポンスの timings 用（段階ごとの合計ミリ秒と、複数回なら回数・最大値）"""
+        summary: Dict[str, Any] = {}
+        for stage, values in self.samples().items():
+            if len(values) == 1:
+                summary[stage] = values[0]
+            else:
+                summary[stage] = {
+                    "totalMs": round(sum(values), 3),
+                    "maxMs": max(values),
+                    "count": len(values),
+                }
+        return summary
+
+
+def metric_name(stage: str) -> str:
+    """段階名をメトリクス名に変換（retrieve → RetrieveLatency）"""
+    return "".join(part.capitalize() for part in stage.split("_")) + "Latency"
+
+
+def build_emf(
+    timer: StageTimer,
+    dimensions: Mapping[str, str],
+    namespace: str = METRICS_NAMESPACE,
+    timestamp_ms: Optional[int] = None
+) -> Dict[str, Any]:
+    """StageTimer の内容からEMFのレコードを作成"""
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    
+    record: Dict[str, Any] = dict(dimensions)
+    metrics = []
+    for stage, values in timer.samples().items():
+        name = metric_name(stage)
+        record[name] = values[0] if len(values) == 1 else values
+        metrics.append({"Name": name, "Unit": "Milliseconds"})
+    for name, value in timer.counts().items():
+        record[name] = value
+        metrics.append({"Name": name, "Unit": "Count"})
+    
+    record["_aws"] = {
+        "Timestamp": timestamp_ms,
+        "CloudWatchMetrics": [{
+            "Namespace": namespace,
+            "Dimensions": [list(dimensions)],
+            "Metrics": metrics,
+        }],
+    }
+    return record
+
+
+def emit_emf(timer: StageTimer, dimensions: Mapping[str, str]) -> None:
+    """EMFのレコードを1行で標準出力に書く（KB_METRICS_ENABLED=false なら何もしない）"""
+    if not METRICS_ENABLED:
+        return
+    print(json_codec.dumps(build_emf(timer, dimensions)))
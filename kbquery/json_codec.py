@@ -0,0 +1,68 @@
+# kbquery/json_codec.py
+"""
+JSONのシリアライズ/デシリアライズ（kbquery と agentcore で共通）
+
+KB_JSON_ORJSON=true かつ orjson がインストールされていれば orjson を使い、それ以外は標準の json モジュールで
+区切り文字なし（separators=(",", ":")）・非ASCII文字をエスケープしない形式で出力する。
+どちらでも出力は UTF-8 のJSONで、日本語は \\uXXXX にしない。
+
+orjson は import だけでコールドスタートが数ミリ秒延び、検索結果程度のペイロードでは
+標準の json より速くならない（bench_json_codec.py）ため、既定では使わない。
+有効にした場合も、読み込むのは初回のシリアライズ時。
+
+agentcore/ には同じ内容のコピーをコミットしている（正本は kbquery/json_codec.py、deploy.ps1 で同期）。
+"""
+import json
+import os
+from typing import Any, Optional, Union
+
+# orjson を使うか（既定は使わない）
+ORJSON_ENABLED = os.environ.get("KB_JSON_ORJSON", "false").lower() == "true"
+
+_COMPACT_SEPARATORS = (",", ":")
+
+_orjson: Optional[Any] = None
+_orjson_loaded = False
+
+
+def _get_orjson() -> Optional[Any]:
+    """orjson を初回使用時に読み込む（無効・未インストールなら None）"""
+    global _orjson, _orjson_loaded
+    if not _orjson_loaded:
+        if ORJSON_ENABLED:
+            try:
+                import orjson
+                _orjson = orjson
+            except ImportError:
+                pass
+        _orjson_loaded = True
+    return _orjson
+
+
+def backend_name() -> str:
+    """実際に使うエンコーダーの名前（orjson / compact）"""
+    return "orjson" if _get_orjson() is not None else "compact"
+
+
+def dumps_bytes(obj: Any) -> bytes:
+    """オブジェクトをUTF-8のJSONバイト列に変換"""
+    orjson = _get_orjson()
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=_COMPACT_SEPARATORS).encode("utf-8")
+
+
+def dumps(obj: Any) -> str:
+    """オブジェクトをJSON文字列に変換"""
+    orjson = _get_orjson()
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=_COMPACT_SEPARATORS)
+
+
+def loads(data: Union[str, bytes, bytearray]) -> Any:
+    """JSON文字列またはバイト列をオブジェクトに変換"""
+    orjson = _get_orjson()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -3,6 +3,7 @@
 ナレッジベース設定
 ここにKBのIDと説明を追加していく
 """
+from kb_registry import KBRegistry, KnowledgeBase, load_registry
 
 # ナレッジベース定義
 # key: 呼び出し時に使う名前
@@ -10,36 +11,92 @@
 # description: 何が入っているかの説明
 # rerank: リランキングを有効にするか
 # rerank_model: リランキングモデル（AMAZON or COHERE）
+# cache_ttl: 検索結果キャッシュの有効期間（秒、0で無効。省略時は KB_CACHE_TTL_SEC）
+# merge_strategy: サブクエリ結果のマージ方法（max / rrf / weighted、省略時は max）
+#   weighted はサブクエリの文字数に比例した重みでスコアを合算する
+# max_sub_queries: 1回の検索で発行するサブクエリの最大数（省略時は KB_MAX_SUB_QUERIES）
+# early_stop: 上位結果が安定したら残りのサブクエリを発行しない（省略時は False）
+# early_stop_patience: 停止に必要な「上位が変化しない応答」の連続回数（省略時は 1）
+# early_stop_margin: 停止に必要なk位とk+1位のスコア差（省略時は 0.0）
+# routing_terms: KB自動選択用のキーワードと重み（{キーワード: 重み}、リストなら重み1）
+# description_weight: 説明文がクエリに含まれていた場合の重み（省略時は 2）
+# keyword_rescore: 取得後にキーワードのBM25スコアで並べ直す（省略時は False）
+# keyword_weight: 再スコアリング時のBM25スコアの重み（省略時は KB_KEYWORD_WEIGHT）
+# retrieval_weight: 再スコアリング時の検索スコアの重み（省略時は KB_RETRIEVAL_WEIGHT）
+# content_mode: 本文の返し方（full / truncate / snippet、省略時は KB_CONTENT_MODE）
+# max_chars_per_result: 1結果あたりの最大文字数（0で無制限、省略時は KB_MAX_CHARS_PER_RESULT）
+# max_response_bytes: 結果本文の合計最大バイト数（0で無制限、省略時は KB_MAX_RESPONSE_BYTES）
+# retry_max_attempts: retrieveの最大試行回数（省略時は KB_RETRY_MAX_ATTEMPTS）
+# breaker_failure_threshold: サーキットブレーカーが開く連続失敗数（0で無効、省略時は KB_BREAKER_FAILURE_THRESHOLD）
+# breaker_reset_sec: ブレーカーが開いてから再試行するまでの秒数（省略時は KB_BREAKER_RESET_SEC）
+# hedge: 応答が遅いときに同じretrieveをもう1本発行する（省略時は False）
+# hedge_delay_ms: ヘッジを発行するまでの時間（省略時は直近の応答時間のp95）
+# rate_limit_rps: retrieveの1秒あたりの上限（サブクエリ・再試行を含む、0で無効、省略時は KB_RATE_LIMIT_RPS）
+# rate_limit_burst: 瞬間的に許容するretrieve数（省略時は KB_RATE_LIMIT_BURST、0なら rate_limit_rps と同じ）
+# rate_limit_max_wait_ms: 上限に達したときに待つ最大時間。超える場合は429を返す（省略時は KB_RATE_LIMIT_MAX_WAIT_MS）
+# sample_queries: 埋め込みルーター用の代表的な質問例（build_kb_embeddings.py で使用）
+#
+# 読み込み時に kb_registry で検証する。未知のキー・型や範囲の誤りがあると KBConfigError で起動に失敗する
 KNOWLEDGE_BASES: dict[str, dict] = {
     "product_docs": {
         "id": "JEBUX7Q8QN",
         "description": "認証機能マニュアル",
         "rerank": True,
         "rerank_model": "AMAZON",
+        "cache_ttl": 300,
+        "routing_terms": {
+            "認証": 1,
+            "ログイン": 1,
+            "パスワード": 1,
+            "auth": 1,
+            "login": 1,
+            "マニュアル": 1,
+            "使い方": 1,
+        },
+        "sample_queries": [
+            "ログインできない場合の対処方法",
+            "パスワードをリセットする手順",
+            "二要素認証の設定方法",
+        ],
     },
     "faq": {
         "id": "2I5CHITSB5",
         "description": "サンプルドキュメント",
         "rerank": True,
         "rerank_model": "AMAZON",
+        "cache_ttl": 600,
+        "routing_terms": {
+            "よくある質問": 1,
+            "faq": 1,
+            "サンプル": 1,
+            "例": 1,
+            "ドキュメント": 1,
+        },
+        "sample_queries": [
+            "よくある質問の一覧",
+            "サンプルドキュメントの内容",
+        ],
     },
     # "internal_wiki": {
     #     "id": "ZZZZZZZZZZ",  # 実際のKB IDに置き換え
     #     "description": "社内Wiki・ナレッジ",
     #     "rerank": False,
     #     "rerank_model": None,
+    #     "cache_ttl": 0,
+    #     "routing_terms": {"社内": 1, "wiki": 2, "規程": 1},
     # },
 }
 
 
-def get_kb_config(kb_name: str) -> dict | None:
-    """指定した名前のKB設定を取得"""
-    return KNOWLEDGE_BASES.get(kb_name)
+# 検証済み・変更不可のKBレジストリ（import 時に1回だけ構築する。設定に誤りがあればここで失敗する）
+KB_REGISTRY: KBRegistry = load_registry(KNOWLEDGE_BASES)
+
+
+def get_kb_config(kb_name: str) -> KnowledgeBase | None:
+    """指定した名前のKB設定を取得（変更不可）"""
+    return KB_REGISTRY.get(kb_name)
 
 
 def list_available_kbs() -> list[dict]:
     """利用可能なKB一覧を取得（呼び出し元が選択用に使う）"""
-    return [
-        {"name": name, "description": config["description"]}
-        for name, config in KNOWLEDGE_BASES.items()
-    ]
+    return KB_REGISTRY.list_available()
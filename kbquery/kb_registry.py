@@ -0,0 +1,297 @@
+# kbquery/kb_registry.py
+"""
+検証済み・変更不可のナレッジベースレジストリ
+
+kb_config.KNOWLEDGE_BASES（編集用の辞書）からコンテナ起動時に1回だけ構築する。
+
+- 読み込み時に全KBの設定を検証し、誤り（未知のキー・型・範囲）があれば KBConfigError で
+  起動を失敗させる（リクエストの途中で失敗しないようにする）
+- KnowledgeBase は変更不可（__slots__ + 代入禁止）。ネストした値も読み取り専用にする
+- retrieval config は (max_results, ハイブリッド検索) ごとに1回だけ構築して使い回す
+- list_kbs の応答は構築時に作成し、シリアライズ済みの本文も保持する
+
+KnowledgeBase は Mapping としても読めるので、設定を辞書で受け取る関数（KBRouter, resolve_shaping など）に
+そのまま渡せる。
+"""
+import json
+import os
+import re
+import threading
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import json_codec
+from response_shaping import CONTENT_MODES
+from result_merge import MERGE_STRATEGIES
+
+
+REGION = os.environ.get("AWS_REGION", "ap-northeast-1")
+
+# リランキングモデルのARN（{region} をリージョンに置き換える）
+RERANK_MODEL_ARNS = {
+    "AMAZON": "arn:aws:bedrock:{region}::foundation-model/amazon.rerank-v1:0",
+    "COHERE": "arn:aws:bedrock:{region}::foundation-model/cohere.rerank-v3-5:0",
+}
+
+# KBごとに保持する retrieval config の最大数（max_results の種類がこれを超えたら都度構築する）
+RETRIEVAL_CONFIG_CACHE_SIZE = 32
+
+_KB_ID_PATTERN = re.compile(r"[0-9A-Z]{10}")
+
+
+class KBConfigError(ValueError):
+    """KB設定の誤り（読み込み時に検出する）"""
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _non_negative(value: Any) -> bool:
+    return _is_number(value) and value >= 0
+
+
+def _positive_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 1
+
+
+def _non_negative_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def _routing_terms(value: Any) -> bool:
+    if isinstance(value, Mapping):
+        return all(isinstance(k, str) and k and _non_negative(v) for k, v in value.items())
+    return isinstance(value, (list, tuple)) and all(isinstance(t, str) and t for t in value)
+
+
+def _string_list(value: Any) -> bool:
+    return isinstance(value, (list, tuple)) and all(isinstance(t, str) for t in value)
+
+
+# 任意キーの検証（キー → (検証関数, 期待する値の説明)）。ここにないキーは誤りとして扱う
+OPTIONAL_KEYS: Dict[str, Tuple[Callable[[Any], bool], str]] = {
+    "rerank": (lambda v: isinstance(v, bool), "bool"),
+    "rerank_model": (lambda v: v is None or v in RERANK_MODEL_ARNS, f"one of {sorted(RERANK_MODEL_ARNS)}"),
+    "hybrid": (lambda v: isinstance(v, bool), "bool"),
+    "cache_ttl": (_non_negative, "number >= 0"),
+    "merge_strategy": (lambda v: v in MERGE_STRATEGIES, f"one of {list(MERGE_STRATEGIES)}"),
+    "max_sub_queries": (_positive_int, "int >= 1"),
+    "early_stop": (lambda v: isinstance(v, bool), "bool"),
+    "early_stop_patience": (_positive_int, "int >= 1"),
+    "early_stop_margin": (_non_negative, "number >= 0"),
+    "routing_terms": (_routing_terms, "{term: weight} or [term, ...]"),
+    "description_weight": (_non_negative, "number >= 0"),
+    "keyword_rescore": (lambda v: isinstance(v, bool), "bool"),
+    "keyword_weight": (_non_negative, "number >= 0"),
+    "retrieval_weight": (_non_negative, "number >= 0"),
+    "content_mode": (lambda v: v in CONTENT_MODES, f"one of {list(CONTENT_MODES)}"),
+    "max_chars_per_result": (_non_negative_int, "int >= 0"),
+    "max_response_bytes": (_non_negative_int, "int >= 0"),
+    "retry_max_attempts": (_positive_int, "int >= 1"),
+    "breaker_failure_threshold": (_non_negative_int, "int >= 0"),
+    "breaker_reset_sec": (_non_negative, "number >= 0"),
+    "hedge": (lambda v: isinstance(v, bool), "bool"),
+    "hedge_delay_ms": (lambda v: v is None or _non_negative(v), "number >= 0"),
+    "rate_limit_rps": (_non_negative, "number >= 0"),
+    "rate_limit_burst": (_non_negative, "number >= 0"),
+    "rate_limit_max_wait_ms": (_non_negative, "number >= 0"),
+    "sample_queries": (_string_list, "[str, ...]"),
+}
+
+
+def validate_kb_config(name: str, config: Any) -> List[str]:
+    """1つのKB設定を検証し、誤りの説明を返す（誤りがなければ空リスト）"""
+    if not isinstance(config, Mapping):
+        return [f"{name}: config must be a dict"]
+    errors = []
+    kb_id = config.get("id")
+    if not isinstance(kb_id, str) or not _KB_ID_PATTERN.fullmatch(kb_id):
+        errors.append(f"{name}.id: expected a 10-character knowledge base ID, got {kb_id!r}")
+    description = config.get("description")
+    if not isinstance(description, str) or not description.strip():
+        errors.append(f"{name}.description: expected a non-empty string")
+    for key, value in config.items():
+        if key in ("id", "description"):
+            continue
+        rule = OPTIONAL_KEYS.get(key)
+        if rule is None:
+            errors.append(f"{name}.{key}: unknown setting")
+        elif not rule[0](value):
+            errors.append(f"{name}.{key}: expected {rule[1]}, got {value!r}")
+    return errors
+
+
+def _freeze(value: Any) -> Any:
+    """ネストした値を読み取り専用にする（dict → MappingProxyType、list → tuple）"""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def build_retrieval_config(
+    settings: Mapping[str, Any],
+    max_results: int,
+    use_hybrid: bool = True,
+    region: str = REGION
+) -> Dict[str, Any]:
+    """
+    KB設定からretrieval configを構築
+    リランキング・ハイブリッド検索の設定を自動適用
+    """
+    config: Dict[str, Any] = {
+        "vectorSearchConfiguration": {
+            "numberOfResults": max_results
+        }
+    }
+    
+    # ハイブリッド検索（ベクトル + キーワード）
+    if use_hybrid:
+        config["vectorSearchConfiguration"]["overrideSearchType"] = "HYBRID"
+    
+    # リランキング設定
+    if settings.get("rerank"):
+        rerank_model = settings.get("rerank_model") or "AMAZON"
+        config["vectorSearchConfiguration"]["rerankingConfiguration"] = {
+            "type": "BEDROCK_RERANKING_MODEL",
+            "bedrockRerankingConfiguration": {
+                "modelConfiguration": {
+                    "modelArn": RERANK_MODEL_ARNS[rerank_model].format(region=region)
+                }
+            }
+        }
+    
+    return config
+
+
+class KnowledgeBase(Mapping):
+    """
+    1つのKBの検証済み設定（変更不可）
+    
+    name / id / description は属性で、その他の設定は Mapping として（kb.get("cache_ttl") など）読む。
+    """
+    
+    __slots__ = ("name", "id", "description", "_settings", "_region", "_retrieval_configs", "_lock")
+    
+    def __init__(self, name: str, config: Mapping[str, Any], region: str = REGION):
+        errors = validate_kb_config(name, config)
+        if errors:
+            raise KBConfigError("invalid knowledge base config: " + "; ".join(errors))
+        set_attr = object.__setattr__
+        set_attr(self, "name", name)
+        set_attr(self, "id", config["id"])
+        set_attr(self, "description", config["description"])
+        set_attr(self, "_settings", _freeze(config))
+        set_attr(self, "_region", region)
+        set_attr(self, "_retrieval_configs", {})
+        set_attr(self, "_lock", threading.Lock())
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+    
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+    
+    def __getitem__(self, key: str) -> Any:
+        return self._settings[key]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._settings)
+    
+    def __len__(self) -> int:
+        return len(self._settings)
+    
+    def __repr__(self) -> str:
+        return f"KnowledgeBase(name={self.name!r}, id={self.id!r})"
+    
+    def retrieval_config(self, max_results: int, use_hybrid: bool) -> Tuple[Dict[str, Any], str]:
+        """
+        retrieval config と、その正規化JSON（キャッシュのスコープ用）を返す
+        
+        (max_results, use_hybrid) ごとに1回だけ構築する。返した dict は共有されるので変更しないこと。
+        """
+        key = (max_results, use_hybrid)
+        cached = self._retrieval_configs.get(key)
+        if cached is not None:
+            return cached
+        config = build_retrieval_config(self._settings, max_results, use_hybrid, self._region)
+        cached = (config, json.dumps(config, sort_keys=True, separators=(",", ":")))
+        with self._lock:
+            if len(self._retrieval_configs) < RETRIEVAL_CONFIG_CACHE_SIZE:
+                cached = self._retrieval_configs.setdefault(key, cached)
+        return cached
+
+
+class KBRegistry(Mapping):
+    """
+    KB名 → KnowledgeBase の読み取り専用レジストリ
+    
+    list_kbs の応答（list_kbs_payload）とシリアライズ済みの本文（list_kbs_body）を保持する。
+    """
+    
+    __slots__ = ("_entries", "region", "list_kbs_payload", "list_kbs_body")
+    
+    def __init__(self, entries: Mapping[str, KnowledgeBase], region: str = REGION):
+        set_attr = object.__setattr__
+        set_attr(self, "_entries", MappingProxyType(dict(entries)))
+        set_attr(self, "region", region)
+        payload = {
+            "knowledgeBases": [
+                {"name": kb.name, "description": kb.description}
+                for kb in entries.values()
+            ]
+        }
+        set_attr(self, "list_kbs_payload", payload)
+        set_attr(self, "list_kbs_body", json_codec.dumps(payload))
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+    
+    def __getitem__(self, name: str) -> KnowledgeBase:
+        return self._entries[name]
+    
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def list_available(self) -> List[Dict[str, str]]:
+        """KB一覧（名前と説明）のコピーを返す"""
+        return [dict(kb) for kb in self.list_kbs_payload["knowledgeBases"]]
+    
+    def with_overrides(self, **settings: Any) -> "KBRegistry":
+        """全KBの設定の一部を上書きした新しいレジストリを返す（ベンチマーク・テスト用）"""
+        return load_registry(
+            {name: {**kb, **settings} for name, kb in self._entries.items()},
+            region=self.region
+        )
+
+
+def load_registry(
+    knowledge_bases: Mapping[str, Mapping[str, Any]],
+    region: Optional[str] = None
+) -> KBRegistry:
+    """
+    KB設定の辞書からレジストリを構築する
+    
+    Raises:
+        KBConfigError: 設定に誤りがある（全KBの誤りをまとめて報告する）
+    """
+    if region is None:
+        region = REGION
+    errors = []
+    for name, config in knowledge_bases.items():
+        if not isinstance(name, str) or not name:
+            errors.append(f"{name!r}: knowledge base name must be a non-empty string")
+            continue
+        errors.extend(validate_kb_config(name, config))
+    if errors:
+        raise KBConfigError("invalid knowledge base config: " + "; ".join(errors))
+    return KBRegistry({
+        name: KnowledgeBase(name, config, region)
+        for name, config in knowledge_bases.items()
+    }, region)
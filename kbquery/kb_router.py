@@ -0,0 +1,125 @@
+# kbquery/kb_router.py
+"""
+キーワードによるナレッジベースのルーティング
+
+kb_config の routing_terms（キーワード → 重み）と説明文から、
+コンテナ起動時に1回だけ以下を構築する:
+- Aho-Corasickオートマトン: クエリを1回走査して全キーワードの出現を検出
+- 転置インデックス: キーワード → [(KB名, 重み)]
+
+クエリ時の計算量はクエリ長 + ヒットしたキーワード数に比例し、KB数には依存しない。
+"""
+from typing import Any, Dict, List, Mapping, Tuple
+
+
+# 説明文がクエリに含まれていた場合の重み（kb_config の description_weight で上書き可能）
+DEFAULT_DESCRIPTION_WEIGHT = 2.0
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick法による複数キーワードの同時検索
+    
+    クエリを1回走査するだけで、登録した全キーワードの出現（重なりを含む）を検出する。
+    """
+    
+    def __init__(self, terms: List[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        
+        for term in dict.fromkeys(terms):
+            if not term:
+                continue
+            node = 0
+            for ch in term:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append(term)
+        
+        # 幅優先で失敗遷移を構築
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+    
+    def find_all(self, text: str) -> List[str]:
+        """text中に出現するキーワードを（重複なし・初出順で）返す"""
+        found: Dict[str, None] = {}
+        goto, fail, output = self._goto, self._fail, self._output
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for term in output[node]:
+                found[term] = None
+        return list(found)
+
+
+def _routing_terms(config: Mapping[str, Any]) -> Dict[str, float]:
+    """KB設定の routing_terms を {小文字キーワード: 重み} に変換（リストなら重み1）"""
+    terms = config.get("routing_terms") or {}
+    if isinstance(terms, Mapping):
+        return {term.lower(): float(weight) for term, weight in terms.items()}
+    return {term.lower(): 1.0 for term in terms}
+
+
+class KBRouter:
+    """
+    キーワードの重み付きマッチでナレッジベースを順位付けする
+    """
+    
+    def __init__(self, knowledge_bases: Mapping[str, Mapping[str, Any]]):
+        self.kb_names: List[str] = list(knowledge_bases)
+        
+        # 転置インデックス: キーワード → [(KB名, 重み)]
+        index: Dict[str, List[Tuple[str, float]]] = {}
+        for kb_name, config in knowledge_bases.items():
+            terms = _routing_terms(config)
+            description = str(config.get("description", "")).lower()
+            if description:
+                weight = float(config.get("description_weight", DEFAULT_DESCRIPTION_WEIGHT))
+                terms[description] = terms.get(description, 0.0) + weight
+            for term, weight in terms.items():
+                index.setdefault(term, []).append((kb_name, weight))
+        
+        self.index = index
+        self.automaton = KeywordAutomaton(list(index))
+        self._position = {kb_name: i for i, kb_name in enumerate(self.kb_names)}
+    
+    def find_terms(self, query: str) -> List[str]:
+        """クエリに出現するルーティング用キーワードを返す（小文字）"""
+        return self.automaton.find_all(query.lower())
+    
+    def rank(self, hits: List[str]) -> List[Tuple[str, float]]:
+        """
+        ヒットしたキーワードから全KBを順位付け
+        
+        Returns:
+            (KB名, スコア) のリスト。スコア順で、同点とスコア0のKBは定義順
+        """
+        scores: Dict[str, float] = {}
+        for term in hits:
+            for kb_name, weight in self.index.get(term, ()):
+                scores[kb_name] = scores.get(kb_name, 0.0) + weight
+        
+        position = self._position
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], position[x[0]]))
+        ranked.extend((kb_name, 0.0) for kb_name in self.kb_names if kb_name not in scores)
+        return ranked
+    
+    def rank_query(self, query: str) -> List[Tuple[str, float]]:
+        """クエリ文字列から全KBを順位付け"""
+        return self.rank(self.find_terms(query))
@@ -0,0 +1,120 @@
+# kbquery/keyword_rescore.py
+"""
+取得後のキーワード再スコアリング（BM25）
+
+Bedrockの検索結果（候補チャンク）に対して、クエリから抽出したキーワード
+（API名・エラーコード・カタカナ語など）の完全一致でBM25スコアを計算し、
+検索スコアと重み付きで合成する。リランキングモデルを使わないKBでも、
+キーワードが一致するチャンクを上位にできる。
+
+- キーワードは1つの正規表現（長い順の選択）にまとめ、各チャンクを1回だけ走査する
+- IDF・平均文書長は候補チャンク集合の中で計算する
+- 合成前に検索スコアとBM25スコアをそれぞれ最大値で割って 0〜1 にそろえる
+"""
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Pattern, Sequence
+
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 合成時の重み（KB設定の keyword_weight / retrieval_weight で上書き可能）
+DEFAULT_KEYWORD_WEIGHT = float(os.environ.get("KB_KEYWORD_WEIGHT", "0.3"))
+DEFAULT_RETRIEVAL_WEIGHT = float(os.environ.get("KB_RETRIEVAL_WEIGHT", "1.0"))
+
+
+def compile_terms(keywords: Sequence[str]) -> Optional[Pattern[str]]:
+    """キーワードを1つの正規表現にまとめる（長いキーワードを優先、大文字小文字は区別しない）"""
+    terms = sorted({k.lower() for k in keywords if k}, key=len, reverse=True)
+    if not terms:
+        return None
+    return re.compile("|".join(re.escape(term) for term in terms), re.IGNORECASE)
+
+
+def bm25_scores(
+    keywords: Sequence[str],
+    texts: Sequence[str],
+    k1: float = BM25_K1,
+    b: float = BM25_B
+) -> List[float]:
+    """
+    候補テキストごとのBM25スコアを計算
+    
+    日本語は空白で区切れないため、文書長は文字数で扱う。
+    """
+    pattern = compile_terms(keywords)
+    if pattern is None or not texts:
+        return [0.0] * len(texts)
+    
+    # 各テキストを1回走査して語ごとの出現回数を数える
+    frequencies: List[Dict[str, int]] = []
+    document_frequency: Dict[str, int] = {}
+    for text in texts:
+        counts: Dict[str, int] = {}
+        for match in pattern.finditer(text):
+            term = match.group().lower()
+            counts[term] = counts.get(term, 0) + 1
+        for term in counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+        frequencies.append(counts)
+    
+    if not document_frequency:
+        return [0.0] * len(texts)
+    
+    n = len(texts)
+    idf = {
+        term: math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        for term, df in document_frequency.items()
+    }
+    lengths = [len(text) for text in texts]
+    average_length = (sum(lengths) / n) or 1.0
+    
+    scores = []
+    for counts, length in zip(frequencies, lengths):
+        norm = k1 * (1.0 - b + b * length / average_length)
+        scores.append(sum(
+            idf[term] * tf * (k1 + 1.0) / (tf + norm)
+            for term, tf in counts.items()
+        ))
+    return scores
+
+
+def rescore_results(
+    results: List[Dict[str, Any]],
+    keywords: Sequence[str],
+    max_results: int,
+    keyword_weight: float = DEFAULT_KEYWORD_WEIGHT,
+    retrieval_weight: float = DEFAULT_RETRIEVAL_WEIGHT
+) -> List[Dict[str, Any]]:
+    """
+    検索結果をBM25スコアと合成して並べ直し、上位 max_results 件を返す
+    
+    返す結果の score は合成スコア。元のスコアは retrievalScore、
+    BM25スコア（0〜1に正規化済み）は keywordScore に入れる。
+    キーワードがない・どれにも一致しない場合は元の順序のまま切り詰める。
+    """
+    keyword_scores = bm25_scores(keywords, [r.get("content", "") for r in results])
+    max_keyword = max(keyword_scores, default=0.0)
+    if max_keyword <= 0.0:
+        return results[:max_results]
+    
+    max_retrieval = max((r.get("score", 0.0) for r in results), default=0.0)
+    rescored = []
+    for result, keyword_score in zip(results, keyword_scores):
+        retrieval_score = result.get("score", 0.0)
+        normalized_retrieval = retrieval_score / max_retrieval if max_retrieval > 0 else 0.0
+        normalized_keyword = keyword_score / max_keyword
+        item = dict(result)
+        item["score"] = (
+            retrieval_weight * normalized_retrieval + keyword_weight * normalized_keyword
+        )
+        item["retrievalScore"] = retrieval_score
+        item["keywordScore"] = normalized_keyword
+        rescored.append(item)
+    
+    # 安定ソートなので同点は元の順位を保つ
+    rescored.sort(key=lambda r: r["score"], reverse=True)
+    return rescored[:max_results]
@@ -8,286 +8,1297 @@ AgentCore Gateway経由で呼び出される（Smithyモデル対応）
 - ハイブリッド検索: ベクトル検索 + キーワード完全一致
 - リランキング: 検索結果の再順位付け
 """
-import json
+import hashlib
 import os
 import re
-import boto3
-from typing import Any, Dict, List, Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from functools import partial
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
 
-from kb_config import get_kb_config, list_available_kbs
+import json_codec
+from cache_backends import create_cache_backend
+from emf_metrics import StageTimer, emit_emf
+from kb_config import KB_REGISTRY
+from kb_registry import KnowledgeBase
+from kb_router import KBRouter
+from keyword_rescore import DEFAULT_KEYWORD_WEIGHT, DEFAULT_RETRIEVAL_WEIGHT, rescore_results
+from rate_limit import (
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_MAX_WAIT_MS,
+    RATE_LIMIT_RPS,
+    RateLimitExceeded,
+    TokenBucket,
+)
+from resilience import HEDGE_MAX_WORKERS, CircuitBreaker, CircuitOpenError, ResilientCaller
+from query_fingerprint import (
+    NearDuplicateIndex,
+    QueryFingerprint,
+    char_ngrams,
+    compute_fingerprint,
+    normalize_text,
+)
+from single_flight import SingleFlight
+from response_shaping import resolve_shaping, shape_results
+from result_merge import RRF_K, chunk_identity, merge_ranked_lists, rrf_score
+from structured_log import RequestLog, StructuredLogger
+
+# boto3 / botocore は読み込みに時間がかかるため、最初に検索するときまで読み込まない
+# （list_kbs だけの呼び出しやコールドスタート時の初期化では読み込まない）
+if TYPE_CHECKING:
+    from botocore.config import Config
 
 
 REGION = os.environ.get("AWS_REGION", "ap-northeast-1")
 
+# 構造化ログ（KB_LOG_LEVEL / KB_LOG_SAMPLE_RATE で設定）
+logger = StructuredLogger("kbquery")
+
 # クエリ分解の閾値（この文字数を超えたら分解を試みる）
 QUERY_SPLIT_THRESHOLD = 50
 
+# サブクエリの最大数（KBごとに kb_config の max_sub_queries で上書き可能）
+MAX_SUB_QUERIES = int(os.environ.get("KB_MAX_SUB_QUERIES", "4"))
+
+# この重複率（文字bigramのJaccard係数）以上の断片は冗長として除外
+SUBQUERY_OVERLAP_THRESHOLD = float(os.environ.get("KB_SUBQUERY_OVERLAP_THRESHOLD", "0.7"))
+
+# 早期終了モード（kb_config の early_stop）で同時に発行するサブクエリ数
+EARLY_STOP_PARALLELISM = int(os.environ.get("KB_EARLY_STOP_PARALLELISM", "2"))
+
+# Lambdaの残り時間からサブクエリ数を見積もるための設定
+# 残り時間から安全マージンを引いた時間内に、1回あたりの想定時間で何巡できるかで上限を決める
+LAMBDA_TIME_MARGIN_SEC = float(os.environ.get("KB_LAMBDA_TIME_MARGIN_SEC", "2"))
+ESTIMATED_RETRIEVE_SEC = float(os.environ.get("KB_ESTIMATED_RETRIEVE_SEC", "1.5"))
+
+# サブクエリ並列実行の同時実行数上限
+SUBQUERY_MAX_WORKERS = int(os.environ.get("KB_SUBQUERY_MAX_WORKERS", "4"))
+
+# サブクエリ全体の締め切り（秒）。超過したサブクエリは部分結果として扱う
+SUBQUERY_DEADLINE_SEC = float(os.environ.get("KB_SUBQUERY_DEADLINE_SEC", "20"))
+
+# バッチ検索の同時実行数と最大アイテム数
+BATCH_MAX_WORKERS = int(os.environ.get("KB_BATCH_MAX_WORKERS", "4"))
+BATCH_MAX_ITEMS = int(os.environ.get("KB_BATCH_MAX_ITEMS", "10"))
+
+# 横断検索で同時に検索するKB数（KBごとにサブクエリのスレッドプールを持つので上限を設ける）
+FEDERATED_MAX_WORKERS = int(os.environ.get("KB_FEDERATED_MAX_WORKERS", "4"))
+
+
+# Bedrockクライアントの接続設定（環境変数で調整可能）
+# 接続数の既定値は同時に発行し得るretrieve数
+# （バッチ・横断検索の同時実行数 × サブクエリの同時実行数 + ヘッジ）。
+# 足りないと urllib3 が接続を破棄・再作成する
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.environ.get(
+    "KB_BEDROCK_MAX_POOL_CONNECTIONS",
+    str(max(10, SUBQUERY_MAX_WORKERS * max(BATCH_MAX_WORKERS, FEDERATED_MAX_WORKERS) + HEDGE_MAX_WORKERS))
+))
+BEDROCK_TCP_KEEPALIVE = os.environ.get("KB_BEDROCK_TCP_KEEPALIVE", "true").lower() == "true"
+BEDROCK_RETRY_MODE = os.environ.get("KB_BEDROCK_RETRY_MODE", "standard")
+# リトライは resilience（KBごとの設定・サーキットブレーカーと連動）で行うため、SDK側は1回
+BEDROCK_MAX_ATTEMPTS = int(os.environ.get("KB_BEDROCK_MAX_ATTEMPTS", "1"))
+BEDROCK_CONNECT_TIMEOUT_SEC = float(os.environ.get("KB_BEDROCK_CONNECT_TIMEOUT_SEC", "2"))
+BEDROCK_READ_TIMEOUT_SEC = float(os.environ.get("KB_BEDROCK_READ_TIMEOUT_SEC", "15"))
+# 初期化時にクライアントを生成しておくか（Provisioned Concurrency など、初期化の時間が
+# 呼び出しの待ち時間に含まれない場合に有効にする。既定では最初の検索まで遅らせる）
+BEDROCK_EAGER_CLIENT = os.environ.get("KB_BEDROCK_EAGER_CLIENT", "false").lower() == "true"
+
+# クライアントはコンテナ内で使い回す（ウォームスタート時は再生成しない）
+_bedrock_client = None
+_bedrock_client_lock = threading.Lock()
+_bedrock_client_stats = {"created": 0, "reused": 0}
+
+
+# 現在の呼び出しの終了期限（time.monotonic基準、Lambda context から設定）
+_invocation_deadline: Optional[float] = None
+
+
+def set_invocation_deadline(context: Any) -> None:
+    """Lambda context の残り時間から、現在の呼び出しの終了期限を設定"""
+    global _invocation_deadline
+    get_remaining = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining is None:
+        _invocation_deadline = None
+        return
+    _invocation_deadline = time.monotonic() + get_remaining() / 1000
+
+
+# コールドスタート判定（コンテナ内の最初の呼び出しだけ True、メトリクスのディメンションに使う）
+_container_warm = False
+_invocation_cold = False
+
+
+def mark_invocation_start() -> bool:
+    """呼び出しの開始を記録し、コールドスタートかどうかを返す"""
+    global _container_warm, _invocation_cold
+    _invocation_cold = not _container_warm
+    _container_warm = True
+    return _invocation_cold
+
+
+def get_remaining_time_sec() -> Optional[float]:
+    """現在の呼び出しの残り時間（秒）。context がなければNone"""
+    if _invocation_deadline is None:
+        return None
+    return _invocation_deadline - time.monotonic()
+
+
+def build_bedrock_client_config() -> "Config":
+    """環境変数からBedrockクライアントの接続設定を構築"""
+    from botocore.config import Config
+    
+    return Config(
+        region_name=REGION,
+        max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=BEDROCK_TCP_KEEPALIVE,
+        retries={
+            "mode": BEDROCK_RETRY_MODE,
+            "max_attempts": BEDROCK_MAX_ATTEMPTS
+        },
+        connect_timeout=BEDROCK_CONNECT_TIMEOUT_SEC,
+        read_timeout=BEDROCK_READ_TIMEOUT_SEC
+    )
+
 
 def get_bedrock_client():
-    """Bedrock Agent Runtimeクライアントを取得"""
-    return boto3.client("bedrock-agent-runtime", region_name=REGION)
+    """
+    Bedrock Agent Runtimeクライアントを取得
+    
+    初回呼び出し時にだけ生成し（boto3 もここで読み込む）、以降は同じクライアントを返す。
+    """
+    global _bedrock_client
+    
+    client = _bedrock_client
+    if client is not None:
+        with _bedrock_client_lock:
+            _bedrock_client_stats["reused"] += 1
+        return client
+    
+    with _bedrock_client_lock:
+        if _bedrock_client is None:
+            import boto3
+            
+            _bedrock_client = boto3.client(
+                "bedrock-agent-runtime",
+                region_name=REGION,
+                config=build_bedrock_client_config()
+            )
+            _bedrock_client_stats["created"] += 1
+        else:
+            _bedrock_client_stats["reused"] += 1
+        return _bedrock_client
+
+
+def reset_bedrock_client() -> None:
+    """キャッシュ済みクライアントを破棄（次回呼び出しで再生成される）"""
+    global _bedrock_client
+    with _bedrock_client_lock:
+        _bedrock_client = None
+
+
+def set_bedrock_client(client: Any) -> None:
+    """使用するクライアントを差し替える（ベンチマーク・テストで偽クライアントを注入する用）"""
+    global _bedrock_client
+    with _bedrock_client_lock:
+        _bedrock_client = client
+
+
+def get_bedrock_client_stats() -> Dict[str, int]:
+    """クライアントの生成回数・再利用回数を取得"""
+    with _bedrock_client_lock:
+        return dict(_bedrock_client_stats)
+
 
+if BEDROCK_EAGER_CLIENT:
+    get_bedrock_client()
 
-def split_query(query: str) -> List[str]:
+
+# KBごとのリトライ・サーキットブレーカー・ヘッジ（コンテナ内で状態を保持する）
+_resilient_callers: Dict[str, ResilientCaller] = {}
+_resilient_callers_lock = threading.Lock()
+
+
+def get_resilient_caller(kb_config: KnowledgeBase) -> ResilientCaller:
+    """KB設定に合わせた ResilientCaller を取得（KB IDごとに1つ）"""
+    kb_id = kb_config.id
+    with _resilient_callers_lock:
+        caller = _resilient_callers.get(kb_id)
+        if caller is None:
+            breaker_kwargs = {
+                key: kb_config[config_key]
+                for key, config_key in (
+                    ("failure_threshold", "breaker_failure_threshold"),
+                    ("reset_sec", "breaker_reset_sec"),
+                )
+                if config_key in kb_config
+            }
+            hedge_delay_ms = kb_config.get("hedge_delay_ms")
+            caller_kwargs = {}
+            if "retry_max_attempts" in kb_config:
+                caller_kwargs["max_attempts"] = kb_config["retry_max_attempts"]
+            caller = ResilientCaller(
+                breaker=CircuitBreaker(**breaker_kwargs),
+                hedge=kb_config.get("hedge", False),
+                hedge_delay_sec=hedge_delay_ms / 1000 if hedge_delay_ms is not None else None,
+                **caller_kwargs
+            )
+            _resilient_callers[kb_id] = caller
+        return caller
+
+
+def get_resilience_stats() -> Dict[str, Dict[str, Any]]:
+    """KB IDごとのリトライ・ブレーカー・ヘッジの統計"""
+    with _resilient_callers_lock:
+        callers = dict(_resilient_callers)
+    return {kb_id: caller.stats() for kb_id, caller in callers.items()}
+
+
+# KBごとのレート制限（トークンバケット、コンテナ内で状態を保持する）
+_rate_limiters: Dict[str, Optional[TokenBucket]] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(kb_config: KnowledgeBase) -> Optional[TokenBucket]:
+    """KB設定に合わせたトークンバケットを取得（KB IDごとに1つ、無効ならNone）"""
+    kb_id = kb_config.id
+    with _rate_limiters_lock:
+        if kb_id not in _rate_limiters:
+            rate = kb_config.get("rate_limit_rps", RATE_LIMIT_RPS)
+            _rate_limiters[kb_id] = TokenBucket(
+                rate, kb_config.get("rate_limit_burst", RATE_LIMIT_BURST)
+            ) if rate > 0 else None
+        return _rate_limiters[kb_id]
+
+
+def get_rate_limit_stats() -> Dict[str, Dict[str, Any]]:
+    """KB IDごとのレート制限の統計（取得・待機・拒否の回数、待ち時間の合計）"""
+    with _rate_limiters_lock:
+        limiters = dict(_rate_limiters)
+    return {kb_id: limiter.stats() for kb_id, limiter in limiters.items() if limiter is not None}
+
+
+# auto_search のレスポンスに含めるKB候補数
+AUTO_SEARCH_CANDIDATES = 3
+
+# レスポンスに段階ごとの処理時間（timings）を含めるか（リクエストの include_timings で上書き可能）
+RETURN_TIMINGS = os.environ.get("KB_RETURN_TIMINGS", "false").lower() == "true"
+
+# 検索結果キャッシュの既定TTL
+# KBごとに kb_config の cache_ttl で上書きできる（0で無効）
+CACHE_DEFAULT_TTL_SEC = float(os.environ.get("KB_CACHE_TTL_SEC", "300"))
+
+# 検索結果のキャッシュ（KB_CACHE_BACKEND で memory / file / sqlite を選択、file はEFS上で複数コンテナと共有可）
+RETRIEVAL_CACHE = create_cache_backend()
+
+
+# 近似重複クエリ → キャッシュキーのインデックス（コンテナ内のみ）
+NEAR_DUPLICATE_INDEX = NearDuplicateIndex()
+
+# キャッシュのヒット状況（しきい値チューニング用）
+_cache_stats_lock = threading.Lock()
+_cache_stats = {"exactHits": 0, "nearHits": 0, "misses": 0}
+
+
+def _record_cache_lookup(kind: str) -> None:
+    with _cache_stats_lock:
+        _cache_stats[kind] += 1
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """キャッシュのヒット数とヒット率を取得"""
+    with _cache_stats_lock:
+        stats: Dict[str, Any] = dict(_cache_stats)
+    total = stats["exactHits"] + stats["nearHits"] + stats["misses"]
+    stats["hitRate"] = (stats["exactHits"] + stats["nearHits"]) / total if total else 0.0
+    stats["nearHitRate"] = stats["nearHits"] / total if total else 0.0
+    return stats
+
+
+def make_cache_scope(kb_id: str, retrieval_config_key: str) -> str:
+    """KB ID と retrieval config の正規化JSON（KnowledgeBase.retrieval_config）からキャッシュのスコープを作成"""
+    return kb_id + "\x1f" + retrieval_config_key
+
+
+def make_cache_key(scope: str, fingerprint: QueryFingerprint) -> str:
+    """スコープと正規化クエリからキャッシュキーを作成"""
+    raw = scope + "\x1f" + fingerprint.canonical
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def lookup_cache(scope: str, fingerprint: QueryFingerprint) -> Optional[List[Dict[str, Any]]]:
     """
-    長いクエリを複数のサブクエリに分解
+    完全一致 → 近似重複の順でキャッシュを検索
     
-    分解ルール:
-    - 句読点（。、！？）で分割
-    - 「と」「や」「および」などの接続詞で分割
-    - 短すぎる分割は除外
-    """
-    if len(query) < QUERY_SPLIT_THRESHOLD:
-        return [query]
-    
-    # 句読点・接続詞で分割
-    patterns = [
-        r'[。！？\n]',           # 句読点
-        r'(?:、また|、そして)',   # 接続表現
-        r'(?:について|に関して)', # トピック区切り
-    ]
+    近似重複は NearDuplicateIndex で類似度がしきい値以上のクエリを探し、
+    そのクエリのキャッシュを共有する（数字・識別子が異なるクエリは対象外）。
+    """
+    cached = RETRIEVAL_CACHE.get(make_cache_key(scope, fingerprint))
+    if cached is not None:
+        _record_cache_lookup("exactHits")
+        return cached
     
-    sub_queries = [query]
-    for pattern in patterns:
-        new_queries = []
-        for q in sub_queries:
-            parts = re.split(pattern, q)
-            new_queries.extend([p.strip() for p in parts if p.strip()])
-        sub_queries = new_queries
+    near = NEAR_DUPLICATE_INDEX.lookup(fingerprint.near_scope(scope), fingerprint.signature)
+    if near is not None:
+        cached = RETRIEVAL_CACHE.get(near[0])
+        if cached is not None:
+            _record_cache_lookup("nearHits")
+            return cached
     
-    # 短すぎるクエリを除外（5文字未満）、重複除去
-    sub_queries = list(set([q for q in sub_queries if len(q) >= 5]))
+    _record_cache_lookup("misses")
+    return None
+
+
+def store_cache(
+    scope: str,
+    fingerprint: QueryFingerprint,
+    results: List[Dict[str, Any]],
+    ttl: float
+) -> None:
+    """キャッシュに保存し、近似重複インデックスにも登録"""
+    if ttl <= 0:
+        return
+    cache_key = make_cache_key(scope, fingerprint)
+    RETRIEVAL_CACHE.put(cache_key, results, ttl)
+    NEAR_DUPLICATE_INDEX.add(fingerprint.near_scope(scope), fingerprint.signature, cache_key)
+
+
+def fragment_features(fragment: str) -> Tuple[str, Set[str]]:
+    """冗長判定用に、断片の正規化文字列と文字bigram集合を計算"""
+    normalized = normalize_text(fragment)
+    return normalized, char_ngrams(normalized)
+
+
+def is_redundant_fragment(
+    features: Tuple[str, Set[str]],
+    kept_features: List[Tuple[str, Set[str]]]
+) -> bool:
+    """
+    既に採用したサブクエリに含まれる / ほぼ同じ内容の断片かを判定
     
-    # 分解結果が1つだけなら元のクエリを返す
-    return sub_queries if len(sub_queries) > 1 else [query]
+    正規化した文字列で部分文字列になっているか、文字bigramのJaccard係数が
+    SUBQUERY_OVERLAP_THRESHOLD 以上なら冗長とみなす。
+    特徴量は fragment_features で断片ごとに1回だけ計算しておく。
+    """
+    normalized, grams = features
+    for other_normalized, other_grams in kept_features:
+        if normalized in other_normalized:
+            return True
+        union = grams | other_grams
+        if union and len(grams & other_grams) / len(union) >= SUBQUERY_OVERLAP_THRESHOLD:
+            return True
+    return False
 
 
-def extract_keywords(query: str) -> List[str]:
+# ========================================
+# クエリ解析（分解・キーワード抽出・KBルーティングを1回の走査で行う）
+# ========================================
+
+# 分割位置とキーワードを1つの正規表現で同時に検出する
+# - split: 句読点・接続表現・トピック区切り（クエリ分解用）
+# - bracket: 括弧内の文字列（中身は _INNER_TOKEN_PATTERN で再走査する）
+# - ascii: 英数字の連続（API名、関数名、エラーコードなど）
+# - kana: カタカナ語（3文字以上）
+_SPLIT_PATTERN = r'[。！？\n]|、また|、そして|について|に関して'
+_ASCII_PATTERN = r'[A-Za-z][A-Za-z0-9_]{2,}'
+_KANA_PATTERN = r'[ァ-ヶー]{3,}'
+_TOKEN_PATTERN = re.compile(
+    f'(?P<split>{_SPLIT_PATTERN})'
+    r'|[「『\(](?P<bracket>[^」』\)]+)[」』\)]'
+    f'|(?P<ascii>{_ASCII_PATTERN})'
+    f'|(?P<kana>{_KANA_PATTERN})'
+)
+_INNER_TOKEN_PATTERN = re.compile(
+    f'(?P<split>{_SPLIT_PATTERN})'
+    f'|(?P<ascii>{_ASCII_PATTERN})'
+    f'|(?P<kana>{_KANA_PATTERN})'
+)
+
+
+# コンテナ内で1回だけ構築する（kb_config の routing_terms と説明文から）
+KB_ROUTER = KBRouter(KB_REGISTRY)
+
+# 埋め込みルーター（オプション。有効時はキーワードスコアに類似度×重みを加算する）
+EMBEDDING_ROUTER_ENABLED = os.environ.get("KB_EMBEDDING_ROUTER", "false").lower() == "true"
+EMBEDDING_ROUTER_WEIGHT = float(os.environ.get("KB_EMBEDDING_ROUTER_WEIGHT", "1.0"))
+
+_embedding_router = None
+_embedding_router_loaded = False
+_embedding_router_lock = threading.Lock()
+
+
+def get_embedding_router():
+    """
+    埋め込みルーターを取得（初回呼び出し時にインデックスを読み込む）
+    
+    無効設定・numpy なし・インデックスなしの場合は None。
+    numpy は有効時にだけ import する（無効時のコールドスタートに影響させない）。
+    """
+    global _embedding_router, _embedding_router_loaded
+    if not EMBEDDING_ROUTER_ENABLED:
+        return None
+    with _embedding_router_lock:
+        if not _embedding_router_loaded:
+            from embedding_router import load_embedding_router
+            _embedding_router = load_embedding_router()
+            _embedding_router_loaded = True
+    return _embedding_router
+
+
+class QueryAnalysis:
+    """
+    クエリ解析の結果（1回の解析結果を分解・キーワード・KB選択で使い回す）
+    
+    fragments: 分解した断片（5文字以上・重複除去・出現順）。冗長除去と件数制限は
+               sub_queries() で行う
+    keywords: ハイブリッド検索用キーワード（英数字 → カタカナ → 括弧内の順）
+    routing_hits: クエリに出現したルーティング用キーワード・KB説明文（小文字）
+    """
+    
+    __slots__ = ("query", "fragments", "keywords", "routing_hits")
+    
+    def __init__(
+        self,
+        query: str,
+        fragments: List[str],
+        keywords: List[str],
+        routing_hits: List[str]
+    ):
+        self.query = query
+        self.fragments = fragments
+        self.keywords = keywords
+        self.routing_hits = routing_hits
+    
+    def sub_queries(self, max_sub_queries: Optional[int] = None) -> List[str]:
+        """
+        検索に使うサブクエリを返す
+        
+        - 他の断片に含まれる / ほぼ同じ内容の断片は除外（長い断片を優先）
+        - max_sub_queries を超える場合は長い断片から採用
+        - 結果は元のクエリ内の出現順（キャッシュキーを安定させるため）
+        """
+        candidates = self.fragments
+        
+        # 長い断片から順に、冗長でないものだけ採用
+        kept: List[str] = []
+        kept_features: List[Tuple[str, Set[str]]] = []
+        for fragment in sorted(candidates, key=len, reverse=True):
+            if max_sub_queries is not None and len(kept) >= max_sub_queries:
+                break
+            features = fragment_features(fragment)
+            if not is_redundant_fragment(features, kept_features):
+                kept.append(fragment)
+                kept_features.append(features)
+        
+        # 出現順に戻す
+        kept_set = set(kept)
+        sub_queries = [q for q in candidates if q in kept_set]
+        
+        # 分解結果が1つだけなら元のクエリを返す
+        return sub_queries if len(sub_queries) > 1 else [self.query]
+
+
+def analyze_query(query: str) -> QueryAnalysis:
     """
-    クエリから重要キーワードを抽出（ハイブリッド検索用）
+    クエリを1回走査して、分解位置・キーワード・ルーティング語を同時に抽出
+    
+    分解ルール:
+    - 句読点（。！？改行）で分割
+    - 「、また」「、そして」などの接続表現で分割
+    - 「について」「に関して」などのトピック区切りで分割
+    - 短すぎる分割（5文字未満）は除外
     
-    抽出対象:
+    キーワード抽出対象:
     - 英数字の連続（API名、関数名など）
     - カタカナ語
     - 括弧内の文字列
     """
-    keywords = []
+    split_spans: List[Tuple[int, int]] = []
+    ascii_words: List[str] = []
+    kana_words: List[str] = []
+    bracket_words: List[str] = []
+    
+    def collect(match: "re.Match[str]", offset: int) -> None:
+        kind = match.lastgroup
+        if kind == "split":
+            split_spans.append((match.start() + offset, match.end() + offset))
+        elif kind == "ascii":
+            ascii_words.append(match.group(kind))
+        elif kind == "kana":
+            kana_words.append(match.group(kind))
     
-    # 英数字（API名、関数名、エラーコードなど）
-    keywords.extend(re.findall(r'[A-Za-z][A-Za-z0-9_]{2,}', query))
+    for match in _TOKEN_PATTERN.finditer(query):
+        if match.lastgroup == "bracket":
+            bracket_words.append(match.group("bracket"))
+            # 括弧内も分割位置・英数字・カタカナの対象
+            inner_start = match.start("bracket")
+            for inner in _INNER_TOKEN_PATTERN.finditer(match.group("bracket")):
+                collect(inner, inner_start)
+        else:
+            collect(match, 0)
     
-    # カタカナ語（3文字以上）
-    keywords.extend(re.findall(r'[ァ-ヶー]{3,}', query))
+    # クエリ分解（短いクエリは分解しない）
+    fragments: List[str] = []
+    if len(query) >= QUERY_SPLIT_THRESHOLD:
+        parts = []
+        position = 0
+        for start, end in split_spans:
+            parts.append(query[position:start])
+            position = end
+        parts.append(query[position:])
+        
+        # 短すぎるクエリを除外（5文字未満）、重複除去（出現順を維持）
+        fragments = list(dict.fromkeys(
+            p.strip() for p in parts if len(p.strip()) >= 5
+        ))
     
-    # 括弧内の文字列
-    keywords.extend(re.findall(r'[「『\(]([^」』\)]+)[」』\)]', query))
+    # 重複除去（出現順を維持）
+    keywords = list(dict.fromkeys(ascii_words + kana_words + bracket_words))
+    routing_hits = KB_ROUTER.find_terms(query)
+    
+    return QueryAnalysis(query, fragments, keywords, routing_hits)
+
+
+def split_query(query: str, max_sub_queries: Optional[int] = None) -> List[str]:
+    """
+    長いクエリを複数のサブクエリに分解（analyze_query の分解部分）
     
-    # 重複除去して返す
-    return list(set(keywords))
+    結果は元のクエリ内の出現順で返す（キャッシュキーを安定させるため）。
+    """
+    return analyze_query(query).sub_queries(max_sub_queries)
 
 
-def build_retrieval_config(
-    kb_config: Dict[str, Any],
+def extract_keywords(query: str) -> List[str]:
+    """
+    クエリから重要キーワードを抽出（ハイブリッド検索用、analyze_query のキーワード部分）
+    """
+    return analyze_query(query).keywords
+
+
+def merge_results(
+    result_lists: List[List[Dict[str, Any]]],
     max_results: int,
-    use_hybrid: bool = True
-) -> Dict[str, Any]:
+    strategy: str = "max",
+    weights: Optional[Sequence[float]] = None
+) -> List[Dict[str, Any]]:
     """
-    KB設定からretrieval configを構築
-    リランキング・ハイブリッド検索の設定を自動適用
+    複数クエリの結果をマージ・重複除去・スコア順ソート
+    
+    重複はチャンク単位で判定する。戦略は result_merge.merge_ranked_lists を参照
+    （weights は weighted のときのサブクエリごとの重み）。
     """
-    config: Dict[str, Any] = {
-        "vectorSearchConfiguration": {
-            "numberOfResults": max_results
-        }
-    }
+    return merge_ranked_lists(result_lists, max_results, strategy, weights=weights)
+
+
+def sub_query_weights(sub_queries: Sequence[str]) -> List[float]:
+    """
+    weighted マージ用のサブクエリごとの重み（合計1）
     
-    # ハイブリッド検索（ベクトル + キーワード）
-    if use_hybrid:
-        config["vectorSearchConfiguration"]["overrideSearchType"] = "HYBRID"
+    早期打ち切りの優先順と同じく、長いサブクエリほど情報量が多いとみなして
+    文字数に比例した重みにする。
+    """
+    total = sum(len(sub_query) for sub_query in sub_queries)
+    if total == 0:
+        return [1.0 / len(sub_queries)] * len(sub_queries) if sub_queries else []
+    return [len(sub_query) / total for sub_query in sub_queries]
+
+
+# 同時に実行中の同一retrieve（KB・検索設定・正規化クエリが同じもの）を1回にまとめる
+# バッチ検索・横断検索のスレッドや、同じ内容のサブクエリが同時にBedrockを呼ばないようにする
+RETRIEVE_FLIGHTS = SingleFlight()
+
+
+def call_retrieve(
+    client: Any,
+    kb_id: str,
+    enhanced_query: str,
+    retrieval_config: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """Bedrockのretrieveを呼び出し、結果を共通形式に変換"""
+    response = client.retrieve(
+        knowledgeBaseId=kb_id,
+        retrievalQuery={"text": enhanced_query},
+        retrievalConfiguration=retrieval_config
+    )
     
-    # リランキング設定
-    if kb_config.get("rerank"):
-        rerank_model = kb_config.get("rerank_model", "AMAZON")
-        
-        # モデルARNを構築
-        if rerank_model == "AMAZON":
-            model_arn = f"arn:aws:bedrock:{REGION}::foundation-model/amazon.rerank-v1:0"
-        else:  # COHERE
-            model_arn = f"arn:aws:bedrock:{REGION}::foundation-model/cohere.rerank-v3-5:0"
+    results = []
+    for item in response.get("retrievalResults", []):
+        content = item.get("content", {}).get("text", "")
+        score = item.get("score", 0.0)
+        location = item.get("location", {})
         
-        config["vectorSearchConfiguration"]["rerankingConfiguration"] = {
-            "type": "BEDROCK_RERANKING_MODEL",
-            "bedrockRerankingConfiguration": {
-                "modelConfiguration": {
-                    "modelArn": model_arn
-                }
-            }
+        result = {
+            "content": content,
+            "score": score,
+            "source": location.get("s3Location", {}).get("uri", "unknown")
         }
+        chunk_id = item.get("metadata", {}).get("x-amz-bedrock-kb-chunk-id")
+        if chunk_id:
+            result["chunkId"] = chunk_id
+        results.append(result)
+    return results
+
+
+def retrieve_sub_query(
+    client: Any,
+    kb_config: KnowledgeBase,
+    enhanced_query: str,
+    max_results: int,
+    use_hybrid: bool,
+    fingerprint: Optional[QueryFingerprint] = None,
+    shared_calls: Optional[SingleFlight] = None,
+    timer: Optional[StageTimer] = None
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    1つのサブクエリでretrieveを実行し、結果を共通形式に変換
+    
+    キャッシュにヒットした場合はBedrockを呼ばずに返す（リランキング料金も発生しない）。
+    fingerprintを省略した場合は enhanced_query から作成する。
+    同時に実行中の同一retrieveは1回にまとめ、結果を共有する（RETRIEVE_FLIGHTS）。
+    shared_callsを渡すと、代わりにそちらでまとめる（バッチ検索では完了後の結果も共有する）。
+    timerを渡すと、次の時間を分けて記録する。
+    - retrieve: Bedrockのretrieve呼び出し1回ごとの時間（再試行・ヘッジの各呼び出しを含む）
+    - retrieve_total: サブクエリ1件の取得全体（トークン待ち・再試行の待機・ヘッジを含む）
+    - queue_wait: レート制限のトークン待ち / retry_wait: 再試行前の待機
+    KBにレート制限がある場合は、retrieveの試行（再試行を含む）ごとにトークンを1つ使い、
+    待ちきれなければ RateLimitExceeded を送出する。ヘッジ（2本目）もトークンを1つ使い、
+    待たずに取得できない場合はヘッジしない。
+    
+    Returns:
+        (検索結果, キャッシュから返したか)
+    """
+    # (max_results, ハイブリッド検索) ごとに構築済みのものを使う
+    retrieval_config, retrieval_config_key = kb_config.retrieval_config(max_results, use_hybrid)
+    
+    if fingerprint is None:
+        fingerprint = compute_fingerprint(enhanced_query)
     
-    return config
+    cache_ttl = kb_config.get("cache_ttl", CACHE_DEFAULT_TTL_SEC)
+    cache_scope = make_cache_scope(kb_config.id, retrieval_config_key)
+    if cache_ttl > 0:
+        cached = lookup_cache(cache_scope, fingerprint)
+        if cached is not None:
+            return [dict(item, cached=True) for item in cached], True
+    
+    caller = get_resilient_caller(kb_config)
+    limiter = get_rate_limiter(kb_config)
+    
+    def acquire_token() -> None:
+        max_wait_sec = kb_config.get("rate_limit_max_wait_ms", RATE_LIMIT_MAX_WAIT_MS) / 1000
+        try:
+            waited = limiter.acquire(max_wait_sec, deadline=_invocation_deadline)
+        except RateLimitExceeded:
+            if timer is not None:
+                timer.count("RateLimited")
+            raise
+        if timer is not None:
+            timer.record("queue_wait", waited * 1000)
+    
+    def call_client() -> List[Dict[str, Any]]:
+        if timer is None:
+            return call_retrieve(client, kb_config.id, enhanced_query, retrieval_config)
+        with timer.stage("retrieve"):
+            return call_retrieve(client, kb_config.id, enhanced_query, retrieval_config)
+    
+    def record_backoff(delay: float) -> None:
+        timer.record("retry_wait", delay * 1000)  # type: ignore
+    
+    def retrieve() -> List[Dict[str, Any]]:
+        # リトライ・サーキットブレーカー・ヘッジを適用（Lambdaの残り時間を超えて再試行しない）
+        return caller.call(
+            call_client,
+            deadline=_invocation_deadline,
+            before_attempt=acquire_token if limiter is not None else None,
+            before_hedge=limiter.try_acquire if limiter is not None else None,
+            on_backoff=record_backoff if timer is not None else None
+        )
+    
+    def fetch() -> List[Dict[str, Any]]:
+        if timer is not None:
+            with timer.stage("retrieve_total"):
+                results = retrieve()
+            timer.count("RetrieveCalls")
+        else:
+            results = retrieve()
+        store_cache(cache_scope, fingerprint, results, cache_ttl)
+        return results
+    
+    flights = shared_calls if shared_calls is not None else RETRIEVE_FLIGHTS
+    results, coalesced = flights.do(make_cache_key(cache_scope, fingerprint), fetch)
+    if coalesced and timer is not None:
+        timer.count("CoalescedCalls")
+    return [dict(item, cached=False) for item in results], False
 
 
-def merge_results(
-    all_results: List[Dict[str, Any]],
-    max_results: int
-) -> List[Dict[str, Any]]:
+# サブクエリの実行結果: (状態, 検索結果, キャッシュから返したか)
+# 状態は done / timeout（締め切り超過。早期終了モードで締め切りまでに発行できなかったものも含む）
+# / skipped（上位が安定したので未発行）
+# / abandoned（早期終了時に発行済みだったが結果を使わなかった）
+# / failed（リトライ後も失敗、サーキットブレーカーが開いていた、またはレート制限で止めた）
+SubQueryOutcome = Tuple[str, List[Dict[str, Any]], bool]
+
+
+def submit_timed(
+    executor: ThreadPoolExecutor,
+    task: Callable[[], Any],
+    timer: Optional[StageTimer] = None
+) -> Future:
+    """タスクを投入し、timerを渡していれば実行開始までの待ち時間を pool_wait として記録する"""
+    if timer is None:
+        return executor.submit(task)
+    submitted_at = time.perf_counter()
+    
+    def run() -> Any:
+        timer.record("pool_wait", (time.perf_counter() - submitted_at) * 1000)
+        return task()
+    
+    return executor.submit(run)
+
+
+def run_sub_queries(
+    tasks: List[Callable[[], Tuple[List[Dict[str, Any]], bool]]],
+    max_workers: int,
+    deadline_sec: float,
+    errors: Optional[List[Exception]] = None,
+    timer: Optional[StageTimer] = None
+) -> List[SubQueryOutcome]:
     """
-    複数クエリの結果をマージ・重複除去・スコア順ソート
+    全サブクエリをスレッドプールで並列実行
+    
+    締め切りまでに終わらなかったものは待たずに timeout として返す。
+    失敗したものは failed とし、errors を渡していれば例外を追加する。
+    timerを渡すと、スレッドプールでの待ち時間を pool_wait として記録する。
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+    try:
+        futures = [submit_timed(executor, task, timer) for task in tasks]
+        done, _ = wait(futures, timeout=deadline_sec)
+    finally:
+        # 締め切り超過分は待たずに戻る（未着手のものはキャンセル）
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    outcomes: List[SubQueryOutcome] = []
+    for future in futures:
+        if future not in done:
+            outcomes.append(("timeout", [], False))
+            continue
+        error = future.exception()
+        if error is not None:
+            outcomes.append(("failed", [], False))
+            if errors is not None:
+                errors.append(error)
+            continue
+        results, from_cache = future.result()
+        outcomes.append(("done", results, from_cache))
+    return outcomes
+
+
+def run_sub_queries_early_stop(
+    tasks: List[Callable[[], Tuple[List[Dict[str, Any]], bool]]],
+    max_results: int,
+    merge_strategy: str,
+    deadline_sec: float,
+    parallelism: int = 2,
+    patience: int = 1,
+    margin: float = 0.0,
+    errors: Optional[List[Exception]] = None,
+    weights: Optional[Sequence[float]] = None,
+    timer: Optional[StageTimer] = None
+) -> List[SubQueryOutcome]:
     """
-    # sourceをキーにして重複除去（スコアが高い方を残す）
-    seen: Dict[str, Dict[str, Any]] = {}
-    for result in all_results:
-        source = result.get("source", "")
-        if source not in seen or result.get("score", 0) > seen[source].get("score", 0):
-            seen[source] = result
+    サブクエリを優先順に発行し、上位max_results件が安定したら残りを発行せずに打ち切る
+    
+    同時に発行するのは parallelism 件まで。結果は優先順に取り込み、取り込むたびに
+    マージ後の上位k件を計算する。上位k件の顔ぶれが変わらず、かつk位とk+1位の
+    スコア差が margin 以上の応答が patience 回続いたら停止する。
+    
+    Args:
+        tasks: 優先順に並べたサブクエリ実行関数
+        max_results: 安定性を判定する上位件数
+        merge_strategy: マージ戦略（merge_results と同じ）
+        deadline_sec: 全体の締め切り秒数
+        parallelism: 同時に発行する最大数
+        patience: 停止に必要な「変化なし」の連続回数
+        margin: k位とk+1位に必要なスコア差
+        errors: 失敗したサブクエリの例外を追加するリスト
+        weights: weighted マージ用の重み（tasks と同じ順、省略時は均等）
+        timer: 渡すとスレッドプールでの待ち時間を pool_wait として記録する
+    """
+    outcomes: List[SubQueryOutcome] = [("skipped", [], False)] * len(tasks)
+    if not tasks:
+        return outcomes
+    
+    deadline = time.monotonic() + deadline_sec
+    executor = ThreadPoolExecutor(max_workers=max(1, parallelism))
+    futures: List[Future] = []
     
-    # スコア順でソートして上位を返す
-    merged = sorted(seen.values(), key=lambda x: x.get("score", 0), reverse=True)
-    return merged[:max_results]
+    def submit_next() -> None:
+        if len(futures) < len(tasks):
+            futures.append(submit_timed(executor, tasks[len(futures)], timer))
+    
+    try:
+        for _ in range(max(1, parallelism)):
+            submit_next()
+        
+        result_lists: List[List[Dict[str, Any]]] = []
+        result_weights: List[float] = []
+        previous_top = None
+        stable_count = 0
+        for index in range(len(tasks)):
+            future = futures[index]
+            done, _ = wait([future], timeout=max(0.0, deadline - time.monotonic()))
+            if not done:
+                # 締め切り超過: 未発行のものも節約ではないので skipped ではなく timeout にする
+                for timed_out in range(index, len(tasks)):
+                    outcomes[timed_out] = ("timeout", [], False)
+                break
+            
+            error = future.exception()
+            if error is not None:
+                # 失敗したサブクエリは安定性の判定に使わず、次を発行する
+                outcomes[index] = ("failed", [], False)
+                if errors is not None:
+                    errors.append(error)
+                submit_next()
+                continue
+            
+            results, from_cache = future.result()
+            outcomes[index] = ("done", results, from_cache)
+            result_lists.append(results)
+            result_weights.append(weights[index] if weights is not None else 1.0)
+            
+            # 上位k件の顔ぶれとk位/k+1位のスコア差で安定性を判定
+            merged = merge_results(result_lists, max_results + 1, merge_strategy, result_weights)
+            top = [chunk_identity(r) for r in merged[:max_results]]
+            gap = (
+                merged[max_results - 1].get("score", 0) - merged[max_results].get("score", 0)
+                if len(merged) > max_results else float("inf")
+            )
+            if top == previous_top and gap >= margin:
+                stable_count += 1
+            else:
+                stable_count = 0
+            previous_top = top
+            
+            if stable_count >= patience:
+                # 発行済みで未取り込みのものは結果を使わない（呼び出し自体は発生している）
+                for issued in range(index + 1, len(futures)):
+                    outcomes[issued] = ("abandoned", [], False)
+                break
+            submit_next()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    return outcomes
 
 
 def search_knowledge_base_impl(
     kb_name: str,
     query: str,
-    max_results: int = 5
+    max_results: int = 5,
+    max_workers: Optional[int] = None,
+    deadline_sec: Optional[float] = None,
+    shared_calls: Optional[SingleFlight] = None,
+    analysis: Optional[QueryAnalysis] = None,
+    content_mode: Optional[str] = None,
+    max_chars: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+    include_timings: Optional[bool] = None
 ) -> Dict[str, Any]:
     """
     ナレッジベースを検索（クエリ分解・ハイブリッド検索対応）
     
+    サブクエリはスレッドプールで並列に実行する。
+    締め切りまでに終わらなかったサブクエリは待たずに、
+    完了済みの結果だけで部分結果を返す。
+    リトライ後も失敗したサブクエリ・サーキットブレーカーやレート制限で止めたサブクエリも
+    部分結果として扱う。すべてのサブクエリがレート制限で止まった場合は RateLimitExceeded を送出する。
+    
     Args:
         kb_name: KB設定名（kb_config.pyで定義）
         query: 検索クエリ
         max_results: 取得する結果の最大数
+        max_workers: 同時実行数の上限（デフォルト: KB_SUBQUERY_MAX_WORKERS）
+        deadline_sec: サブクエリ全体の締め切り秒数（デフォルト: KB_SUBQUERY_DEADLINE_SEC）
+        shared_calls: 同一retrieveをまとめるための共有オブジェクト（バッチ検索用）
+        analysis: analyze_query の結果（省略時はここで解析）
+        content_mode: 本文の返し方（full / truncate / snippet、省略時はKB設定）
+        max_chars: 1結果あたりの最大文字数（省略時はKB設定、0は無制限）
+        max_bytes: 全結果の本文の合計最大バイト数（省略時はKB設定、0は無制限）
+        include_timings: 段階ごとの処理時間を timings に含めるか（デフォルト: KB_RETURN_TIMINGS）
     
     Returns:
         検索結果
     """
     # KB設定を取得
-    kb_config = get_kb_config(kb_name)
+    kb_config = KB_REGISTRY.get(kb_name)
     if not kb_config:
         raise ValueError(f"Unknown knowledge base: {kb_name}")
+    shaping = resolve_shaping(kb_config, content_mode, max_chars, max_bytes)
+    if include_timings is None:
+        include_timings = RETURN_TIMINGS
+    
+    # 段階ごとの処理時間（analyze / retrieve / merge / shape）を記録し、EMFで出力する
+    timer = StageTimer()
+    search_start = time.perf_counter()
+    
+    if max_workers is None:
+        max_workers = SUBQUERY_MAX_WORKERS
+    if deadline_sec is None:
+        deadline_sec = SUBQUERY_DEADLINE_SEC
+    max_sub_queries = kb_config.get("max_sub_queries", MAX_SUB_QUERIES)
+    
+    # Lambdaの残り時間に収まるように締め切りとサブクエリ数を調整
+    remaining = get_remaining_time_sec()
+    if remaining is not None:
+        budget = max(0.0, remaining - LAMBDA_TIME_MARGIN_SEC)
+        deadline_sec = min(deadline_sec, budget)
+        rounds = max(1, int(budget // ESTIMATED_RETRIEVE_SEC))
+        max_sub_queries = min(max_sub_queries, rounds * max_workers)
     
     client = get_bedrock_client()
     
-    # クエリ分解
-    sub_queries = split_query(query)
+    # クエリ解析（分解・キーワード抽出を1回の走査で行う）
+    with timer.stage("analyze"):
+        if analysis is None:
+            analysis = analyze_query(query)
+        sub_queries = analysis.sub_queries(max_sub_queries)
     
     # キーワード抽出（ハイブリッド検索の補助）
-    keywords = extract_keywords(query)
+    keywords = analysis.keywords
     
     # ハイブリッド検索（ベクトル + キーワード）- KB設定で有効な場合のみ
     use_hybrid = kb_config.get("hybrid", False)
     
-    # 各サブクエリで検索実行
-    all_results: List[Dict[str, Any]] = []
+    # キーワードがあればクエリに追加（検索精度向上）
+    # 正規化したフィンガープリントは近似重複クエリのキャッシュ共有に使う
     queries_used = []
-    
+    fingerprints = []
     for sub_query in sub_queries:
-        # キーワードがあればクエリに追加（検索精度向上）
         enhanced_query = sub_query
         if keywords:
             enhanced_query = f"{sub_query} {' '.join(keywords[:3])}"
-        
         queries_used.append(enhanced_query)
-        
-        response = client.retrieve(
-            knowledgeBaseId=kb_config["id"],
-            retrievalQuery={"text": enhanced_query},
-            retrievalConfiguration=build_retrieval_config(
-                kb_config,
-                max_results=max_results * 2,  # マージ用に多めに取得
-                use_hybrid=use_hybrid
-            )
+        fingerprints.append(compute_fingerprint(sub_query, keywords[:3]))
+    
+    merge_strategy = kb_config.get("merge_strategy", "max")
+    weights = sub_query_weights(sub_queries)
+    tasks = [
+        partial(
+            retrieve_sub_query,
+            client,
+            kb_config,
+            enhanced_query,
+            max_results * 2,  # マージ用に多めに取得
+            use_hybrid,
+            fingerprint,
+            shared_calls,
+            timer
         )
-        
-        # 結果を収集
-        for item in response.get("retrievalResults", []):
-            content = item.get("content", {}).get("text", "")
-            score = item.get("score", 0.0)
-            location = item.get("location", {})
-            
-            all_results.append({
-                "content": content,
-                "score": score,
-                "source": location.get("s3Location", {}).get("uri", "unknown")
-            })
+        for enhanced_query, fingerprint in zip(queries_used, fingerprints)
+    ]
+    
+    errors: List[Exception] = []
+    if kb_config.get("early_stop", False):
+        # 長いサブクエリ（情報量が多い）から優先して発行し、上位が安定したら打ち切る
+        order = sorted(range(len(tasks)), key=lambda i: len(sub_queries[i]), reverse=True)
+        outcomes = run_sub_queries_early_stop(
+            [tasks[i] for i in order],
+            max_results,
+            merge_strategy,
+            deadline_sec,
+            parallelism=min(max_workers, EARLY_STOP_PARALLELISM),
+            patience=kb_config.get("early_stop_patience", 1),
+            margin=kb_config.get("early_stop_margin", 0.0),
+            errors=errors,
+            weights=[weights[i] for i in order],
+            timer=timer
+        )
+        queries_used = [queries_used[i] for i in order]
+        weights = [weights[i] for i in order]
+    else:
+        outcomes = run_sub_queries(tasks, max_workers, deadline_sec, errors, timer)
+    
+    # 結果はサブクエリの順序で収集する（逐次実行時と同じマージ結果にするため）
+    result_lists: List[List[Dict[str, Any]]] = []
+    result_weights: List[float] = []
+    timed_out_queries = []
+    failed_queries = []
+    skipped_queries = []
+    calls_saved = 0
+    cache_hits = 0
+    for enhanced_query, weight, (status, results, from_cache) in zip(queries_used, weights, outcomes):
+        if status == "timeout":
+            timed_out_queries.append(enhanced_query)
+            continue
+        if status == "failed":
+            failed_queries.append(enhanced_query)
+            continue
+        if status in ("skipped", "abandoned"):
+            skipped_queries.append(enhanced_query)
+            if status == "skipped":
+                calls_saved += 1
+            continue
+        result_lists.append(results)
+        result_weights.append(weight)
+        if from_cache:
+            cache_hits += 1
+    
+    # すべて失敗した場合、サーキットブレーカーによるものなら空の縮退結果を返し、
+    # レート制限によるものは 429 にする。それ以外（再試行を使い切った・リクエストの誤り）は
+    # 従来どおりエラーにする
+    degraded = any(isinstance(e, CircuitOpenError) for e in errors)
+    rate_limited = [e for e in errors if isinstance(e, RateLimitExceeded)]
+    if errors and not result_lists and not timed_out_queries and not degraded:
+        raise rate_limited[0] if rate_limited else errors[0]
     
     # 結果をマージ・重複除去
-    merged_results = merge_results(all_results, max_results)
+    # キーワード再スコアリングが有効なら、取得した候補をすべて残してから並べ直す
+    keyword_rescore = kb_config.get("keyword_rescore", False) and bool(keywords)
+    with timer.stage("merge"):
+        if keyword_rescore:
+            candidates = merge_results(result_lists, max_results * 2, merge_strategy, result_weights)
+            merged_results = rescore_results(
+                candidates,
+                keywords,
+                max_results,
+                keyword_weight=kb_config.get("keyword_weight", DEFAULT_KEYWORD_WEIGHT),
+                retrieval_weight=kb_config.get("retrieval_weight", DEFAULT_RETRIEVAL_WEIGHT)
+            )
+        else:
+            merged_results = merge_results(result_lists, max_results, merge_strategy, result_weights)
     
-    return {
+    # レスポンスサイズの制御（スニペット抽出・切り詰め・バイト数の上限）
+    with timer.stage("shape"):
+        merged_results, truncated = shape_results(merged_results, keywords, **shaping)
+    
+    timer.record("search", (time.perf_counter() - search_start) * 1000)
+    timer.count("CacheHits", cache_hits)
+    emit_emf(timer, {"KbName": kb_name, "ColdStart": str(_invocation_cold).lower()})
+    
+    response = {
         "kbName": kb_name,
-        "kbDescription": kb_config["description"],
+        "kbDescription": kb_config.description,
         "query": query,
         "subQueries": queries_used,
         "keywordsExtracted": keywords,
         "results": merged_results,
         "count": len(merged_results),
         "reranked": kb_config.get("rerank", False),
-        "hybridSearch": kb_config.get("hybrid", False)
+        "hybridSearch": kb_config.get("hybrid", False),
+        "keywordRescored": keyword_rescore,
+        "contentMode": shaping["content_mode"],
+        "truncated": truncated,
+        "partial": bool(timed_out_queries or failed_queries),
+        "timedOutQueries": timed_out_queries,
+        "failedQueries": failed_queries,
+        "degraded": degraded,
+        "rateLimited": bool(rate_limited),
+        "cacheHits": cache_hits,
+        "coalescedCalls": timer.counts().get("CoalescedCalls", 0),
+        "earlyStopped": bool(skipped_queries),
+        "callsSaved": calls_saved,
+        "skippedQueries": skipped_queries
     }
+    if include_timings:
+        response["timings"] = timer.summary()
+    return response
 
 
-def auto_select_kb(query: str) -> str:
+def rank_kbs(query: str, analysis: Optional[QueryAnalysis] = None) -> List[Tuple[str, float]]:
+    """
+    クエリ内容から各ナレッジベースの適合スコアを計算し、スコア順に並べる
+    
+    スコアはクエリに出現した routing_terms の重みと説明文の重みの合計。
+    埋め込みルーターが有効な場合は、KB重心とのコサイン類似度×KB_EMBEDDING_ROUTER_WEIGHT を加算する。
+    
+    Args:
+        query: 検索クエリ
+        analysis: analyze_query の結果（省略時はここで解析）
+    
+    Returns:
+        (KB名, スコア) のリスト（同点はkb_configの定義順）
+    """
+    if not KB_ROUTER.kb_names:
+        raise ValueError("No knowledge bases available")
+    
+    if analysis is None:
+        analysis = analyze_query(query)
+    ranking = KB_ROUTER.rank(analysis.routing_hits)
+    
+    router = get_embedding_router()
+    if router is None:
+        return ranking
+    
+    # インデックスにないKB（作成後に追加されたKB）は類似度0として扱う
+    similarities = router.similarities(query)
+    combined = [
+        (name, score + EMBEDDING_ROUTER_WEIGHT * similarities.get(name, 0.0))
+        for name, score in ranking
+    ]
+    # 安定ソートなので同点はキーワードスコアの順序を保つ
+    return sorted(combined, key=lambda x: x[1], reverse=True)
+
+
+def auto_select_kb(query: str, analysis: Optional[QueryAnalysis] = None) -> str:
     """
     クエリ内容から最適なナレッジベースを自動選択
     
     Args:
         query: 検索クエリ
+        analysis: analyze_query の結果（省略時はここで解析）
     
     Returns:
-        選択されたKB名
+        選択されたKB名（マッチしなければ最初のKB）
     """
-    kbs = list_available_kbs()
+    return rank_kbs(query, analysis)[0][0]
+
+
+def normalize_scores(
+    results: List[Dict[str, Any]],
+    method: str = "rrf"
+) -> List[float]:
+    """
+    1つのKBの検索結果のスコアを、KB間で比較できる値に正規化
     
-    if not kbs:
-        raise ValueError("No knowledge bases available")
+    - rrf: 順位のみを使う Reciprocal Rank Fusion（1 / (k + 順位)）
+    - minmax: KB内の最小値を0、最大値を1に線形変換
+    """
+    if method == "rrf":
+        return [rrf_score(rank, RRF_K) for rank in range(1, len(results) + 1)]
+    if method == "minmax":
+        scores = [r.get("score", 0.0) for r in results]
+        if not scores:
+            return []
+        low, high = min(scores), max(scores)
+        if high == low:
+            return [1.0] * len(scores)
+        return [(score - low) / (high - low) for score in scores]
+    raise ValueError(f"Unknown fusion method: {method}")
+
+
+def federated_search_impl(
+    query: str,
+    max_results: int = 5,
+    top_n: Optional[int] = None,
+    fusion: str = "rrf",
+    shaping: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    複数のナレッジベースを並列に検索し、1つのランキングに統合
     
-    # キーワードマッチングで最適なKBを選択
-    query_lower = query.lower()
-    best_kb = None
-    best_score = 0
+    Args:
+        query: 検索クエリ
+        max_results: 統合後に返す結果の最大数
+        top_n: 検索するKB数（rank_kbsの上位から、1以上の整数。省略時は全KB）
+        fusion: スコア正規化方法（rrf / minmax）
+        shaping: レスポンス整形の引数（content_mode / max_chars / max_bytes）
     
-    # 簡易的なキーワードマッチング
-    keyword_map = {
-        "product_docs": ["認証", "ログイン", "パスワード", "auth", "login", "マニュアル", "使い方"],
-        "faq": ["よくある質問", "faq", "サンプル", "例", "ドキュメント"],
-    }
+    Returns:
+        統合された検索結果とKBごとの実行時間
     
-    for kb in kbs:
-        kb_name = kb["name"]
-        keywords = keyword_map.get(kb_name, [])
-        
-        # キーワードマッチスコア計算
-        score = sum(1 for kw in keywords if kw in query_lower)
+    同時に検索するKBは KB_FEDERATED_MAX_WORKERS 件まで。
+    """
+    if shaping is None:
+        shaping = {}
+    # 整形指定の誤りはKBごとのエラーではなく呼び出し全体のエラーにする
+    resolved = resolve_shaping({}, **shaping)
+    if fusion not in ("rrf", "minmax"):
+        raise ValueError(f"Unknown fusion method: {fusion}")
+    if top_n is not None and (not isinstance(top_n, int) or isinstance(top_n, bool) or top_n < 1):
+        raise ValueError(f"top_n must be a positive integer: {top_n!r}")
+    
+    analysis = analyze_query(query)
+    kb_names = [kb_name for kb_name, _ in rank_kbs(query, analysis)]
+    if top_n is not None:
+        kb_names = kb_names[:top_n]
+    
+    def run_kb(kb_name: str) -> Tuple[Optional[Dict[str, Any]], Optional[str], float]:
+        start = time.perf_counter()
+        try:
+            result = search_knowledge_base_impl(
+                kb_name, query, max_results, analysis=analysis, **shaping
+            )
+            return result, None, time.perf_counter() - start
+        except Exception as e:
+            return None, str(e), time.perf_counter() - start
+    
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(FEDERATED_MAX_WORKERS, len(kb_names)))
+    ) as executor:
+        outputs = list(executor.map(run_kb, kb_names))
+    
+    # KBごとに正規化したスコアで1つのランキングに統合
+    fused: List[Dict[str, Any]] = []
+    per_kb = []
+    for kb_name, (result, error, elapsed) in zip(kb_names, outputs):
+        kb_summary: Dict[str, Any] = {
+            "kbName": kb_name,
+            "elapsedMs": round(elapsed * 1000, 1),
+        }
+        if error is not None:
+            kb_summary["error"] = error
+            per_kb.append(kb_summary)
+            continue
         
-        # 説明文とのマッチも考慮
-        if kb["description"].lower() in query_lower:
-            score += 2
+        kb_results = result["results"]
+        kb_summary["count"] = len(kb_results)
+        kb_summary["partial"] = result.get("partial", False)
+        per_kb.append(kb_summary)
         
-        if score > best_score:
-            best_score = score
-            best_kb = kb_name
+        for item, norm_score in zip(kb_results, normalize_scores(kb_results, fusion)):
+            fused.append(dict(
+                item,
+                kbName=kb_name,
+                originalScore=item.get("score", 0.0),
+                score=norm_score
+            ))
+    
+    merged = sorted(fused, key=lambda x: x["score"], reverse=True)[:max_results]
     
-    # マッチしなければ最初のKBを使用
-    if not best_kb:
-        best_kb = kbs[0]["name"]
+    # KBごとの上限とは別に、統合後の結果全体にもバイト数の上限を適用する
+    merged, truncated = shape_results(merged, analysis.keywords, max_bytes=resolved["max_bytes"])
+    truncated = truncated or any(item.get("truncated", False) for item in merged)
     
-    return best_kb
+    return {
+        "query": query,
+        "fusion": fusion,
+        "kbsSearched": kb_names,
+        "results": merged,
+        "count": len(merged),
+        "truncated": truncated,
+        "perKb": per_kb
+    }
 
 
 # ========================================
 # ツールハンドラー（AgentCore Gateway対応）
 # ========================================
 
+def shaping_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    """リクエスト引数からレスポンス整形の指定を取り出す（指定のないものはKB設定の既定値）"""
+    return {
+        "content_mode": args.get("content_mode"),
+        "max_chars": args.get("max_chars"),
+        "max_bytes": args.get("max_bytes"),
+    }
+
+
+def validate_max_results(value: Any) -> int:
+    """max_results の検証（1以上の整数でなければ ValueError → 400）"""
+    if not isinstance(value, int) or isinstance(value, bool) or value < 1:
+        raise ValueError(f"max_results must be a positive integer: {value!r}")
+    return value
+
+
 def handle_list_kbs(args: Dict[str, Any]) -> Dict[str, Any]:
     """
     list_kbs ツール: 利用可能なKB一覧を返す
+    
+    呼び出し側が変更してもレジストリに影響しないよう、毎回コピーを返す。
+    本文はレジストリでシリアライズ済みのもの（list_kbs_body）を lambda_handler で使う。
     """
-    kbs = list_available_kbs()
-    return {
-        "knowledgeBases": kbs
-    }
+    return {"knowledgeBases": KB_REGISTRY.list_available()}
 
 
 def handle_kb_search(args: Dict[str, Any]) -> Dict[str, Any]:
@@ -298,17 +1309,23 @@ def handle_kb_search(args: Dict[str, Any]) -> Dict[str, Any]:
         kb_name: 検索するナレッジベースの名前
         query: 検索クエリ
         max_results: 取得する結果の最大数（デフォルト: 5）
+        content_mode / max_chars / max_bytes: レスポンス整形（省略時はKB設定）
+        include_timings: 段階ごとの処理時間を timings に含めるか
     """
     kb_name = args.get("kb_name")
     query = args.get("query")
-    max_results = args.get("max_results", 5)
+    max_results = validate_max_results(args.get("max_results", 5))
     
     if not kb_name:
         raise ValueError("kb_name is required")
     if not query:
         raise ValueError("query is required")
     
-    result = search_knowledge_base_impl(kb_name, query, max_results)
+    result = search_knowledge_base_impl(
+        kb_name, query, max_results,
+        include_timings=args.get("include_timings"),
+        **shaping_args(args)
+    )
     return result
 
 
@@ -319,30 +1336,152 @@ def handle_auto_search(args: Dict[str, Any]) -> Dict[str, Any]:
     Args:
         query: 検索クエリ
         max_results: 取得する結果の最大数（デフォルト: 5）
+        content_mode / max_chars / max_bytes: レスポンス整形（省略時はKB設定）
+        include_timings: 段階ごとの処理時間を timings に含めるか
     """
     query = args.get("query")
-    max_results = args.get("max_results", 5)
+    max_results = validate_max_results(args.get("max_results", 5))
     
     if not query:
         raise ValueError("query is required")
     
-    # 最適なKBを自動選択
-    selected_kb = auto_select_kb(query)
+    # クエリを1回だけ解析し、KB選択と検索で使い回す
+    analysis = analyze_query(query)
+    
+    # 最適なKBを自動選択（候補の順位も返す）
+    ranking = rank_kbs(query, analysis)
+    selected_kb = ranking[0][0]
     
     # 検索実行
-    result = search_knowledge_base_impl(selected_kb, query, max_results)
+    result = search_knowledge_base_impl(
+        selected_kb, query, max_results, analysis=analysis,
+        include_timings=args.get("include_timings"),
+        **shaping_args(args)
+    )
     
     return {
         "selectedKb": selected_kb,
+        "candidates": [
+            {"kbName": kb_name, "score": score}
+            for kb_name, score in ranking[:AUTO_SEARCH_CANDIDATES]
+            if score > 0
+        ],
         "result": result
     }
 
 
+def handle_batch_search(args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    batch_search ツール: 複数の検索を1回の呼び出しでまとめて実行する
+    
+    各アイテムは並列に実行し、同一のretrieveは1回にまとめる。
+    アイテムごとのエラー（未知のKBなど）は全体を失敗させず、そのアイテムの error に入れて返す。
+    入力の形式の誤り（items がリストでない、アイテムがオブジェクトでないなど）は全体のエラーにする。
+    
+    Args:
+        items: [{kb_name, query, max_results}] のリスト
+        または
+        query: 検索クエリ
+        kb_names: 検索するナレッジベース名のリスト
+        max_results: 取得する結果の最大数（デフォルト: 5、items ではアイテムごとの既定値）
+        content_mode / max_chars / max_bytes: レスポンス整形（全アイテム共通、省略時はKB設定）
+    """
+    items = args.get("items")
+    max_results = validate_max_results(args.get("max_results", 5))
+    if not items:
+        query = args.get("query")
+        kb_names = args.get("kb_names")
+        if not query or not kb_names:
+            raise ValueError("items, or query and kb_names are required")
+        if not isinstance(kb_names, list):
+            raise ValueError("kb_names must be a list")
+        items = [
+            {"kb_name": kb_name, "query": query, "max_results": max_results}
+            for kb_name in kb_names
+        ]
+    elif not isinstance(items, list):
+        raise ValueError("items must be a list")
+    
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"Too many batch items: {len(items)} (max {BATCH_MAX_ITEMS})")
+    
+    normalized_items = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f"items[{index}] must be an object")
+        kb_name = item.get("kb_name")
+        query = item.get("query")
+        if not kb_name or not isinstance(kb_name, str):
+            raise ValueError("kb_name is required for each item")
+        if not query or not isinstance(query, str):
+            raise ValueError("query is required for each item")
+        # アイテムに max_results がなければ、全体の max_results を使う
+        normalized_items.append(
+            (kb_name, query, validate_max_results(item.get("max_results", max_results)))
+        )
+    
+    # 完全に同じアイテムは1回だけ実行する
+    unique_items = list(dict.fromkeys(normalized_items))
+    shared_calls = SingleFlight(retain=True)
+    shaping = shaping_args(args)
+    
+    def run_item(item: Tuple[str, str, int]) -> Dict[str, Any]:
+        kb_name, query, max_results = item
+        try:
+            return {
+                "result": search_knowledge_base_impl(
+                    kb_name, query, max_results, shared_calls=shared_calls, **shaping
+                )
+            }
+        except Exception as e:
+            return {"error": str(e)}
+    
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(BATCH_MAX_WORKERS, len(unique_items)))
+    ) as executor:
+        outputs = dict(zip(unique_items, executor.map(run_item, unique_items)))
+    
+    results = []
+    for kb_name, query, max_results in normalized_items:
+        output = outputs[(kb_name, query, max_results)]
+        results.append({"kbName": kb_name, "query": query, **output})
+    
+    return {
+        "items": results,
+        "count": len(results),
+        "dedupedCalls": shared_calls.coalesced + len(normalized_items) - len(unique_items)
+    }
+
+
+def handle_federated_search(args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    federated_search ツール: 複数KBを並列に検索して1つのランキングに統合する
+    
+    Args:
+        query: 検索クエリ
+        max_results: 取得する結果の最大数（デフォルト: 5）
+        top_n: 検索するKB数（省略時は全KB）
+        fusion: スコア正規化方法（rrf / minmax、デフォルト: rrf）
+        content_mode / max_chars / max_bytes: レスポンス整形（省略時はKB設定）
+    """
+    query = args.get("query")
+    max_results = validate_max_results(args.get("max_results", 5))
+    top_n = args.get("top_n")
+    fusion = args.get("fusion", "rrf")
+    
+    if not query:
+        raise ValueError("query is required")
+    
+    return federated_search_impl(query, max_results, top_n, fusion, shaping_args(args))
+
+
 # ツール名とハンドラーのマッピング
 TOOL_HANDLERS = {
     "list_kbs": handle_list_kbs,
     "kb_search": handle_kb_search,
     "auto_search": handle_auto_search,
+    "batch_search": handle_batch_search,
+    "federated_search": handle_federated_search,
 }
 
 
@@ -350,13 +1489,52 @@ TOOL_HANDLERS = {
 # Lambda ハンドラー（AgentCore Gateway対応）
 # ========================================
 
+# レスポンス形式
+# proxy: {"statusCode": ..., "body": "<JSON文字列>"}（従来の形式）
+# native: ツールの出力をそのまま返す（Gatewayが1回だけJSONにする。二重エンコードなし）
+RESPONSE_MODE = os.environ.get("KB_RESPONSE_MODE", "proxy")
+
+
+def make_response(
+    status_code: int,
+    payload: Dict[str, Any],
+    body: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    RESPONSE_MODE に合わせてレスポンスを組み立てる
+    
+    native ではエラー時だけ statusCode を出力に含める。
+    body に payload をシリアライズ済みの文字列を渡すと、proxy ではそれをそのまま使う。
+    """
+    if RESPONSE_MODE == "native":
+        if status_code == 200:
+            return payload
+        return {"statusCode": status_code, **payload}
+    return {
+        "statusCode": status_code,
+        "body": body if body is not None else json_codec.dumps(payload)
+    }
+
+
+def parse_response(response: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+    """
+    make_response の逆変換: レスポンスから (ステータスコード, payload) を取り出す
+    
+    proxy / native のどちらの形式でも使える（テスト・ローカル実行用）。
+    """
+    if "body" in response:
+        return response["statusCode"], json_codec.loads(response["body"])
+    payload = {key: value for key, value in response.items() if key != "statusCode"}
+    return response.get("statusCode", 200), payload
+
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Lambda エントリーポイント（AgentCore Gateway対応）
     
     Gatewayからは以下の形式でイベントが渡される:
     {
-        "toolName": "list_kbs" | "kb_search" | "auto_search",
+        "toolName": "list_kbs" | "kb_search" | "auto_search" | "batch_search" | "federated_search",
         "input": { ... }  # ツール固有の引数
     }
     
@@ -367,9 +1545,17 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         ...
     }
     """
+    set_invocation_deadline(context)
+    cold_start = mark_invocation_start()
+    request_log = RequestLog(
+        logger,
+        requestId=getattr(context, "aws_request_id", None),
+        coldStart=cold_start
+    )
+    handler_timer = StageTimer()
     try:
-        # デバッグ用: 受信イベントをログ出力
-        print(f"Received event: {json.dumps(event, ensure_ascii=False)}")
+        # デバッグ用: 受信イベント（DEBUG のときだけシリアライズされる）
+        logger.debug("received event", event=event)
         
         # ツール名を取得（複数の形式に対応）
         tool_name = (
@@ -384,7 +1570,9 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         # ツール名がない場合、引数から推測
         if not tool_name:
-            if "kb_name" in args and "query" in args:
+            if "items" in args or "kb_names" in args:
+                tool_name = "batch_search"
+            elif "kb_name" in args and "query" in args:
                 tool_name = "kb_search"
             elif "query" in args:
                 tool_name = "auto_search"
@@ -396,46 +1584,67 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             "ListKnowledgeBases": "list_kbs",
             "SearchKnowledgeBase": "kb_search",
             "AutoSearchKnowledgeBase": "auto_search",
+            "BatchSearchKnowledgeBase": "batch_search",
+            "FederatedSearchKnowledgeBase": "federated_search",
         }
         tool_name = operation_mapping.get(tool_name, tool_name)
+        request_log.set(tool=tool_name)
         
-        print(f"Tool name: {tool_name}, Args: {json.dumps(args, ensure_ascii=False)}")
+        if args is not event:
+            logger.debug("tool args", tool=tool_name, args=args)
         
         # ハンドラーを取得して実行
         handler = TOOL_HANDLERS.get(tool_name)
         if not handler:
-            return {
-                "statusCode": 400,
-                "body": json.dumps({
-                    "error": f"Unknown tool: {tool_name}",
-                    "availableTools": list(TOOL_HANDLERS.keys())
-                }, ensure_ascii=False)
-            }
+            request_log.emit("WARNING", status=400, error="unknown tool")
+            return make_response(400, {
+                "error": f"Unknown tool: {tool_name}",
+                "availableTools": list(TOOL_HANDLERS.keys())
+            })
         
         # ツール実行
-        output = handler(args)
+        with handler_timer.stage("handler"):
+            output = handler(args)
         
         # 成功レスポンス
-        return {
-            "statusCode": 200,
-            "body": json.dumps(output, ensure_ascii=False)
-        }
+        # list_kbs はレジストリでシリアライズ済みの本文を使う
+        with handler_timer.stage("serialize"):
+            if handler is handle_list_kbs:
+                response = make_response(200, output, KB_REGISTRY.list_kbs_body)
+            else:
+                response = make_response(200, output)
+        emit_emf(handler_timer, {"Tool": tool_name, "ColdStart": str(cold_start).lower()})
+        request_log.timings.update(handler_timer.summary())
+        request_log.emit(
+            status=200,
+            count=output.get("count"),
+            cache=get_cache_stats,
+            bedrockClient=get_bedrock_client_stats,
+            resilience=get_resilience_stats,
+            rateLimit=get_rate_limit_stats,
+            singleFlight=RETRIEVE_FLIGHTS.stats
+        )
+        return response
     
+    except RateLimitExceeded as e:
+        # レート制限（Bedrockを呼ばずに止めた）
+        retry_after_ms = round(e.retry_after_sec * 1000)
+        request_log.emit("WARNING", status=429, error=str(e), retryAfterMs=retry_after_ms)
+        return make_response(429, {
+            "error": str(e),
+            "retryAfterMs": retry_after_ms
+        })
     except ValueError as e:
         # バリデーションエラー
-        return {
-            "statusCode": 400,
-            "body": json.dumps({
-                "error": str(e)
-            }, ensure_ascii=False)
-        }
+        request_log.emit("WARNING", status=400, error=str(e))
+        return make_response(400, {
+            "error": str(e)
+        })
     except Exception as e:
         # 内部エラー
         import traceback
-        return {
-            "statusCode": 500,
-            "body": json.dumps({
-                "error": str(e),
-                "traceback": traceback.format_exc()
-            }, ensure_ascii=False)
-        }
+        request_log.emit("ERROR", status=500, error=str(e), traceback=traceback.format_exc)
+        return make_response(500, {
+            "error": str(e),
+            "traceback": traceback.format_exc()
+        })
@@ -19,10 +19,51 @@ if ($LASTEXITCODE -ne 0) {
     exit 1
 }
 
+# orjson（オプション）: Lambda（Linux x86_64 / Python 3.12）用のwheelを取得する
+# KB_JSON_ORJSON=true のときだけ使う。取得できなくても json_codec が標準の json にフォールバックする
+pip install orjson -t $tempDir --platform manylinux2014_x86_64 --only-binary=:all: --python-version 3.12 --quiet
+if ($LASTEXITCODE -ne 0) {
+    Write-Host "⚠️  orjson をインストールできませんでした（標準の json を使用します）" -ForegroundColor Yellow
+}
+
 # 3. Pythonファイルをコピー
 Write-Host "📄 Pythonファイルをコピー中..." -ForegroundColor Cyan
 Copy-Item "lambda_function.py" $tempDir
 Copy-Item "kb_config.py" $tempDir
+Copy-Item "kb_registry.py" $tempDir
+Copy-Item "json_codec.py" $tempDir
+Copy-Item "structured_log.py" $tempDir
+Copy-Item "emf_metrics.py" $tempDir
+Copy-Item "resilience.py" $tempDir
+Copy-Item "rate_limit.py" $tempDir
+Copy-Item "single_flight.py" $tempDir
+Copy-Item "kb_router.py" $tempDir
+Copy-Item "cache_backends.py" $tempDir
+Copy-Item "query_fingerprint.py" $tempDir
+Copy-Item "result_merge.py" $tempDir
+Copy-Item "keyword_rescore.py" $tempDir
+Copy-Item "response_shaping.py" $tempDir
+Copy-Item "embedding_router.py" $tempDir
+
+# バイトコードを事前にコンパイルして同梱する
+# /var/task は書き込めないため、同梱しないとコールドスタートのたびに全モジュールがコンパイルされる。
+# .pyc はLambdaのランタイム（python3.12）と同じバージョンで作成したものだけが使われる。
+# ZIPで更新日時が変わっても使えるよう、ハッシュで検証しない形式（unchecked-hash）で作成する
+$pyVersion = python -c "import sys; print('%d.%d' % sys.version_info[:2])"
+if ($pyVersion -eq "3.12") {
+    Write-Host "⚙️  バイトコードをコンパイル中..." -ForegroundColor Cyan
+    python -m compileall -q --invalidation-mode unchecked-hash $tempDir
+} else {
+    Write-Host "⚠️  Python $pyVersion のためバイトコードを同梱しません（Lambdaは3.12）" -ForegroundColor Yellow
+}
+
+# 埋め込みルーターのインデックス（build_kb_embeddings.py で作成済みの場合のみ同梱）
+if (Test-Path "kb_centroids.npy") {
+    Write-Host "🧭 埋め込みルーターのインデックスを同梱します..." -ForegroundColor Cyan
+    pip install numpy -t $tempDir --quiet
+    Copy-Item "kb_centroids.npy" $tempDir
+    Copy-Item "kb_centroids.json" $tempDir
+}
 
 # 4. ZIPファイルを作成
 Write-Host "🗜️  ZIPファイルを作成中..." -ForegroundColor Cyan
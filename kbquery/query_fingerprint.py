@@ -0,0 +1,215 @@
+# kbquery/query_fingerprint.py
+"""
+クエリの正規化とフィンガープリント（近似重複クエリのキャッシュ共有用）
+
+- 正規化: NFKC（全角/半角の統一）・小文字化・句読点/記号/空白の除去
+- キーワード: 正規化して集合をソート（並び順の違いを吸収）
+- MinHash: 文字n-gramから署名を作り、Jaccard類似度を推定
+- アンカー: 数字・英数字の識別子（エラーコード、ID等）。違えば近似重複とみなさない
+- NearDuplicateIndex: LSH（バンド分割）で類似クエリのキャッシュキーを引く
+"""
+import hashlib
+import os
+import re
+import struct
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+# MinHashの設定
+MINHASH_NUM_PERM = 64
+MINHASH_BANDS = 16
+NGRAM_SIZE = 2
+
+# 類似度のしきい値（これ以上なら同じキャッシュを共有、1より大きければ無効）
+SIMILARITY_THRESHOLD = float(os.environ.get("KB_CACHE_SIMILARITY_THRESHOLD", "0.85"))
+
+# 正規化後のテキストから取り出すアンカー（英数字の連続）
+_ANCHOR_PATTERN = re.compile(r"[0-9a-z]+")
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def _make_permutations(num_perm: int) -> List[Tuple[int, int]]:
+    """MinHash用の (a, b) 係数を決定的に生成"""
+    perms = []
+    for i in range(num_perm):
+        digest = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", digest)
+        perms.append((a % (_MERSENNE_PRIME - 1) + 1, b % _MERSENNE_PRIME))
+    return perms
+
+
+_PERMUTATIONS = _make_permutations(MINHASH_NUM_PERM)
+
+
+def normalize_text(text: str) -> str:
+    """NFKC正規化・小文字化し、句読点・記号・空白を除去"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        ch for ch in text
+        if not unicodedata.category(ch).startswith(("P", "S", "Z", "C"))
+    )
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """文字n-gramの集合（n文字未満ならテキスト全体）"""
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def minhash_signature(shingles: Iterable[str]) -> Tuple[int, ...]:
+    """シングル集合からMinHash署名を計算"""
+    hashes = [
+        struct.unpack("<I", hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest())[0]
+        for s in shingles
+    ]
+    if not hashes:
+        return tuple([_MAX_HASH] * MINHASH_NUM_PERM)
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def estimate_similarity(sig1: Tuple[int, ...], sig2: Tuple[int, ...]) -> float:
+    """2つのMinHash署名からJaccard類似度を推定"""
+    if not sig1 or len(sig1) != len(sig2):
+        return 0.0
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / len(sig1)
+
+
+class QueryFingerprint:
+    """
+    サブクエリ + キーワードの正規化表現
+    
+    canonical: 完全一致キャッシュのキーに使う正規化文字列
+    signature: 近似重複検出に使うMinHash署名
+    anchors: 数字・識別子トークンを並べた文字列（近似重複はこれが一致する場合だけ）
+    """
+    
+    __slots__ = ("canonical", "signature", "anchors")
+    
+    def __init__(self, canonical: str, signature: Tuple[int, ...], anchors: str = ""):
+        self.canonical = canonical
+        self.signature = signature
+        self.anchors = anchors
+    
+    def near_scope(self, scope: str) -> str:
+        """
+        NearDuplicateIndex に渡すスコープ
+        
+        アンカーをスコープに含め、数字や識別子だけが違うクエリ
+        （例: エラーコード401と403）が近似重複としてヒットしないようにする。
+        """
+        return scope + "\x1f" + self.anchors
+
+
+def compute_fingerprint(sub_query: str, keywords: Iterable[str] = ()) -> QueryFingerprint:
+    """
+    サブクエリと抽出キーワードからフィンガープリントを作成
+    
+    Args:
+        sub_query: split_query で分解したサブクエリ
+        keywords: extract_keywords で抽出したキーワード（順不同）
+    """
+    text = normalize_text(sub_query)
+    keyword_set = sorted({normalize_text(kw) for kw in keywords} - {""})
+    canonical = text + "|" + " ".join(keyword_set)
+    
+    shingles = char_ngrams(text)
+    shingles.update(f"kw:{kw}" for kw in keyword_set)
+    anchors = " ".join(sorted(set(_ANCHOR_PATTERN.findall(text))))
+    return QueryFingerprint(canonical, minhash_signature(shingles), anchors)
+
+
+class NearDuplicateIndex:
+    """
+    MinHash署名 → キャッシュキーの近似検索インデックス
+    
+    署名をバンドに分割してバケットに登録し、同じバケットに入った候補だけ
+    類似度を計算する。scope（KB ID + retrieval config）が異なるものは比較しない。
+    コンテナ内のみで保持し、上限件数を超えたら古いものから削除する。
+    """
+    
+    def __init__(
+        self,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = 1024,
+        bands: int = MINHASH_BANDS
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self._rows = MINHASH_NUM_PERM // bands
+        self._entries: "OrderedDict[str, Tuple[str, Tuple[int, ...]]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, Tuple[int, ...]], Set[str]] = {}
+        self._lock = threading.Lock()
+    
+    def _band_keys(self, scope: str, signature: Tuple[int, ...]) -> List[Tuple[str, int, Tuple[int, ...]]]:
+        rows = self._rows
+        return [
+            (scope, band, signature[band * rows:(band + 1) * rows])
+            for band in range(self.bands)
+        ]
+    
+    def add(self, scope: str, signature: Tuple[int, ...], cache_key: str) -> None:
+        """キャッシュキーを登録"""
+        if self.threshold > 1 or self.max_entries <= 0:
+            return
+        with self._lock:
+            if cache_key in self._entries:
+                self._entries.move_to_end(cache_key)
+                return
+            self._entries[cache_key] = (scope, signature)
+            for band_key in self._band_keys(scope, signature):
+                self._buckets.setdefault(band_key, set()).add(cache_key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_scope, old_signature) = self._entries.popitem(last=False)
+                self._remove_from_buckets(old_key, old_scope, old_signature)
+    
+    def _remove_from_buckets(self, cache_key: str, scope: str, signature: Tuple[int, ...]) -> None:
+        for band_key in self._band_keys(scope, signature):
+            bucket = self._buckets.get(band_key)
+            if bucket is None:
+                continue
+            bucket.discard(cache_key)
+            if not bucket:
+                del self._buckets[band_key]
+    
+    def lookup(self, scope: str, signature: Tuple[int, ...]) -> Optional[Tuple[str, float]]:
+        """
+        しきい値以上で最も類似したキャッシュキーを返す
+        
+        Returns:
+            (キャッシュキー, 推定類似度) または None
+        """
+        if self.threshold > 1:
+            return None
+        with self._lock:
+            candidates: Set[str] = set()
+            for band_key in self._band_keys(scope, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+            
+            best: Optional[Tuple[str, float]] = None
+            for cache_key in candidates:
+                similarity = estimate_similarity(signature, self._entries[cache_key][1])
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (cache_key, similarity)
+            if best is not None:
+                self._entries.move_to_end(best[0])
+            return best
+    
+    def clear(self) -> None:
+        """全エントリを削除"""
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,127 @@
+# kbquery/rate_limit.py
+"""
+KBごとのクライアント側レート制限（トークンバケット）
+
+Bedrockのretrieve（リランキング含む）を呼ぶ前に1トークンを取得する。
+トークンがなければ、max_wait_sec 以内に補充される場合だけ待ち（短いキューイング）、
+それ以上かかる場合は RateLimitExceeded を送出して呼び出しを止める（429として返す）。
+Bedrock側でスロットリングされてからリトライするより、手前で止めた方が負荷が増えない。
+
+待ちは予約方式: 取得した時点でトークンを減らし（負になり得る）、待つべき時間を返すので、
+同時に待つ呼び出しは到着順に補充分を使う。
+ヘッジ（2本目）は try_acquire で待たずに取得できる場合だけ発行する（取得できなければヘッジしない）。
+
+制限はLambdaコンテナごと。アカウント全体の上限に合わせる場合は
+「コンテナ数（同時実行数）× rate」で見積もる。
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+
+# 既定値（KB設定で上書き可能）
+# 1秒あたりのretrieve数（0で無効）
+RATE_LIMIT_RPS = float(os.environ.get("KB_RATE_LIMIT_RPS", "0"))
+# バケットの容量（瞬間的に許容する呼び出し数、0なら rate と同じ）
+RATE_LIMIT_BURST = float(os.environ.get("KB_RATE_LIMIT_BURST", "0"))
+# トークンを待つ最大時間（ミリ秒、0なら待たずに即座に止める）
+RATE_LIMIT_MAX_WAIT_MS = float(os.environ.get("KB_RATE_LIMIT_MAX_WAIT_MS", "500"))
+
+
+class RateLimitExceeded(Exception):
+    """レート制限により呼び出さなかった"""
+    
+    def __init__(self, message: str, retry_after_sec: float):
+        super().__init__(message)
+        self.retry_after_sec = retry_after_sec
+
+
+class TokenBucket:
+    """
+    トークンバケット
+    
+    Args:
+        rate: 1秒あたりの補充トークン数
+        burst: バケットの容量（省略時は rate、最小1）
+        clock / sleep: 時刻と待機の関数（テストで差し替える）
+    """
+    
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.burst = max(1.0, burst if burst else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+        self._stats = {"acquired": 0, "waited": 0, "shed": 0, "denied": 0, "waitMs": 0.0}
+    
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def reserve(self, max_wait_sec: float) -> float:
+        """
+        1トークンを予約し、使えるようになるまでの秒数を返す
+        
+        Raises:
+            RateLimitExceeded: max_wait_sec 以内にトークンが補充されない（予約はしない）
+        """
+        with self._lock:
+            self._refill()
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if wait > max_wait_sec:
+                self._stats["shed"] += 1
+                raise RateLimitExceeded("rate limit exceeded", retry_after_sec=wait)
+            self._tokens -= 1
+            self._stats["acquired"] += 1
+            if wait > 0:
+                self._stats["waited"] += 1
+                self._stats["waitMs"] += wait * 1000
+            return wait
+    
+    def try_acquire(self) -> bool:
+        """
+        待たずに取得できる場合だけ1トークンを取得する（ヘッジなど、省略してよい呼び出し用）
+        
+        取得できなくても shed には数えない（denied に数える）。
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self._stats["denied"] += 1
+                return False
+            self._tokens -= 1
+            self._stats["acquired"] += 1
+            return True
+    
+    def acquire(self, max_wait_sec: float, deadline: Optional[float] = None) -> float:
+        """
+        1トークンを取得する（必要なら待つ）。待った秒数を返す
+        
+        Args:
+            max_wait_sec: 待つ最大時間
+            deadline: これ以降まで待たない時刻（time.monotonic基準）
+        """
+        if deadline is not None:
+            max_wait_sec = min(max_wait_sec, max(0.0, deadline - time.monotonic()))
+        wait = self.reserve(max_wait_sec)
+        if wait > 0:
+            self._sleep(wait)
+        return wait
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["waitMs"] = round(stats["waitMs"], 1)
+        return stats
@@ -0,0 +1,387 @@
+# kbquery/resilience.py
+"""
+Bedrock呼び出しの耐障害性レイヤー（リトライ・サーキットブレーカー・ヘッジリクエスト）
+
+- リトライ: スロットリング等の一時的なエラーだけを、ジッター付き指数バックオフ（full jitter）で
+  再試行する。Lambdaの残り時間（deadline）を超える待機はしない
+- サーキットブレーカー: KBごとに連続失敗を数え、しきい値に達したら一定時間呼び出さずに
+  CircuitOpenError を返す（呼び出し側は部分結果として扱う）。時間経過後に1回だけ試行し、
+  成功すれば閉じる
+- ヘッジリクエスト: 応答が遅い場合、p95相当の時間が経ったら同じ呼び出しをもう1本発行し、
+  先に返ってきた方を使う。1本目はキューに入れずにすぐ開始し（待ち時間はその開始から数える）、
+  2本目はヘッジ用プールに空きがあり、before_hedge（レート制限のトークン取得など）が許可したときだけ発行する
+
+AWSに依存しないため、偽クライアントでそのままテストできる。
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+
+# 既定値（KB設定で上書き可能）
+RETRY_MAX_ATTEMPTS = int(os.environ.get("KB_RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SEC = float(os.environ.get("KB_RETRY_BASE_DELAY_SEC", "0.1"))
+RETRY_MAX_DELAY_SEC = float(os.environ.get("KB_RETRY_MAX_DELAY_SEC", "2.0"))
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("KB_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SEC = float(os.environ.get("KB_BREAKER_RESET_SEC", "30"))
+
+# ヘッジ: 遅延を固定しない場合、直近の応答時間のp95を使う（サンプルが揃うまでヘッジしない）
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = int(os.environ.get("KB_HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = 200
+# 同時に実行できるヘッジ（2本目）の数。空きがなければヘッジしない
+HEDGE_MAX_WORKERS = int(os.environ.get("KB_HEDGE_MAX_WORKERS", "8"))
+
+# 再試行する（一時的な）エラー
+RETRYABLE_ERROR_CODES = frozenset({
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+})
+RETRYABLE_EXCEPTION_NAMES = frozenset({
+    "EndpointConnectionError",
+    "ConnectTimeoutError",
+    "ReadTimeoutError",
+    "ConnectionClosedError",
+})
+
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出さなかった"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """一時的なエラーか（botocoreの ClientError はエラーコード、接続エラーはクラス名で判定）"""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code in RETRYABLE_ERROR_CODES:
+            return True
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+        return status in (429, 500, 502, 503, 504)
+    return type(error).__name__ in RETRYABLE_EXCEPTION_NAMES or isinstance(error, TimeoutError)
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random) -> float:
+    """attempt回目（0始まり）の再試行までの待ち時間（full jitter）"""
+    return rng.uniform(0.0, min(cap, base * (2 ** attempt)))
+
+
+class CircuitBreaker:
+    """
+    連続失敗でしきい値に達したら開き、reset_sec 経過後に1回だけ試行を許す（half-open）
+    """
+    
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_sec: float = BREAKER_RESET_SEC,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+    
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._clock() - self._opened_at >= self.reset_sec:
+                return "half_open"
+            return "open"
+    
+    def allow(self) -> bool:
+        """呼び出してよいか（half-open では1本だけ許可）"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.reset_sec or self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+    
+    def release(self) -> None:
+        """呼び出さずに終わった half-open の試行枠を返す（成功・失敗として数えない）"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold > 0:
+                # half-open での失敗は再度開き直す
+                self._opened_at = self._clock()
+
+
+class LatencyTracker:
+    """直近の応答時間（秒）からパーセンタイルを求める"""
+    
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self._lock = threading.Lock()
+        self._samples: deque = deque(maxlen=window)
+    
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+    
+    def percentile(self, p: float, min_samples: int = HEDGE_MIN_SAMPLES) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < max(1, min_samples):
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+
+class HedgePool:
+    """
+    ヘッジ（2本目）専用のスレッドプール
+    
+    空きワーカーがないときは投入せずに None を返す（キューで待ったヘッジは遅すぎて役に立たず、
+    負荷だけが増えるため）。
+    """
+    
+    def __init__(self, max_workers: int = HEDGE_MAX_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="kb-hedge")
+        self._slots = threading.BoundedSemaphore(max(1, max_workers))
+    
+    def try_submit(self, fn: Callable[[], Any], admit: Optional[Callable[[], bool]] = None) -> Optional[Future]:
+        """
+        空きワーカーがあれば fn を投入する
+        
+        admit を渡すと、空きを確保した後に呼び、False なら投入しない
+        （空きがないときはトークンなどを消費しないように、確保後に呼ぶ）。
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            if admit is not None and not admit():
+                self._slots.release()
+                return None
+            future = self._executor.submit(fn)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+# ヘッジ用のスレッドプール（コンテナ内で共有）
+_hedge_pool: Optional[HedgePool] = None
+_hedge_pool_lock = threading.Lock()
+
+
+def _get_hedge_pool() -> HedgePool:
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = HedgePool()
+        return _hedge_pool
+
+
+class ResilientCaller:
+    """
+    1つのKBへの呼び出しに、リトライ・サーキットブレーカー・ヘッジを適用する
+    
+    Args:
+        max_attempts: 最大試行回数（初回を含む）
+        base_delay_sec / max_delay_sec: バックオフの基準値と上限
+        breaker: サーキットブレーカー（省略時は既定値で作成）
+        hedge: ヘッジリクエストを使うか
+        hedge_delay_sec: ヘッジを発行するまでの時間（省略時は直近のp95）
+        sleep: 待機関数（テストで差し替える）
+    """
+    
+    def __init__(
+        self,
+        max_attempts: int = RETRY_MAX_ATTEMPTS,
+        base_delay_sec: float = RETRY_BASE_DELAY_SEC,
+        max_delay_sec: float = RETRY_MAX_DELAY_SEC,
+        breaker: Optional[CircuitBreaker] = None,
+        hedge: bool = False,
+        hedge_delay_sec: Optional[float] = None,
+        hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Optional[random.Random] = None
+    ):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay_sec = base_delay_sec
+        self.max_delay_sec = max_delay_sec
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.hedge = hedge
+        self.hedge_delay_sec = hedge_delay_sec
+        self.hedge_min_samples = hedge_min_samples
+        self.latency = LatencyTracker()
+        self._sleep = sleep
+        self._rng = rng if rng is not None else random.Random()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "calls": 0, "retries": 0, "failures": 0, "rejected": 0,
+            "hedges": 0, "hedgeWins": 0, "hedgesSkipped": 0,
+        }
+    
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats: Dict[str, Any] = dict(self._stats)
+        stats["breaker"] = self.breaker.state
+        return stats
+    
+    def current_hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        if self.hedge_delay_sec is not None:
+            return self.hedge_delay_sec
+        return self.latency.percentile(HEDGE_PERCENTILE, self.hedge_min_samples)
+    
+    def call(
+        self,
+        fn: Callable[[], Any],
+        deadline: Optional[float] = None,
+        before_attempt: Optional[Callable[[], Any]] = None,
+        before_hedge: Optional[Callable[[], bool]] = None,
+        on_backoff: Optional[Callable[[float], Any]] = None
+    ) -> Any:
+        """
+        fn を実行する
+        
+        Args:
+            fn: 実行する呼び出し
+            deadline: これ以降は再試行しない時刻（time.monotonic基準）
+            before_attempt: 各試行（再試行を含む）の直前に呼ぶ関数（レート制限のトークン取得など）。
+                例外を送出した場合は fn を呼ばずにそのまま送出する（ブレーカーの失敗には数えない）
+            before_hedge: ヘッジ（2本目）を発行する直前に呼ぶ関数。False を返したらヘッジしない
+                （レート制限のトークンを待たずに取得できたときだけヘッジする、など）
+            on_backoff: 再試行前の待機の直前に、待機秒数を渡して呼ぶ関数（待ち時間の記録用）
+        
+        Raises:
+            CircuitOpenError: ブレーカーが開いている
+            その他: 再試行しないエラー、または再試行を使い切ったときの最後のエラー
+        """
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError("circuit breaker is open")
+        
+        for attempt in range(self.max_attempts):
+            if before_attempt is not None:
+                try:
+                    before_attempt()
+                except Exception:
+                    self.breaker.release()
+                    raise
+            self._count("calls")
+            try:
+                result = self._call_once(fn, before_hedge)
+            except Exception as e:
+                if not is_retryable(e):
+                    # リクエスト自体の誤りはKBの障害として数えない
+                    self.breaker.record_success()
+                    raise
+                delay = backoff_delay(attempt, self.base_delay_sec, self.max_delay_sec, self._rng)
+                out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+                if attempt == self.max_attempts - 1 or out_of_time:
+                    self._count("failures")
+                    self.breaker.record_failure()
+                    raise
+                self._count("retries")
+                if on_backoff is not None:
+                    on_backoff(delay)
+                self._sleep(delay)
+                continue
+            self.breaker.record_success()
+            return result
+    
+    def _call_once(self, fn: Callable[[], Any], before_hedge: Optional[Callable[[], bool]] = None) -> Any:
+        hedge_delay = self.current_hedge_delay()
+        if hedge_delay is None:
+            start = time.monotonic()
+            result = fn()
+            self.latency.add(time.monotonic() - start)
+            return result
+        return self._call_hedged(fn, hedge_delay, before_hedge)
+    
+    def _call_hedged(
+        self,
+        fn: Callable[[], Any],
+        hedge_delay: float,
+        before_hedge: Optional[Callable[[], bool]] = None
+    ) -> Any:
+        """
+        1本目の開始から hedge_delay 秒経っても応答がなければ2本目を発行し、先に成功した方を返す
+        
+        1本目は共有プールに入れず専用スレッドですぐに開始する（プールの待ち時間を遅延と
+        見なしてヘッジしないように）。呼び出し元のスレッドは結果を待つだけなので、
+        ヘッジが先に返れば1本目の完了を待たずに戻れる。
+        ヘッジ用プールに空きがない、または before_hedge が False を返した場合はヘッジしない。
+        """
+        primary: Future = Future()
+        # 実行中にしておく（ヘッジが勝ったときの cancel() で CANCELLED にならないように）
+        primary.set_running_or_notify_cancel()
+        started = threading.Event()
+        started_at = [0.0]
+        
+        def timed() -> Any:
+            start = time.monotonic()
+            result = fn()
+            self.latency.add(time.monotonic() - start)
+            return result
+        
+        def run_primary() -> None:
+            started_at[0] = time.monotonic()
+            started.set()
+            try:
+                primary.set_result(timed())
+            except BaseException as e:
+                primary.set_exception(e)
+        
+        threading.Thread(target=run_primary, name="kb-primary", daemon=True).start()
+        started.wait()
+        remaining = started_at[0] + hedge_delay - time.monotonic()
+        done, _ = wait([primary], timeout=max(0.0, remaining))
+        if done:
+            return primary.result()
+        
+        hedged = _get_hedge_pool().try_submit(timed, before_hedge)
+        if hedged is None:
+            self._count("hedgesSkipped")
+            return primary.result()
+        
+        self._count("hedges")
+        pending = {primary, hedged}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedged:
+                        self._count("hedgeWins")
+                    # 残った方は結果を使わない（実行中のものは止められないので放置する）
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error  # type: ignore
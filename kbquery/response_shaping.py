@@ -0,0 +1,146 @@
+# kbquery/response_shaping.py
+"""
+検索結果のレスポンスサイズ制御
+
+チャンク本文はそのままLLMの入力トークンになるため、返す量を以下の方法で絞る。
+
+- full: 本文をそのまま返す（従来の動作）
+- truncate: 先頭から max_chars 文字で切り詰める
+- snippet: キーワードの前後 KB_SNIPPET_WINDOW_CHARS 文字だけを抜き出す
+  （キーワードが見つからなければ truncate と同じ）
+
+さらに max_bytes を指定すると、結果全体の本文のUTF-8バイト数がその範囲に収まるように、
+順位の低い結果から削る。
+既定値は環境変数、KB設定（content_mode / max_chars_per_result / max_response_bytes）、
+リクエスト引数の順に上書きする。
+"""
+import os
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from keyword_rescore import compile_terms
+
+
+CONTENT_MODES = ("full", "truncate", "snippet")
+
+# 既定値（0は無制限）
+DEFAULT_CONTENT_MODE = os.environ.get("KB_CONTENT_MODE", "full")
+DEFAULT_MAX_CHARS = int(os.environ.get("KB_MAX_CHARS_PER_RESULT", "0"))
+DEFAULT_MAX_RESPONSE_BYTES = int(os.environ.get("KB_MAX_RESPONSE_BYTES", "0"))
+
+# スニペットでキーワードの前後に含める文字数
+SNIPPET_WINDOW_CHARS = int(os.environ.get("KB_SNIPPET_WINDOW_CHARS", "80"))
+
+ELLIPSIS = "…"
+
+
+def resolve_shaping(
+    kb_config: Mapping[str, Any],
+    content_mode: Optional[str] = None,
+    max_chars: Optional[int] = None,
+    max_bytes: Optional[int] = None
+) -> Dict[str, Any]:
+    """リクエスト引数 → KB設定 → 環境変数の順で整形オプションを決める"""
+    if content_mode is None:
+        content_mode = kb_config.get("content_mode", DEFAULT_CONTENT_MODE)
+    if content_mode not in CONTENT_MODES:
+        raise ValueError(f"Unknown content mode: {content_mode}")
+    if max_chars is None:
+        max_chars = kb_config.get("max_chars_per_result", DEFAULT_MAX_CHARS)
+    if max_bytes is None:
+        max_bytes = kb_config.get("max_response_bytes", DEFAULT_MAX_RESPONSE_BYTES)
+    return {
+        "content_mode": content_mode,
+        "max_chars": max(0, int(max_chars)),
+        "max_bytes": max(0, int(max_bytes)),
+    }
+
+
+def truncate_text(text: str, max_chars: int) -> str:
+    """先頭から max_chars 文字で切り詰める（0は無制限）"""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return text
+    return text[:max_chars] + ELLIPSIS
+
+
+def extract_snippet(
+    text: str,
+    keywords: Sequence[str],
+    max_chars: int = 0,
+    window: int = SNIPPET_WINDOW_CHARS
+) -> str:
+    """
+    キーワードの出現位置の前後 window 文字を抜き出して連結する
+    
+    重なる範囲は1つにまとめる。キーワードが見つからない場合は先頭から切り詰める
+    （max_chars が0なら window の2倍）。
+    """
+    pattern = compile_terms(keywords)
+    spans: List[Tuple[int, int]] = []
+    if pattern is not None:
+        for match in pattern.finditer(text):
+            start = max(0, match.start() - window)
+            end = min(len(text), match.end() + window)
+            if spans and start <= spans[-1][1]:
+                spans[-1] = (spans[-1][0], max(spans[-1][1], end))
+            else:
+                spans.append((start, end))
+    
+    if not spans:
+        return truncate_text(text, max_chars or window * 2)
+    
+    pieces = []
+    for start, end in spans:
+        piece = text[start:end]
+        if start > 0:
+            piece = ELLIPSIS + piece
+        if end < len(text):
+            piece = piece + ELLIPSIS
+        pieces.append(piece)
+    return truncate_text("".join(pieces).replace(ELLIPSIS * 2, ELLIPSIS), max_chars)
+
+
+def shape_results(
+    results: List[Dict[str, Any]],
+    keywords: Sequence[str],
+    content_mode: str = "full",
+    max_chars: int = 0,
+    max_bytes: int = 0
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    結果の本文を整形し、全体のバイト数の上限を適用する
+    
+    元の結果は変更しない。本文を削った結果には truncated: True を付ける。
+    
+    Returns:
+        (整形後の結果, いずれかの結果を削ったか)
+    """
+    if content_mode == "full" and max_chars <= 0 and max_bytes <= 0:
+        return results, False
+    
+    shaped = []
+    any_truncated = False
+    remaining = max_bytes
+    for result in results:
+        content = result.get("content", "")
+        if content_mode == "snippet":
+            new_content = extract_snippet(content, keywords, max_chars)
+        else:
+            new_content = truncate_text(content, max_chars)
+        
+        if max_bytes > 0:
+            encoded = new_content.encode("utf-8")
+            if len(encoded) > remaining:
+                new_content = encoded[:remaining].decode("utf-8", "ignore")
+                if not new_content:
+                    # 予算を使い切ったら残りの結果は返さない
+                    any_truncated = True
+                    break
+            remaining -= len(new_content.encode("utf-8"))
+        
+        item = dict(result)
+        if new_content != content:
+            item["content"] = new_content
+            item["truncated"] = True
+            any_truncated = True
+        shaped.append(item)
+    return shaped, any_truncated
@@ -0,0 +1,116 @@
+# kbquery/result_merge.py
+"""
+複数サブクエリの検索結果をマージするエンジン
+
+戦略:
+- max: チャンクごとに最大スコアを採用（従来の動作）
+- rrf: Reciprocal Rank Fusion（順位のみを使うのでスコアの尺度に依存しない）
+- weighted: サブクエリごとの重み付きスコア和（重みは呼び出し側が渡す。省略時は均等）
+
+重複判定はS3 URIではなくチャンク単位で行い、同じドキュメントの別チャンクは別の結果として扱う。
+上位k件の選択はヒープ（heapq.nlargest）で行い、全件ソートは行わない。
+"""
+import heapq
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+
+# RRFの定数（大きいほど下位の結果も重視）
+RRF_K = 60
+
+MERGE_STRATEGIES = ("max", "rrf", "weighted")
+
+
+def chunk_identity(result: Dict[str, Any]) -> Hashable:
+    """
+    結果のチャンクを識別するキー
+    
+    BedrockのチャンクIDがあればそれを使い、なければ (ソースURI, 本文) を使う。
+    本文はハッシュ値を計算せずにそのままキーにする（文字列のハッシュはPythonが
+    オブジェクトごとにキャッシュし、比較はハッシュが一致したときだけ行われる）。
+    """
+    return result.get("chunkId") or (result.get("source", ""), result.get("content", ""))
+
+
+def rrf_score(rank: int, k: int = RRF_K) -> float:
+    """順位（1始まり）からRRFスコアを計算"""
+    return 1.0 / (k + rank)
+
+
+def merge_ranked_lists(
+    result_lists: Sequence[List[Dict[str, Any]]],
+    max_results: int,
+    strategy: str = "max",
+    rrf_k: int = RRF_K,
+    weights: Optional[Sequence[float]] = None
+) -> List[Dict[str, Any]]:
+    """
+    サブクエリごとの結果リストをマージして上位max_results件を返す
+    
+    Args:
+        result_lists: サブクエリごとの結果（各リストはスコア順）
+        max_results: 返す件数
+        strategy: max / rrf / weighted
+        rrf_k: RRFの定数
+        weights: weighted のときのサブクエリごとの重み（result_lists と同じ長さ、省略時は均等）
+    
+    Returns:
+        マージ後の結果（rrf / weighted では score が統合スコアに置き換わる）
+    """
+    if strategy not in MERGE_STRATEGIES:
+        raise ValueError(f"Unknown merge strategy: {strategy}")
+    if weights is not None and len(weights) != len(result_lists):
+        raise ValueError("weights must have the same length as result_lists")
+    if max_results <= 0:
+        return []
+    
+    if strategy == "max":
+        # チャンクごとにスコアが最大のものを残す（同点は先に出たものを優先）
+        # 件数が多いので、chunk_identity の呼び出しと辞書の二重引きを避けてループ内で展開する
+        best: Dict[Hashable, Dict[str, Any]] = {}
+        best_scores: Dict[Hashable, float] = {}
+        for results in result_lists:
+            for result in results:
+                key = result.get("chunkId") or (result.get("source", ""), result.get("content", ""))
+                score = result.get("score", 0)
+                previous = best_scores.get(key)
+                if previous is None or score > previous:
+                    best[key] = result
+                    best_scores[key] = score
+        top_keys = heapq.nlargest(max_results, best_scores, key=best_scores.__getitem__)
+        return [best[key] for key in top_keys]
+    
+    if strategy == "weighted":
+        if weights is None:
+            weights = [1.0 / len(result_lists)] * len(result_lists) if result_lists else []
+        # チャンクごとに重み付きスコアを合算（代表の結果は最初に出たものを使う）
+        totals: Dict[Hashable, float] = {}
+        representatives: Dict[Hashable, Dict[str, Any]] = {}
+        for results, weight in zip(result_lists, weights):
+            for result in results:
+                key = result.get("chunkId") or (result.get("source", ""), result.get("content", ""))
+                contribution = weight * result.get("score", 0)
+                total = totals.get(key)
+                if total is None:
+                    totals[key] = contribution
+                    representatives[key] = result
+                else:
+                    totals[key] = total + contribution
+        top_keys = heapq.nlargest(max_results, totals, key=totals.__getitem__)
+        return [dict(representatives[key], score=totals[key]) for key in top_keys]
+    
+    # チャンクごとにRRFスコアを合算（代表の結果は最初に出たものを使う）
+    totals = {}
+    representatives = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = result.get("chunkId") or (result.get("source", ""), result.get("content", ""))
+            contribution = 1.0 / (rrf_k + rank)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = contribution
+                representatives[key] = result
+            else:
+                totals[key] = total + contribution
+    
+    top_keys = heapq.nlargest(max_results, totals, key=totals.__getitem__)
+    return [dict(representatives[key], score=totals[key]) for key in top_keys]
@@ -0,0 +1,72 @@
+# kbquery/single_flight.py
+"""
+同一呼び出しのまとめ（single-flight）
+
+同じキーの呼び出しが実行中のときは、新たに実行せず、先に始まった呼び出しの
+結果（または例外）を共有する。完了したキーは忘れるので、次の呼び出しは新たに実行する
+（retain=True の場合は完了後も結果を保持する。バッチ検索1回分など、寿命の短いスコープ用）。
+
+Lambda（kbquery）とエージェント（agentcore）で共通。agentcore には deploy.ps1 がコピーする。
+"""
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Tuple
+
+
+def make_key(name: str, arguments: Dict[str, Any]) -> str:
+    """名前と引数から、引数の順序に依存しないキーを作る"""
+    return name + ":" + json.dumps(arguments, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class SingleFlight:
+    """
+    キーごとに実行中の呼び出しを1回にまとめる
+    
+    Args:
+        retain: 完了後も結果を保持し、以降の同じキーにも共有するか
+    """
+    
+    def __init__(self, retain: bool = False):
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._stats = {"calls": 0, "coalesced": 0}
+    
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        キーごとに fn を1回だけ実行する
+        
+        Returns:
+            (結果, 他の呼び出しの結果を共有したか)
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._futures[key] = future
+            else:
+                self._stats["coalesced"] += 1
+        
+        if owner:
+            try:
+                future.set_result(fn())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                if not self.retain:
+                    with self._lock:
+                        self._futures.pop(key, None)
+        return future.result(), not owner
+    
+    @property
+    def coalesced(self) -> int:
+        """他の呼び出しの結果を共有した回数"""
+        with self._lock:
+            return self._stats["coalesced"]
+    
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "inFlight": 0 if self.retain else len(self._futures)}
@@ -0,0 +1,170 @@
+# kbquery/test_cache_backends.py
+"""
+キャッシュバックエンドのローカルテスト（AWS不要）
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from cache_backends import (
+    FileCacheBackend,
+    MemoryCacheBackend,
+    SqliteCacheBackend,
+    create_cache_backend,
+    deserialize_results,
+    serialize_results,
+)
+
+
+SAMPLE_RESULTS = [
+    {"content": "認証機能の使い方", "score": 0.9, "source": "s3://bucket/auth.md"},
+    {"content": "パスワードリセット手順", "score": 0.7, "source": "s3://bucket/reset.md"},
+]
+
+
+def check_backend(backend):
+    """両バックエンド共通の動作確認"""
+    assert backend.get("missing") is None
+    
+    backend.put("key1", SAMPLE_RESULTS, ttl=60)
+    assert backend.get("key1") == SAMPLE_RESULTS
+    
+    # TTL 0 は保存しない
+    backend.put("key2", SAMPLE_RESULTS, ttl=0)
+    assert backend.get("key2") is None
+    
+    # 期限切れは返さない
+    backend.put("key3", SAMPLE_RESULTS, ttl=0.05)
+    time.sleep(0.1)
+    assert backend.get("key3") is None
+    
+    backend.clear()
+    assert backend.get("key1") is None
+
+
+def check_lru_eviction(backend):
+    """上限を超えたら最も古く参照されたものから削除される"""
+    backend.put("a", SAMPLE_RESULTS, ttl=60)
+    time.sleep(0.01)
+    backend.put("b", SAMPLE_RESULTS, ttl=60)
+    time.sleep(0.01)
+    backend.get("a")  # aを最近使ったことにする
+    time.sleep(0.01)
+    backend.put("c", SAMPLE_RESULTS, ttl=60)
+    
+    assert backend.get("a") is not None
+    assert backend.get("b") is None
+    assert backend.get("c") is not None
+    assert len(backend) == 2
+
+
+def test_serialization_roundtrip():
+    """シリアライズ結果が元に戻り、非圧縮JSONより小さいこと"""
+    print("=== シリアライズ ===")
+    payload = serialize_results(SAMPLE_RESULTS * 20)
+    assert deserialize_results(payload) == SAMPLE_RESULTS * 20
+    print(f"圧縮後サイズ: {len(payload)} bytes")
+
+
+def test_memory_backend():
+    """メモリバックエンド"""
+    print("=== MemoryCacheBackend ===")
+    check_backend(MemoryCacheBackend(max_entries=10))
+    check_lru_eviction(MemoryCacheBackend(max_entries=2))
+
+
+def test_sqlite_backend():
+    """SQLiteバックエンド"""
+    print("=== SqliteCacheBackend ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SqliteCacheBackend(path=os.path.join(tmp, "cache.sqlite3"), max_entries=10)
+        check_backend(backend)
+        backend.close()
+        
+        backend = SqliteCacheBackend(path=os.path.join(tmp, "lru.sqlite3"), max_entries=2)
+        check_lru_eviction(backend)
+        backend.close()
+
+
+def test_file_backend():
+    """ファイルバックエンド"""
+    print("=== FileCacheBackend ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        check_backend(FileCacheBackend(directory=os.path.join(tmp, "cache"), max_entries=10))
+        check_lru_eviction(FileCacheBackend(directory=os.path.join(tmp, "lru"), max_entries=2))
+
+
+def test_file_backend_shared_across_processes():
+    """別プロセスが書いたエントリを読めて、書き込み中の一時ファイルは見えないこと"""
+    print("=== FileCacheBackend 共有 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = os.path.join(tmp, "shared")
+        reader = FileCacheBackend(directory=directory)
+        script = (
+            "import sys\n"
+            "from cache_backends import FileCacheBackend\n"
+            "backend = FileCacheBackend(directory=sys.argv[1])\n"
+            "for i in range(20):\n"
+            "    backend.put('shared', [{'content': str(i)}] * 50, ttl=60)\n"
+        )
+        writers = [
+            subprocess.Popen(
+                [sys.executable, "-c", script, directory],
+                cwd=os.path.dirname(os.path.abspath(__file__))
+            )
+            for _ in range(2)
+        ]
+        # 書き込み中に読んでも、壊れたエントリは返らない
+        while any(writer.poll() is None for writer in writers):
+            results = reader.get("shared")
+            assert results is None or len(results) == 50
+        assert all(writer.returncode == 0 for writer in writers)
+        assert reader.get("shared") == [{"content": "19"}] * 50
+        assert len(reader) == 1
+
+
+def test_sqlite_backend_shared():
+    """同じファイルを開いた別インスタンス（同じホストの別プロセス相当）から読めること"""
+    print("=== SqliteCacheBackend 共有 ===")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "shared", "cache.sqlite3")
+        writer = SqliteCacheBackend(path=path)
+        reader = SqliteCacheBackend(path=path)
+        
+        writer.put("shared", SAMPLE_RESULTS, ttl=60)
+        assert reader.get("shared") == SAMPLE_RESULTS
+        
+        writer.close()
+        reader.close()
+
+
+def test_create_cache_backend():
+    """設定名からのバックエンド作成"""
+    print("=== create_cache_backend ===")
+    assert isinstance(create_cache_backend("memory"), MemoryCacheBackend)
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = create_cache_backend("file", directory=os.path.join(tmp, "files"))
+        assert isinstance(backend, FileCacheBackend)
+        backend = create_cache_backend("sqlite", path=os.path.join(tmp, "c.sqlite3"))
+        assert isinstance(backend, SqliteCacheBackend)
+        backend.close()
+    
+    try:
+        create_cache_backend("redis")
+    except ValueError as e:
+        print(f"想定どおりのエラー: {e}")
+    else:
+        raise AssertionError("unknown backend should raise ValueError")
+
+
+if __name__ == "__main__":
+    test_serialization_roundtrip()
+    test_memory_backend()
+    test_sqlite_backend()
+    test_file_backend()
+    test_file_backend_shared_across_processes()
+    test_sqlite_backend_shared()
+    test_create_cache_backend()
+    print("✅ すべてのテストが完了しました")
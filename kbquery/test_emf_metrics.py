@@ -0,0 +1,80 @@
+# kbquery/test_emf_metrics.py
+"""
+段階ごとの計測とEMF出力のローカルテスト（AWS不要）
+"""
+import contextlib
+import io
+import json
+import threading
+
+from emf_metrics import StageTimer, build_emf, emit_emf, metric_name
+
+
+def test_metric_name():
+    print("=== metric_name ===")
+    assert metric_name("retrieve") == "RetrieveLatency"
+    assert metric_name("build_agent") == "BuildAgentLatency"
+
+
+def test_build_emf():
+    """EMFの _aws メタデータ・ディメンション・値の配列が正しいこと"""
+    print("=== build_emf ===")
+    timer = StageTimer()
+    timer.record("analyze", 0.5)
+    timer.record("retrieve", 120.0)
+    timer.record("retrieve", 80.0)
+    timer.count("RetrieveCalls", 2)
+    
+    record = build_emf(timer, {"KbName": "faq", "ColdStart": "true"}, namespace="Test", timestamp_ms=1)
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert record["_aws"]["Timestamp"] == 1
+    assert directive["Namespace"] == "Test"
+    assert directive["Dimensions"] == [["KbName", "ColdStart"]]
+    assert {"Name": "RetrieveLatency", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert {"Name": "RetrieveCalls", "Unit": "Count"} in directive["Metrics"]
+    assert record["KbName"] == "faq" and record["ColdStart"] == "true"
+    assert record["AnalyzeLatency"] == 0.5
+    assert record["RetrieveLatency"] == [120.0, 80.0]
+    assert record["RetrieveCalls"] == 2
+    # 宣言したメトリクスはすべてレコードに値がある
+    for metric in directive["Metrics"]:
+        assert metric["Name"] in record
+
+
+def test_emit_emf_single_line():
+    """1行のJSONとして出力されること"""
+    print("=== emit_emf ===")
+    timer = StageTimer()
+    with timer.stage("merge"):
+        pass
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        emit_emf(timer, {"Tool": "kb_search", "ColdStart": "false"})
+    lines = buffer.getvalue().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["Tool"] == "kb_search"
+
+
+def test_timer_threads_and_summary():
+    """複数スレッドから記録でき、summary に回数・最大値が出ること"""
+    print("=== StageTimer ===")
+    timer = StageTimer()
+    threads = [threading.Thread(target=timer.record, args=("retrieve", float(i))) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    timer.record("merge", 1.0)
+    summary = timer.summary()
+    assert summary["merge"] == 1.0
+    assert summary["retrieve"]["count"] == 8
+    assert summary["retrieve"]["maxMs"] == 7.0
+    assert summary["retrieve"]["totalMs"] == 28.0
+
+
+if __name__ == "__main__":
+    test_metric_name()
+    test_build_emf()
+    test_emit_emf_single_line()
+    test_timer_threads_and_summary()
+    print("✅ すべてのテストが完了しました")
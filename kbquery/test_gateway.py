@@ -5,7 +5,7 @@ Gateway対応Lambda関数のローカルテスト
 実際のGatewayを使わずに、Lambda関数を直接呼び出してテスト
 """
 import json
-from lambda_function import lambda_handler
+from lambda_function import lambda_handler, parse_response
 
 
 def test_list_knowledge_bases():
@@ -19,9 +19,9 @@ def test_list_knowledge_bases():
         "input": {}
     }
     
-    result = lambda_handler(event, None)
-    print(f"ステータスコード: {result['statusCode']}")
-    print(f"レスポンス:\n{json.dumps(json.loads(result['body']), indent=2, ensure_ascii=False)}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"ステータスコード: {status}")
+    print(f"レスポンス:\n{json.dumps(body, indent=2, ensure_ascii=False)}")
     print()
 
 
@@ -40,11 +40,10 @@ def test_search_knowledge_base():
         }
     }
     
-    result = lambda_handler(event, None)
-    print(f"ステータスコード: {result['statusCode']}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"ステータスコード: {status}")
     
-    body = json.loads(result['body'])
-    if result['statusCode'] == 200:
+    if status == 200:
         search_result = body.get('result', {})
         print(f"KB名: {search_result.get('kbName')}")
         print(f"クエリ: {search_result.get('query')}")
@@ -75,11 +74,10 @@ def test_auto_search_knowledge_base():
         }
     }
     
-    result = lambda_handler(event, None)
-    print(f"ステータスコード: {result['statusCode']}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"ステータスコード: {status}")
     
-    body = json.loads(result['body'])
-    if result['statusCode'] == 200:
+    if status == 200:
         print(f"選択されたKB: {body.get('selectedKb')}")
         search_result = body.get('result', {})
         print(f"ヒット数: {search_result.get('count')}")
@@ -107,9 +105,9 @@ def test_validation_error():
         }
     }
     
-    result = lambda_handler(event, None)
-    print(f"ステータスコード: {result['statusCode']}")
-    print(f"エラーメッセージ: {json.loads(result['body'])}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"ステータスコード: {status}")
+    print(f"エラーメッセージ: {body}")
     print()
 
 
@@ -124,9 +122,9 @@ def test_unknown_operation():
         "input": {}
     }
     
-    result = lambda_handler(event, None)
-    print(f"ステータスコード: {result['statusCode']}")
-    print(f"エラーメッセージ: {json.loads(result['body'])}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"ステータスコード: {status}")
+    print(f"エラーメッセージ: {body}")
     print()
 
 
@@ -0,0 +1,62 @@
+# kbquery/test_json_codec.py
+"""
+JSONコーデックのローカルテスト（AWS不要、orjson の有無どちらでも動く）
+"""
+import json
+import os
+import subprocess
+import sys
+
+import json_codec
+
+PAYLOAD = {
+    "kbName": "product_docs",
+    "results": [
+        {"content": "認証の「設定」手順\n\"API\" キー", "score": 0.87, "source": "s3://a", "cached": False},
+    ],
+    "count": 1,
+    "partial": None,
+}
+
+
+def test_round_trip():
+    """dumps → loads で元に戻り、標準の json でも読めること"""
+    print(f"=== round trip ({json_codec.backend_name()}) ===")
+    text = json_codec.dumps(PAYLOAD)
+    assert json_codec.loads(text) == PAYLOAD
+    assert json.loads(text) == PAYLOAD
+    assert json_codec.loads(json_codec.dumps_bytes(PAYLOAD)) == PAYLOAD
+
+
+def test_compact_unescaped():
+    """日本語をエスケープせず、区切り文字に空白を入れないこと"""
+    print("=== compact ===")
+    text = json_codec.dumps(PAYLOAD)
+    assert "認証" in text
+    assert "\\u" not in text
+    assert ", " not in text and '": ' not in text
+    assert json_codec.dumps_bytes(PAYLOAD) == text.encode("utf-8")
+
+
+def test_orjson_is_not_imported_by_default():
+    """KB_JSON_ORJSON を指定しなければ、シリアライズしても orjson を読み込まないこと"""
+    print("=== orjson の遅延読み込み ===")
+    env = {key: value for key, value in os.environ.items() if key != "KB_JSON_ORJSON"}
+    output = subprocess.run(
+        [sys.executable, "-c",
+         "import sys, json_codec; json_codec.loads(json_codec.dumps({'a': 1})); "
+         "print('orjson' in sys.modules, json_codec.backend_name())"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    ).stdout.split()
+    assert output == ["False", "compact"]
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_compact_unescaped()
+    test_orjson_is_not_imported_by_default()
+    print("✅ すべてのテストが完了しました")
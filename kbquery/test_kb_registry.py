@@ -0,0 +1,105 @@
+# kbquery/test_kb_registry.py
+"""
+KBレジストリ（検証・変更不可・retrieval config のキャッシュ）のローカルテスト（AWS不要）
+"""
+import json
+
+from kb_registry import KBConfigError, KnowledgeBase, load_registry
+from kb_router import KBRouter
+from response_shaping import resolve_shaping
+
+
+KNOWLEDGE_BASES = {
+    "manual": {
+        "id": "AAAAAAAAAA",
+        "description": "認証機能マニュアル",
+        "rerank": True,
+        "rerank_model": "COHERE",
+        "content_mode": "snippet",
+        "routing_terms": {"ログイン": 2, "認証": 1},
+    },
+    "faq": {
+        "id": "BBBBBBBBBB",
+        "description": "よくある質問",
+        "routing_terms": ["faq", "質問"],
+    },
+}
+
+
+def test_validation_reports_all_errors():
+    """未知のキー・型の誤り・IDの形式をまとめて報告すること"""
+    print("=== 設定の検証 ===")
+    broken = {
+        "manual": {"id": "short", "description": "x", "cache_tll": 300},
+        "faq": {"id": "BBBBBBBBBB", "description": "y", "early_stop": "yes", "merge_strategy": "avg"},
+    }
+    try:
+        load_registry(broken)
+        assert False, "KBConfigError expected"
+    except KBConfigError as e:
+        message = str(e)
+    for expected in ("manual.id", "manual.cache_tll: unknown setting", "faq.early_stop", "faq.merge_strategy"):
+        assert expected in message, (expected, message)
+
+
+def test_entries_are_immutable():
+    """属性の代入・ネストした設定の変更ができないこと"""
+    print("=== 変更不可 ===")
+    kb = load_registry(KNOWLEDGE_BASES)["manual"]
+    assert isinstance(kb, KnowledgeBase)
+    assert kb.id == "AAAAAAAAAA" and kb["content_mode"] == "snippet"
+    for mutate in (
+        lambda: setattr(kb, "id", "CCCCCCCCCC"),
+        lambda: kb["routing_terms"].__setitem__("新語", 1),
+    ):
+        try:
+            mutate()
+            assert False, "mutation should fail"
+        except (AttributeError, TypeError):
+            pass
+    # 元の辞書を変更してもレジストリには影響しない
+    source = {name: dict(config) for name, config in KNOWLEDGE_BASES.items()}
+    registry = load_registry(source)
+    source["faq"]["description"] = "changed"
+    assert registry["faq"].description == "よくある質問"
+
+
+def test_retrieval_config_is_cached():
+    """(max_results, ハイブリッド検索) ごとに1回だけ構築し、同じオブジェクトを返すこと"""
+    print("=== retrieval config のキャッシュ ===")
+    kb = load_registry(KNOWLEDGE_BASES, region="us-east-1")["manual"]
+    config, key = kb.retrieval_config(10, True)
+    assert kb.retrieval_config(10, True)[0] is config
+    assert kb.retrieval_config(5, True)[0] is not config
+    vector = config["vectorSearchConfiguration"]
+    assert vector["numberOfResults"] == 10 and vector["overrideSearchType"] == "HYBRID"
+    model_arn = vector["rerankingConfiguration"]["bedrockRerankingConfiguration"]["modelConfiguration"]["modelArn"]
+    assert model_arn == "arn:aws:bedrock:us-east-1::foundation-model/cohere.rerank-v3-5:0"
+    assert json.loads(key) == config
+
+
+def test_list_kbs_and_mapping_access():
+    """list_kbs の応答が事前に作成され、Mapping として既存の処理に渡せること"""
+    print("=== list_kbs と Mapping ===")
+    registry = load_registry(KNOWLEDGE_BASES)
+    expected = [
+        {"name": "manual", "description": "認証機能マニュアル"},
+        {"name": "faq", "description": "よくある質問"},
+    ]
+    assert registry.list_kbs_payload == {"knowledgeBases": expected}
+    assert json.loads(registry.list_kbs_body) == registry.list_kbs_payload
+    assert registry.list_available() == expected
+    
+    assert KBRouter(registry).rank_query("ログインできない")[0][0] == "manual"
+    assert resolve_shaping(registry["manual"])["content_mode"] == "snippet"
+    
+    overridden = registry.with_overrides(cache_ttl=0)
+    assert overridden["faq"].get("cache_ttl") == 0 and registry["faq"].get("cache_ttl") is None
+
+
+if __name__ == "__main__":
+    test_validation_reports_all_errors()
+    test_entries_are_immutable()
+    test_retrieval_config_is_cached()
+    test_list_kbs_and_mapping_access()
+    print("✅ すべてのテストが完了しました")
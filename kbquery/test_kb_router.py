@@ -0,0 +1,84 @@
+# kbquery/test_kb_router.py
+"""
+キーワードルーター（Aho-Corasick / 転置インデックス）のローカルテスト（AWS不要）
+
+KeywordAutomaton の結果を、キーワードごとの部分文字列判定（素朴な実装）と比較する。
+"""
+import random
+
+from kb_router import KBRouter, KeywordAutomaton
+
+
+def naive_find_all(terms, text):
+    """
+    キーワードごとに text.find で判定する素朴な実装
+    
+    順序は KeywordAutomaton と同じく「初出の終了位置 → 長いキーワード」の順。
+    """
+    found = []
+    for term in dict.fromkeys(terms):
+        if not term:
+            continue
+        start = text.find(term)
+        if start >= 0:
+            found.append((start + len(term), -len(term), term))
+    return [term for _, _, term in sorted(found)]
+
+
+def test_overlapping_and_shared_prefixes():
+    """重なり・共通接頭辞・他のキーワードを含むキーワードをすべて検出すること"""
+    print("=== 重なりと共通接頭辞 ===")
+    terms = ["he", "she", "his", "hers", "ログ", "ログイン", "ログイン方法", "イン", "ン方"]
+    cases = [
+        "ushers",
+        "ahishers",
+        "ログイン方法を教えて",
+        "ログインとログ",
+        "hershe",
+        "ロロログイイン",
+    ]
+    automaton = KeywordAutomaton(terms)
+    for text in cases:
+        assert automaton.find_all(text) == naive_find_all(terms, text), text
+    assert automaton.find_all("ushers") == ["she", "he", "hers"]
+
+
+def test_empty_input():
+    """空のクエリ・空のキーワード・キーワードなしでも失敗しないこと"""
+    print("=== 空の入力 ===")
+    assert KeywordAutomaton(["ログイン"]).find_all("") == []
+    assert KeywordAutomaton([]).find_all("ログイン") == []
+    assert KeywordAutomaton(["", "faq"]).find_all("faq") == ["faq"]
+    assert KeywordAutomaton(["faq", "faq"]).find_all("faq faq") == ["faq"]
+
+
+def test_random_texts_match_naive():
+    """小さなアルファベットのランダムな文字列で、素朴な実装と常に一致すること"""
+    print("=== ランダムな入力 ===")
+    rng = random.Random(12)
+    alphabet = "abン"
+    for _ in range(300):
+        terms = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(6)]
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+        assert KeywordAutomaton(terms).find_all(text) == naive_find_all(terms, text), (terms, text)
+
+
+def test_router_rank():
+    """ヒットしたキーワードの重みの合計で順位付けし、同点は定義順になること"""
+    print("=== KBRouter ===")
+    router = KBRouter({
+        "auth": {"description": "認証マニュアル", "routing_terms": {"ログイン": 2, "login": 1}},
+        "faq": {"description": "よくある質問", "routing_terms": ["ログイン", "質問"]},
+        "billing": {"description": "請求ガイド"},
+    })
+    assert router.rank_query("LOGIN とログインの質問") == [("auth", 3.0), ("faq", 2.0), ("billing", 0.0)]
+    assert router.rank_query("よくある質問") == [("faq", 3.0), ("auth", 0.0), ("billing", 0.0)]
+    assert router.rank_query("") == [("auth", 0.0), ("faq", 0.0), ("billing", 0.0)]
+
+
+if __name__ == "__main__":
+    test_overlapping_and_shared_prefixes()
+    test_empty_input()
+    test_random_texts_match_naive()
+    test_router_rank()
+    print("✅ すべてのテストが完了しました")
@@ -0,0 +1,54 @@
+# kbquery/test_keyword_rescore.py
+"""
+キーワード再スコアリングのローカルテスト（AWS不要）
+"""
+from keyword_rescore import bm25_scores, rescore_results
+
+
+def test_bm25_scores():
+    """キーワードを含むテキストほど高く、含まないテキストは0になること"""
+    print("=== bm25_scores ===")
+    texts = [
+        "エラーコード AUTH-401 はトークンの期限切れを示します。AUTH-401 が出たら再ログインしてください。",
+        "auth-401 の詳細はログを確認してください。",
+        "パスワードの変更手順について説明します。",
+    ]
+    scores = bm25_scores(["AUTH-401"], texts)
+    assert scores[0] > scores[1] > 0.0
+    assert scores[2] == 0.0
+    assert bm25_scores([], texts) == [0.0, 0.0, 0.0]
+
+
+def test_rare_term_weighs_more():
+    """候補の多くに出る語より、少数にしか出ない語の方が効くこと"""
+    print("=== IDF ===")
+    texts = ["ログイン ログイン", "ログイン SAML", "ログイン", "ログイン"]
+    scores = bm25_scores(["ログイン", "SAML"], texts)
+    assert scores[1] > scores[0]
+
+
+def test_rescore_results():
+    """キーワード一致のチャンクが上位に上がり、元のスコアが残ること"""
+    print("=== rescore_results ===")
+    results = [
+        {"content": "認証機能の概要です。", "score": 0.80, "source": "s3://a"},
+        {"content": "SetupMFA API の呼び出し方法", "score": 0.70, "source": "s3://b"},
+        {"content": "その他の設定", "score": 0.60, "source": "s3://c"},
+    ]
+    rescored = rescore_results(results, ["SetupMFA"], 2, keyword_weight=0.5)
+    assert [r["source"] for r in rescored] == ["s3://b", "s3://a"]
+    assert rescored[0]["retrievalScore"] == 0.70
+    assert rescored[0]["keywordScore"] == 1.0
+    # 元の結果は変更しない
+    assert results[1]["score"] == 0.70
+    
+    # 一致がなければ元の順序のまま切り詰める
+    unchanged = rescore_results(results, ["存在しない語"], 2)
+    assert unchanged == results[:2]
+
+
+if __name__ == "__main__":
+    test_bm25_scores()
+    test_rare_term_weighs_more()
+    test_rescore_results()
+    print("✅ すべてのテストが完了しました")
@@ -0,0 +1,495 @@
+# kbquery/test_lambda_function.py
+"""
+lambda_function の検索処理のローカルテスト（偽クライアント使用、AWS不要）
+
+set_bedrock_client で retrieve だけを模した偽クライアントを注入し、
+キャッシュを無効にしたKBレジストリで検索する（キャッシュのテストだけ cache_ttl を指定して有効にする）。
+"""
+import contextlib
+import os
+import random
+import threading
+import time
+
+# テスト中のログ・EMF出力を抑える（lambda_function の import より前に設定する）
+os.environ.setdefault("KB_LOG_LEVEL", "ERROR")
+os.environ.setdefault("KB_METRICS_ENABLED", "false")
+
+import json_codec
+import lambda_function
+from lambda_function import call_retrieve, merge_results, search_knowledge_base_impl
+from single_flight import SingleFlight
+
+
+# 4つのサブクエリに分解される長いクエリ
+LONG_QUERY = (
+    "認証機能の使い方について教えてください。ログインAPIのエラーコードは何ですか？"
+    "パスワードリセットの手順を知りたいです。また、SAMLの設定方法も教えて"
+)
+
+
+class FakeRetrieveClient:
+    """
+    bedrock-agent-runtime の retrieve だけを模した偽クライアント
+    
+    同時実行数の最大値と呼び出されたクエリを記録する。結果はクエリから決まる疑似乱数で作り、
+    異なるクエリでも同じ文書（chunkId）が返るようにする（マージ時の重複除去の対象）。
+    
+    Args:
+        delays: クエリに含まれる文字列 → 遅延秒（最初に一致したもの）
+        default_delay: 一致しない場合の遅延秒
+    """
+    
+    def __init__(self, delays=None, default_delay=0.02):
+        self.delays = dict(delays or {})
+        self.default_delay = default_delay
+        self.calls = 0
+        self.queries = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+    
+    def _delay(self, query):
+        for marker, delay in self.delays.items():
+            if marker in query:
+                return delay
+        return self.default_delay
+    
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration):
+        query = retrievalQuery["text"]
+        with self._lock:
+            self.calls += 1
+            self.queries.append(query)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            time.sleep(self._delay(query))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+        
+        limit = retrievalConfiguration["vectorSearchConfiguration"]["numberOfResults"]
+        return {"retrievalResults": [
+            make_item(knowledgeBaseId, doc, score)
+            for doc, score in self._results(knowledgeBaseId, query, limit)
+        ]}
+    
+    def _results(self, kb_id, query, limit):
+        """(文書番号, スコア) のリスト"""
+        rng = random.Random(f"{kb_id}:{query}")
+        return [(rng.randrange(12), round(rng.random(), 4)) for _ in range(limit)]
+
+
+class RankedRetrieveClient(FakeRetrieveClient):
+    """
+    どのクエリにも同じ文書を同じ順位で返す偽クライアント
+    
+    スコアは順位ごとに 0.1 ずつ下がり、penalties に一致したクエリではその分だけ低くなる。
+    """
+    
+    def __init__(self, penalties=None, **kwargs):
+        super().__init__(**kwargs)
+        self.penalties = dict(penalties or {})
+    
+    def _results(self, kb_id, query, limit):
+        penalty = next((p for marker, p in self.penalties.items() if marker in query), 0.0)
+        return [(doc, round(1.0 - doc * 0.1 - penalty, 4)) for doc in range(min(limit, 10))]
+
+
+def make_item(kb_id, doc, score):
+    """retrieve の結果1件"""
+    return {
+        "content": {"text": f"doc-{doc} の本文"},
+        "score": score,
+        "location": {"s3Location": {"uri": f"s3://test/{kb_id}/doc-{doc}.md"}},
+        "metadata": {"x-amz-bedrock-kb-chunk-id": f"{kb_id}-chunk-{doc}"},
+    }
+
+
+@contextlib.contextmanager
+def fake_environment(client, **settings):
+    """
+    偽クライアントとキャッシュ無効のKBレジストリに差し替え、終了後に戻す
+    
+    settings に cache_ttl を渡すとキャッシュを有効にできる（キャッシュは空の状態から始める）。
+    締め切り超過などで実行中のまま残った retrieve とまとめられないように、
+    RETRIEVE_FLIGHTS もテストごとに新しくする。
+    """
+    original_registry = lambda_function.KB_REGISTRY
+    original_flights = lambda_function.RETRIEVE_FLIGHTS
+    lambda_function.KB_REGISTRY = original_registry.with_overrides(**{"cache_ttl": 0, **settings})
+    lambda_function.RETRIEVE_FLIGHTS = SingleFlight()
+    lambda_function.RETRIEVAL_CACHE.clear()
+    lambda_function.NEAR_DUPLICATE_INDEX.clear()
+    lambda_function.set_bedrock_client(client)
+    try:
+        yield
+    finally:
+        lambda_function.KB_REGISTRY = original_registry
+        lambda_function.RETRIEVE_FLIGHTS = original_flights
+        lambda_function.RETRIEVAL_CACHE.clear()
+        lambda_function.NEAR_DUPLICATE_INDEX.clear()
+        lambda_function.reset_bedrock_client()
+        lambda_function._invocation_deadline = None
+
+
+def test_sub_queries_run_concurrently_within_bound():
+    """サブクエリは並列に実行され、同時実行数は max_workers を超えないこと"""
+    print("=== サブクエリの同時実行数 ===")
+    client = FakeRetrieveClient(default_delay=0.05)
+    with fake_environment(client):
+        output = search_knowledge_base_impl("product_docs", LONG_QUERY, max_workers=2)
+    assert len(output["subQueries"]) == 4
+    assert client.calls == 4
+    assert client.max_in_flight == 2
+    assert not output["partial"]
+
+
+def test_partial_results_at_deadline():
+    """Lambdaの残り時間内に終わらないサブクエリは待たずに、部分結果を返すこと"""
+    print("=== 締め切りでの部分結果 ===")
+    client = FakeRetrieveClient(delays={"設定方法": 1.0}, default_delay=0.01)
+    with fake_environment(client):
+        # 残り時間 = 安全マージン + 0.3秒
+        lambda_function._invocation_deadline = (
+            time.monotonic() + lambda_function.LAMBDA_TIME_MARGIN_SEC + 0.3
+        )
+        start = time.monotonic()
+        output = search_knowledge_base_impl("product_docs", LONG_QUERY, max_workers=4)
+        elapsed = time.monotonic() - start
+    assert elapsed < 0.8
+    assert output["partial"]
+    assert len(output["timedOutQueries"]) == 1 and "設定方法" in output["timedOutQueries"][0]
+    assert output["count"] > 0
+
+
+def test_concurrent_merge_matches_sequential():
+    """完了順が変わっても、並列実行のマージ結果は逐次実行と同じであること"""
+    print("=== 並列と逐次のマージ結果 ===")
+    # 先頭のサブクエリほど遅くし、完了順を逆にする
+    delays = {"使い方": 0.08, "エラーコードは": 0.06, "手順を": 0.04, "設定方法": 0.0}
+    
+    client = FakeRetrieveClient(delays=delays)
+    with fake_environment(client):
+        concurrent = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=5, max_workers=4)
+        sequential = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=5, max_workers=1)
+        
+        # サブクエリを順番に呼び出してマージした結果とも一致する
+        kb_config = lambda_function.KB_REGISTRY["product_docs"]
+        retrieval_config, _ = kb_config.retrieval_config(10, kb_config.get("hybrid", False))
+        result_lists = [
+            call_retrieve(FakeRetrieveClient(default_delay=0), kb_config.id, query, retrieval_config)
+            for query in concurrent["subQueries"]
+        ]
+    expected = merge_results(result_lists, 5, kb_config.get("merge_strategy", "max"))
+    
+    assert concurrent["subQueries"] == sequential["subQueries"]
+    assert concurrent["results"] == sequential["results"]
+    strip = [{k: v for k, v in r.items() if k != "cached"} for r in concurrent["results"]]
+    assert strip == expected
+    assert client.max_in_flight > 1
+
+
+def invoke(tool_name, arguments):
+    """lambda_handler を呼び出し、(ステータスコード, 本文) を返す（proxy / native 両対応）"""
+    response = lambda_function.lambda_handler({"toolName": tool_name, "input": arguments}, None)
+    return lambda_function.parse_response(response)
+
+
+class FlakyRetrieveClient(FakeRetrieveClient):
+    """最初の failures 回だけスロットリングで失敗する偽クライアント"""
+    
+    def __init__(self, failures=1, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+    
+    def retrieve(self, **kwargs):
+        with self._lock:
+            fail = self.failures > 0
+            self.failures -= 1
+        if fail:
+            time.sleep(self.default_delay)
+            error = RuntimeError("ThrottlingException")
+            error.response = {"Error": {"Code": "ThrottlingException"}}
+            raise error
+        return super().retrieve(**kwargs)
+
+
+def total_ms(timings, stage):
+    """timings の段階の合計ミリ秒（1回なら値そのもの）"""
+    value = timings.get(stage, 0.0)
+    return value["totalMs"] if isinstance(value, dict) else value
+
+
+def test_retrieve_timing_excludes_waits():
+    """retrieve は呼び出し自体の時間だけを記録し、プールの待ち・再試行の待機は別に記録すること"""
+    print("=== retrieve の時間 ===")
+    client = FlakyRetrieveClient(failures=1, default_delay=0.05)
+    with fake_environment(client):
+        output = search_knowledge_base_impl(
+            "product_docs", LONG_QUERY, max_workers=1, include_timings=True
+        )
+    timings = output["timings"]
+    calls = client.calls + 1  # 失敗した1回を含む
+    assert timings["retrieve"]["count"] == calls
+    # 呼び出しは1回約50ms。プールの待ちや再試行の待機を含めると大きく超える
+    assert timings["retrieve"]["maxMs"] < 100
+    assert timings["pool_wait"]["count"] == client.calls and total_ms(timings, "pool_wait") > 50
+    assert "retry_wait" in timings
+    waited = total_ms(timings, "retrieve") + total_ms(timings, "retry_wait")
+    assert total_ms(timings, "retrieve_total") >= waited
+
+
+def test_federated_search_caps_concurrency():
+    """横断検索で同時に検索するKB数は KB_FEDERATED_MAX_WORKERS を超えないこと"""
+    print("=== 横断検索の同時実行数 ===")
+    kb_count = len(lambda_function.KB_REGISTRY)
+    original = lambda_function.FEDERATED_MAX_WORKERS
+    try:
+        for cap, expected in ((1, 1), (kb_count, kb_count)):
+            lambda_function.FEDERATED_MAX_WORKERS = cap
+            client = FakeRetrieveClient(default_delay=0.05)
+            with fake_environment(client):
+                output = lambda_function.federated_search_impl("よくある質問の一覧", max_results=3)
+            assert len(output["kbsSearched"]) == kb_count
+            assert all("error" not in kb for kb in output["perKb"])
+            assert client.calls == kb_count
+            assert client.max_in_flight == expected
+    finally:
+        lambda_function.FEDERATED_MAX_WORKERS = original
+
+
+def test_federated_search_rejects_invalid_top_n():
+    """不正な top_n は500ではなく400を返すこと"""
+    print("=== 横断検索の top_n ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client):
+        for top_n in ("2", 0, -1, 1.5, True):
+            status, body = invoke("federated_search", {"query": "認証の設定", "top_n": top_n})
+            assert status == 400, (top_n, status)
+            assert "top_n" in body["error"]
+        status, body = invoke("federated_search", {"query": "認証の設定", "top_n": 1})
+    assert status == 200
+    assert len(body["kbsSearched"]) == 1
+    assert client.calls == 1
+
+
+def test_federated_search_accepts_string_max_bytes():
+    """横断検索でも kb_search と同じく文字列の max_bytes を整数として扱うこと"""
+    print("=== 横断検索の max_bytes ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client):
+        outputs = [
+            invoke("federated_search", {"query": "よくある質問の一覧", "max_bytes": max_bytes})
+            for max_bytes in ("10", 10)
+        ]
+        status, body = invoke("federated_search", {"query": "よくある質問の一覧", "max_bytes": "abc"})
+    assert outputs[0][0] == 200 and outputs[1][0] == 200
+    assert outputs[0][1]["results"] == outputs[1][1]["results"]
+    assert outputs[0][1]["truncated"]
+    assert status == 400
+
+
+def test_batch_search_dedup_and_item_errors():
+    """同一アイテムは1回だけ実行し、アイテムごとのエラーは他のアイテムを失敗させないこと"""
+    print("=== バッチ検索の重複排除とエラー ===")
+    client = FakeRetrieveClient(default_delay=0.01)
+    item = {"kb_name": "product_docs", "query": "ログインできない場合の対処方法"}
+    with fake_environment(client):
+        status, body = invoke("batch_search", {
+            "items": [item, dict(item), {"kb_name": "unknown_kb", "query": "ログイン"}],
+            "max_results": 2,
+        })
+    assert status == 200
+    first, second, unknown = body["items"]
+    assert first["result"]["results"] == second["result"]["results"]
+    # アイテムに max_results がなければ全体の max_results を使う
+    assert first["result"]["count"] == 2
+    assert body["dedupedCalls"] == 1
+    assert client.calls == 1
+    assert "unknown_kb" in unknown["error"] and "result" not in unknown
+
+
+def test_batch_search_rejects_malformed_input():
+    """形式の誤った入力は500ではなく400を返すこと"""
+    print("=== バッチ検索の入力検証 ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client):
+        for arguments in (
+            {"items": "product_docs"},
+            {"items": {"kb_name": "faq", "query": "質問"}},
+            {"items": ["faq"]},
+            {"items": [{"kb_name": "faq", "query": "質問"}, None]},
+            {"query": "質問", "kb_names": "faq"},
+        ):
+            status, body = invoke("batch_search", arguments)
+            assert status == 400, (arguments, status)
+    assert client.calls == 0
+
+
+def test_early_stop_saves_calls_and_keeps_top_k():
+    """上位k件が安定しk位とk+1位の差が margin 以上なら、残りを発行せず上位k件は全件実行と同じになること"""
+    print("=== 早期終了 ===")
+    # 優先度の低い（短い）サブクエリほど同じ文書を低いスコアで返す
+    penalties = {"使い方": 0.03, "設定方法": 0.02}
+    settings = {"early_stop_patience": 1, "early_stop_margin": 0.05}
+    
+    baseline_client = RankedRetrieveClient(penalties=penalties, default_delay=0.01)
+    with fake_environment(baseline_client, early_stop=False, **settings):
+        full = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=3)
+    client = RankedRetrieveClient(penalties=penalties, default_delay=0.01)
+    with fake_environment(client, early_stop=True, **settings):
+        stopped = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=3)
+    
+    assert baseline_client.calls == 4
+    assert stopped["earlyStopped"] and stopped["callsSaved"] >= 1
+    assert client.calls < baseline_client.calls
+    assert [(r["chunkId"], r["score"]) for r in stopped["results"]] == \
+        [(r["chunkId"], r["score"]) for r in full["results"]]
+
+
+def test_early_stop_deadline_is_not_a_saving():
+    """早期終了モードで締め切りまでに発行できなかったサブクエリは、節約ではなく timeout として返すこと"""
+    print("=== 早期終了と締め切り ===")
+    client = RankedRetrieveClient(default_delay=0.5)
+    with fake_environment(client, early_stop=True):
+        output = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=3, deadline_sec=0.1)
+    assert client.calls == lambda_function.EARLY_STOP_PARALLELISM
+    assert output["partial"]
+    assert len(output["timedOutQueries"]) == 4
+    assert not output["earlyStopped"]
+    assert output["callsSaved"] == 0 and output["skippedQueries"] == []
+
+
+def test_early_stop_is_off_by_default():
+    """既定のKB設定では早期終了しないこと"""
+    print("=== 早期終了の既定値 ===")
+    assert not any(kb.get("early_stop", False) for kb in lambda_function.KB_REGISTRY.values())
+
+
+def test_invalid_max_results_is_rejected():
+    """max_results が1以上の整数でなければ400を返すこと"""
+    print("=== max_results の検証 ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client, early_stop=True):
+        for max_results in (0, -3, "5", None, True):
+            for tool_name, arguments in (
+                ("kb_search", {"kb_name": "faq", "query": "よくある質問"}),
+                ("auto_search", {"query": "よくある質問"}),
+                ("federated_search", {"query": "よくある質問"}),
+                ("batch_search", {"query": "よくある質問", "kb_names": ["faq"]}),
+            ):
+                status, _ = invoke(tool_name, dict(arguments, max_results=max_results))
+                assert status == 400, (tool_name, max_results, status)
+    assert client.calls == 0
+
+
+def test_weighted_merge_uses_sub_query_lengths():
+    """weighted では、サブクエリの文字数に比例した重みでスコアを合算すること"""
+    print("=== weighted マージ ===")
+    kb_config = lambda_function.KB_REGISTRY["product_docs"]
+    max_sub_queries = kb_config.get("max_sub_queries", lambda_function.MAX_SUB_QUERIES)
+    sub_queries = lambda_function.analyze_query(LONG_QUERY).sub_queries(max_sub_queries)
+    weights = lambda_function.sub_query_weights(sub_queries)
+    assert abs(sum(weights) - 1.0) < 1e-9
+    
+    # 「設定方法」を含むサブクエリだけスコアが0.5低い
+    penalties = [0.5 if "設定方法" in sub_query else 0.0 for sub_query in sub_queries]
+    client = RankedRetrieveClient(penalties={"設定方法": 0.5}, default_delay=0)
+    with fake_environment(client, merge_strategy="weighted"):
+        output = search_knowledge_base_impl("product_docs", LONG_QUERY, max_results=3)
+    expected = [
+        round(sum(w * (1.0 - doc * 0.1 - p) for w, p in zip(weights, penalties)), 6)
+        for doc in range(3)
+    ]
+    assert [round(r["score"], 6) for r in output["results"]] == expected
+    assert client.calls == len(sub_queries)
+
+
+def test_full_content_by_default():
+    """既定では本文をそのまま返し、snippet はリクエストで指定したときだけ使うこと"""
+    print("=== 本文の既定の返し方 ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client):
+        for kb_name in lambda_function.KB_REGISTRY:
+            status, body = invoke("kb_search", {"kb_name": kb_name, "query": "よくある質問"})
+            assert status == 200
+            assert body["contentMode"] == "full" and not body["truncated"]
+        status, body = invoke("kb_search", {
+            "kb_name": "faq", "query": "よくある質問", "content_mode": "snippet", "max_chars": 4,
+        })
+    assert status == 200
+    assert body["contentMode"] == "snippet" and body["truncated"]
+
+
+def test_list_kbs_output_is_not_shared():
+    """list_kbs の出力を変更しても、次の呼び出しやレジストリに影響しないこと"""
+    print("=== list_kbs の出力のコピー ===")
+    expected = lambda_function.handle_list_kbs({})
+    output = lambda_function.handle_list_kbs({})
+    output["knowledgeBases"][0]["name"] = "changed"
+    output["knowledgeBases"].clear()
+    output["extra"] = True
+    assert lambda_function.handle_list_kbs({}) == expected
+    assert json_codec.loads(lambda_function.KB_REGISTRY.list_kbs_body) == expected
+    status, body = invoke("list_kbs", {})
+    assert status == 200 and body == expected
+
+
+def test_cache_through_lambda_handler():
+    """同じクエリの2回目はキャッシュから返し、retrieve を呼ばないこと"""
+    print("=== lambda_handler とキャッシュ ===")
+    client = FakeRetrieveClient(default_delay=0)
+    arguments = {"kb_name": "faq", "query": "よくある質問の一覧"}
+    with fake_environment(client, cache_ttl=60):
+        exact_hits = lambda_function.get_cache_stats()["exactHits"]
+        first_status, first = invoke("kb_search", arguments)
+        second_status, second = invoke("kb_search", arguments)
+        stats = lambda_function.get_cache_stats()
+    assert first_status == 200 and second_status == 200
+    assert client.calls == 1
+    assert first["cacheHits"] == 0 and second["cacheHits"] == 1
+    assert second["count"] > 0
+    assert not any(result["cached"] for result in first["results"])
+    assert all(result["cached"] for result in second["results"])
+    assert [result["chunkId"] for result in second["results"]] == \
+        [result["chunkId"] for result in first["results"]]
+    assert stats["exactHits"] == exact_hits + 1
+
+
+def test_near_duplicate_requires_same_numbers():
+    """数字だけが違うクエリは、近似重複として他のクエリのキャッシュを使わないこと"""
+    print("=== 近似重複と数字 ===")
+    client = FakeRetrieveClient(default_delay=0)
+    with fake_environment(client, cache_ttl=60):
+        for code in ("401", "403"):
+            status, body = invoke("kb_search", {
+                "kb_name": "faq", "query": f"ログインAPIでエラーコード{code}が返るときの対処方法と原因の調べ方",
+            })
+            assert status == 200
+            assert not any(result["cached"] for result in body["results"]), code
+        stats = lambda_function.get_cache_stats()
+    assert client.calls == 2
+    assert stats["nearHits"] == 0
+
+
+if __name__ == "__main__":
+    test_sub_queries_run_concurrently_within_bound()
+    test_partial_results_at_deadline()
+    test_concurrent_merge_matches_sequential()
+    test_retrieve_timing_excludes_waits()
+    test_federated_search_caps_concurrency()
+    test_federated_search_rejects_invalid_top_n()
+    test_federated_search_accepts_string_max_bytes()
+    test_batch_search_dedup_and_item_errors()
+    test_batch_search_rejects_malformed_input()
+    test_early_stop_saves_calls_and_keeps_top_k()
+    test_early_stop_deadline_is_not_a_saving()
+    test_early_stop_is_off_by_default()
+    test_invalid_max_results_is_rejected()
+    test_weighted_merge_uses_sub_query_lengths()
+    test_full_content_by_default()
+    test_list_kbs_output_is_not_shared()
+    test_cache_through_lambda_handler()
+    test_near_duplicate_requires_same_numbers()
+    print("✅ すべてのテストが完了しました")
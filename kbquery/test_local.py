@@ -2,16 +2,17 @@
 """
 ローカルテスト用スクリプト
 """
-from lambda_function import lambda_handler
+import json_codec
+from lambda_function import lambda_handler, parse_response
 
 
 def test_list_kbs():
     """KB一覧取得テスト"""
     print("=== KB一覧取得 ===")
     event = {"action": "list_kbs"}
-    result = lambda_handler(event, None)
-    print(f"Status: {result['statusCode']}")
-    print(f"Body: {result['body']}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"Status: {status}")
+    print(f"Body: {json_codec.dumps(body)}")
 
 
 def test_search():
@@ -23,9 +24,9 @@ def test_search():
         "query": "使い方を教えて",
         "max_results": 3
     }
-    result = lambda_handler(event, None)
-    print(f"Status: {result['statusCode']}")
-    print(f"Body: {result['body']}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"Status: {status}")
+    print(f"Body: {json_codec.dumps(body)}")
 
 
 def test_unknown_kb():
@@ -36,9 +37,9 @@ def test_unknown_kb():
         "kb_name": "unknown_kb",
         "query": "テスト"
     }
-    result = lambda_handler(event, None)
-    print(f"Status: {result['statusCode']}")
-    print(f"Body: {result['body']}")
+    status, body = parse_response(lambda_handler(event, None))
+    print(f"Status: {status}")
+    print(f"Body: {json_codec.dumps(body)}")
 
 
 if __name__ == "__main__":
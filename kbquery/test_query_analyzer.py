@@ -0,0 +1,80 @@
+# kbquery/test_query_analyzer.py
+"""
+クエリ解析（analyze_query）のローカルテスト（AWS不要）
+
+1回の走査で行う解析が、従来の処理（bench_query_analyzer の legacy_*）と
+同じサブクエリ・キーワード・KB選択スコアを返すことを確認する。
+"""
+import os
+
+# テスト中のログ・EMF出力を抑える（lambda_function の import より前に設定する）
+os.environ.setdefault("KB_LOG_LEVEL", "ERROR")
+os.environ.setdefault("KB_METRICS_ENABLED", "false")
+
+from bench_query_analyzer import CORPUS, analyzer_pipeline, legacy_pipeline
+from lambda_function import analyze_query
+
+
+# 全角・半角の混在やNFKC正規化で結果が変わり得るクエリ
+MIXED_WIDTH_QUERIES = [
+    "ＡＰＩキーの発行方法を詳しく教えてください。APIキーの発行方法を詳しく教えてください。"
+    "また、ﾊﾟｽﾜｰﾄﾞの変更手順も知りたい",
+    "ＦＡＱにある「ｻﾝﾌﾟﾙ」を見たい",
+    "LOGIN できません。Auth エラーです、そして FAQ も見たいのですが、どこにありますか？ログイン画面の説明も",
+    "ﾛｸﾞｲﾝ方法について",
+    "よくある質問について！サンプルに関して？ドキュメントの例を教えて下さい。\n二要素認証（2FA）の手順",
+    "認証",
+    "",
+]
+
+
+def test_matches_legacy_pipeline():
+    """コーパスと全角・半角混在のクエリで、従来の処理と結果が一致すること"""
+    print("=== 従来の処理との一致 ===")
+    for query in CORPUS + MIXED_WIDTH_QUERIES:
+        assert analyzer_pipeline(query) == legacy_pipeline(query), query
+
+
+def test_decomposition_and_keywords():
+    """分解位置・キーワード・ルーティング語を1回の解析で取り出すこと"""
+    print("=== 分解とキーワード ===")
+    query = (
+        "多要素認証（MFA）について、設定手順と、そしてリカバリーコードの扱いに関して詳しく知りたいです。"
+        "管理者向けマニュアルはありますか？"
+    )
+    analysis = analyze_query(query)
+    assert analysis.sub_queries() == [
+        "多要素認証（MFA）", "、設定手順と", "リカバリーコードの扱い", "詳しく知りたいです", "管理者向けマニュアルはありますか",
+    ]
+    assert analysis.keywords == ["MFA", "リカバリーコード", "マニュアル"]
+    assert "認証" in analysis.routing_hits and "マニュアル" in analysis.routing_hits
+    # 件数を制限すると長い断片から採用し、出現順で返す
+    assert analysis.sub_queries(2) == ["リカバリーコードの扱い", "管理者向けマニュアルはありますか"]
+
+
+def test_nfkc_redundant_fragments():
+    """全角・半角だけが違う断片は、NFKC正規化後に同じとみなして1つにまとめること"""
+    print("=== NFKC正規化 ===")
+    analysis = analyze_query(MIXED_WIDTH_QUERIES[0])
+    assert len(analysis.fragments) == 3
+    assert analysis.sub_queries() == [
+        "ＡＰＩキーの発行方法を詳しく教えてください",
+        "また、ﾊﾟｽﾜｰﾄﾞの変更手順も知りたい",
+    ]
+    # キーワード抽出は元の表記のまま行う（全角英字はキーワードにしない）
+    assert analysis.keywords == ["API"]
+
+
+def test_short_query_is_not_split():
+    """短いクエリは分解せず、そのまま1つのサブクエリにすること"""
+    print("=== 短いクエリ ===")
+    for query in ("ログイン方法について教えて", "ＦＡＱ", ""):
+        assert analyze_query(query).sub_queries() == [query]
+
+
+if __name__ == "__main__":
+    test_matches_legacy_pipeline()
+    test_decomposition_and_keywords()
+    test_nfkc_redundant_fragments()
+    test_short_query_is_not_split()
+    print("✅ すべてのテストが完了しました")
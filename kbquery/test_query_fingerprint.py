@@ -0,0 +1,102 @@
+# kbquery/test_query_fingerprint.py
+"""
+クエリフィンガープリントのローカルテスト（AWS不要）
+"""
+from query_fingerprint import (
+    SIMILARITY_THRESHOLD,
+    NearDuplicateIndex,
+    compute_fingerprint,
+    estimate_similarity,
+    normalize_text,
+)
+
+
+def test_normalize_text():
+    """全角/半角・句読点・空白の違いを吸収すること"""
+    print("=== normalize_text ===")
+    assert normalize_text("認証機能の使い方？") == normalize_text("認証機能の使い方")
+    assert normalize_text("ＡＰＩ　認証") == normalize_text("api認証")
+
+
+def test_keyword_order_is_ignored():
+    """キーワードの並び順が違っても同じフィンガープリントになること"""
+    print("=== キーワード順序 ===")
+    fp1 = compute_fingerprint("ログイン方法", ["API", "SAML"])
+    fp2 = compute_fingerprint("ログイン方法", ["SAML", "API"])
+    assert fp1.canonical == fp2.canonical
+    assert fp1.signature == fp2.signature
+
+
+def test_similarity():
+    """似たクエリは高く、無関係なクエリは低い類似度になること"""
+    print("=== 類似度 ===")
+    base = compute_fingerprint("認証機能の使い方について")
+    similar = compute_fingerprint("認証機能の使い方についての説明")
+    different = compute_fingerprint("パスワードリセットの手順")
+    
+    high = estimate_similarity(base.signature, similar.signature)
+    low = estimate_similarity(base.signature, different.signature)
+    print(f"類似: {high:.2f}, 非類似: {low:.2f}")
+    assert high > low
+    assert low < 0.3
+
+
+def test_near_duplicate_index():
+    """しきい値以上の類似クエリだけが同じスコープ内で見つかること"""
+    print("=== NearDuplicateIndex ===")
+    index = NearDuplicateIndex(threshold=0.5, max_entries=2)
+    base = compute_fingerprint("認証機能の使い方について")
+    index.add("kb1", base.signature, "key-base")
+    
+    similar = compute_fingerprint("認証機能の使い方についての説明")
+    found = index.lookup("kb1", similar.signature)
+    assert found is not None and found[0] == "key-base"
+    
+    # スコープが違えばヒットしない
+    assert index.lookup("kb2", similar.signature) is None
+    
+    # 無関係なクエリはヒットしない
+    assert index.lookup("kb1", compute_fingerprint("パスワードリセットの手順").signature) is None
+    
+    # 上限を超えたら古いものから削除
+    index.add("kb1", compute_fingerprint("料金プラン").signature, "key-2")
+    index.add("kb1", compute_fingerprint("お問い合わせ先").signature, "key-3")
+    assert len(index) == 2
+    assert index.lookup("kb1", base.signature) is None
+
+
+def test_different_numbers_are_not_near_duplicates():
+    """数字・識別子だけが違うクエリは、類似度が高くても近似重複としてヒットしないこと"""
+    print("=== 数字・識別子の違い ===")
+    fp401 = compute_fingerprint("ログインAPIでエラーコード401が返るときの対処方法と原因の調べ方")
+    fp403 = compute_fingerprint("ログインAPIでエラーコード403が返るときの対処方法と原因の調べ方")
+    assert estimate_similarity(fp401.signature, fp403.signature) >= SIMILARITY_THRESHOLD
+    assert fp401.anchors == "401 api" and fp403.anchors == "403 api"
+    
+    index = NearDuplicateIndex()
+    index.add(fp401.near_scope("kb1"), fp401.signature, "key-401")
+    assert index.lookup(fp403.near_scope("kb1"), fp403.signature) is None
+    
+    # 全角・半角や大文字・小文字の違いだけならヒットする
+    fp_wide = compute_fingerprint("ログインＡＰＩでエラーコード４０１が返るときの対処方法と原因の調べ方は")
+    found = index.lookup(fp_wide.near_scope("kb1"), fp_wide.signature)
+    assert found is not None and found[0] == "key-401"
+
+
+def test_disabled_threshold():
+    """しきい値が1より大きければ近似検索は無効"""
+    print("=== 無効化 ===")
+    index = NearDuplicateIndex(threshold=1.1)
+    fp = compute_fingerprint("認証機能の使い方")
+    index.add("kb1", fp.signature, "key")
+    assert index.lookup("kb1", fp.signature) is None
+
+
+if __name__ == "__main__":
+    test_normalize_text()
+    test_keyword_order_is_ignored()
+    test_similarity()
+    test_near_duplicate_index()
+    test_different_numbers_are_not_near_duplicates()
+    test_disabled_threshold()
+    print("✅ すべてのテストが完了しました")
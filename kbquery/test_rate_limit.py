@@ -0,0 +1,132 @@
+# kbquery/test_rate_limit.py
+"""
+レート制限（トークンバケット）のローカルテスト（AWS不要）
+"""
+import threading
+import time
+
+from rate_limit import RateLimitExceeded, TokenBucket
+from resilience import CircuitBreaker, ResilientCaller
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+    
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_burst_then_wait():
+    """容量分はすぐに取得でき、それ以降は補充を待つこと"""
+    print("=== バースト後の待機 ===")
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire(max_wait_sec=1) == 0
+    assert bucket.acquire(max_wait_sec=1) == 0
+    waited = bucket.acquire(max_wait_sec=1)
+    assert abs(waited - 0.1) < 1e-9
+    assert abs(clock.now - 0.1) < 1e-9
+    stats = bucket.stats()
+    assert stats["acquired"] == 3 and stats["waited"] == 1 and stats["waitMs"] == 100.0
+
+
+def test_reservations_queue_in_order():
+    """同時に待つ呼び出しは補充分を順番に使うこと（待ち時間が積み上がる）"""
+    print("=== 予約の順序 ===")
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=1, clock=clock)
+    assert bucket.reserve(max_wait_sec=1) == 0
+    waits = [bucket.reserve(max_wait_sec=1) for _ in range(3)]
+    assert [round(w, 3) for w in waits] == [0.1, 0.2, 0.3]
+
+
+def test_shed_when_wait_too_long():
+    """待ち時間が上限を超える場合は予約せずに RateLimitExceeded を送出すること"""
+    print("=== 負荷の切り捨て ===")
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, burst=1, clock=clock)
+    bucket.reserve(max_wait_sec=0)
+    try:
+        bucket.reserve(max_wait_sec=0.1)
+        assert False, "RateLimitExceeded expected"
+    except RateLimitExceeded as e:
+        assert abs(e.retry_after_sec - 0.5) < 1e-9
+    assert bucket.stats()["shed"] == 1
+    # 切り捨てた分は予約していないので、補充後は待たずに取得できる
+    clock.now = 0.5
+    assert bucket.reserve(max_wait_sec=0) == 0
+
+
+def test_retries_use_tokens():
+    """ResilientCaller の再試行もトークンを使い、切り捨てはブレーカーの失敗に数えないこと"""
+    print("=== 再試行とレート制限 ===")
+    clock = FakeClock()
+    bucket = TokenBucket(rate=1, burst=1, clock=clock)
+    breaker = CircuitBreaker(failure_threshold=1)
+    calls = []
+    
+    def throttled():
+        calls.append(1)
+        error = Exception("ThrottlingException")
+        error.response = {"Error": {"Code": "ThrottlingException"}}
+        raise error
+    
+    caller = ResilientCaller(max_attempts=3, breaker=breaker, sleep=lambda _: None)
+    try:
+        caller.call(throttled, before_attempt=lambda: bucket.reserve(max_wait_sec=0))
+        assert False, "RateLimitExceeded expected"
+    except RateLimitExceeded:
+        pass
+    # 1回目だけ呼ばれ、再試行はトークン不足で止まる
+    assert len(calls) == 1
+    assert breaker.state == "closed"
+
+
+def test_try_acquire_does_not_wait():
+    """try_acquire はトークンがあるときだけ取得し、なければ待たずに False を返すこと"""
+    print("=== 待たない取得 ===")
+    clock = FakeClock()
+    bucket = TokenBucket(rate=10, burst=1, clock=clock)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    stats = bucket.stats()
+    assert stats["acquired"] == 1 and stats["denied"] == 1 and stats["shed"] == 0
+    clock.now = 0.1
+    assert bucket.try_acquire()
+
+
+def test_hedges_use_tokens():
+    """ヘッジもトークンを使い、トークンがなければヘッジしないこと"""
+    print("=== ヘッジとレート制限 ===")
+    bucket = TokenBucket(rate=0.001, burst=1)
+    calls = []
+    lock = threading.Lock()
+    
+    def slow():
+        with lock:
+            calls.append(1)
+        time.sleep(0.1)
+        return "ok"
+    
+    caller = ResilientCaller(hedge=True, hedge_delay_sec=0.01, sleep=lambda _: None)
+    # 1本目の分でトークンを使い切っているので、ヘッジは発行されない
+    assert caller.call(slow, before_attempt=lambda: bucket.reserve(max_wait_sec=0),
+                       before_hedge=bucket.try_acquire) == "ok"
+    assert len(calls) == 1
+    stats = caller.stats()
+    assert stats["hedges"] == 0 and stats["hedgesSkipped"] == 1
+    assert bucket.stats()["denied"] == 1
+
+
+if __name__ == "__main__":
+    test_burst_then_wait()
+    test_reservations_queue_in_order()
+    test_shed_when_wait_too_long()
+    test_retries_use_tokens()
+    test_try_acquire_does_not_wait()
+    test_hedges_use_tokens()
+    print("✅ すべてのテストが完了しました")
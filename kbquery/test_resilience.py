@@ -0,0 +1,219 @@
+# kbquery/test_resilience.py
+"""
+リトライ・サーキットブレーカー・ヘッジのローカルテスト（偽クライアント使用、AWS不要）
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, HedgePool, ResilientCaller, is_retryable
+
+
+class FakeClientError(Exception):
+    """botocore の ClientError と同じ形の response を持つ例外"""
+    
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code, "Message": code}}
+
+
+class FakeClient:
+    """指定した回数だけ失敗してから成功する retrieve"""
+    
+    def __init__(self, failures=(), delays=()):
+        self.failures = list(failures)
+        self.delays = list(delays)
+        self.calls = 0
+        self._lock = threading.Lock()
+    
+    def retrieve(self):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+            failure = self.failures.pop(0) if self.failures else None
+            delay = self.delays.pop(0) if self.delays else 0.0
+        time.sleep(delay)
+        if failure:
+            raise FakeClientError(failure)
+        return [f"result-{call}"]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    
+    def __call__(self):
+        return self.now
+
+
+def test_is_retryable():
+    print("=== is_retryable ===")
+    assert is_retryable(FakeClientError("ThrottlingException"))
+    assert not is_retryable(FakeClientError("ValidationException"))
+    assert not is_retryable(ValueError("bad"))
+
+
+def test_retry_with_backoff():
+    """スロットリングは再試行し、待ち時間はジッター付きで上限以内であること"""
+    print("=== リトライ ===")
+    client = FakeClient(failures=["ThrottlingException", "ThrottlingException"])
+    sleeps = []
+    backoffs = []
+    caller = ResilientCaller(max_attempts=3, base_delay_sec=0.1, max_delay_sec=0.15, sleep=sleeps.append)
+    assert caller.call(client.retrieve, on_backoff=backoffs.append) == ["result-3"]
+    assert client.calls == 3
+    assert len(sleeps) == 2
+    assert backoffs == sleeps
+    assert 0.0 <= sleeps[0] <= 0.1 and 0.0 <= sleeps[1] <= 0.15
+    assert caller.stats()["retries"] == 2
+
+
+def test_non_retryable_is_not_retried():
+    """リクエストの誤りは再試行せず、ブレーカーの失敗にも数えないこと"""
+    print("=== 再試行しないエラー ===")
+    client = FakeClient(failures=["ValidationException"] * 10)
+    caller = ResilientCaller(max_attempts=3, breaker=CircuitBreaker(failure_threshold=1), sleep=lambda _: None)
+    for _ in range(3):
+        try:
+            caller.call(client.retrieve)
+            assert False, "exception expected"
+        except FakeClientError:
+            pass
+    assert client.calls == 3
+    assert caller.breaker.state == "closed"
+
+
+def test_deadline_stops_retry():
+    """残り時間を超える待機はせずに失敗すること"""
+    print("=== 締め切り ===")
+    client = FakeClient(failures=["ThrottlingException"] * 3)
+    caller = ResilientCaller(max_attempts=3, base_delay_sec=10, max_delay_sec=10, sleep=lambda _: None)
+    try:
+        caller.call(client.retrieve, deadline=time.monotonic() + 0.001)
+        assert False, "exception expected"
+    except FakeClientError:
+        pass
+    # 待ち時間が0に近い乱数になる場合を除き、1回で諦める
+    assert client.calls <= 2
+
+
+def test_circuit_breaker():
+    """連続失敗で開き、時間経過後の試行が成功すれば閉じること"""
+    print("=== サーキットブレーカー ===")
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_sec=30, clock=clock)
+    client = FakeClient(failures=["ServiceUnavailableException"] * 2)
+    caller = ResilientCaller(max_attempts=1, breaker=breaker, sleep=lambda _: None)
+    
+    for _ in range(2):
+        try:
+            caller.call(client.retrieve)
+        except FakeClientError:
+            pass
+    assert breaker.state == "open"
+    
+    try:
+        caller.call(client.retrieve)
+        assert False, "CircuitOpenError expected"
+    except CircuitOpenError:
+        pass
+    assert client.calls == 2
+    assert caller.stats()["rejected"] == 1
+    
+    clock.now = 31
+    assert breaker.state == "half_open"
+    assert caller.call(client.retrieve) == ["result-3"]
+    assert breaker.state == "closed"
+
+
+def test_half_open_failure_reopens():
+    """half-open の試行が失敗したら再び開くこと"""
+    print("=== half-open の失敗 ===")
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_sec=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 11
+    assert breaker.allow()
+    assert not breaker.allow()  # 試行中は1本だけ
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_hedged_request():
+    """1本目が遅いとき、ヘッジした2本目の結果が使われること"""
+    print("=== ヘッジリクエスト ===")
+    client = FakeClient(delays=[0.5, 0.01])
+    caller = ResilientCaller(hedge=True, hedge_delay_sec=0.05, sleep=lambda _: None)
+    thread_errors = []
+    original_hook = threading.excepthook
+    threading.excepthook = thread_errors.append
+    try:
+        start = time.monotonic()
+        assert caller.call(client.retrieve) == ["result-2"]
+        assert time.monotonic() - start < 0.4
+        # 負けた1本目のスレッドが完了しても例外にならないこと
+        for thread in threading.enumerate():
+            if thread.name == "kb-primary":
+                thread.join()
+    finally:
+        threading.excepthook = original_hook
+    assert thread_errors == []
+    stats = caller.stats()
+    assert stats["hedges"] == 1 and stats["hedgeWins"] == 1
+
+
+def test_no_hedge_under_concurrency():
+    """同時に多数呼び出しても、遅延が hedge_delay 未満ならヘッジしないこと（1本目はキューで待たない）"""
+    print("=== 並行呼び出しとヘッジ ===")
+    callers = 32
+    client = FakeClient(delays=[0.05] * callers)
+    caller = ResilientCaller(hedge=True, hedge_delay_sec=0.15, sleep=lambda _: None)
+    with ThreadPoolExecutor(max_workers=callers) as executor:
+        results = list(executor.map(lambda _: caller.call(client.retrieve), range(callers)))
+    assert len(results) == callers
+    assert client.calls == callers
+    stats = caller.stats()
+    assert stats["hedges"] == 0 and stats["hedgesSkipped"] == 0
+
+
+def test_hedge_skipped_when_pool_is_full():
+    """ヘッジ用プールに空きがなければヘッジせず、1本目の結果を待つこと"""
+    print("=== ヘッジ用プールの上限 ===")
+    original = resilience._hedge_pool
+    resilience._hedge_pool = HedgePool(max_workers=1)
+    try:
+        client = FakeClient(delays=[0.3] * 4)
+        caller = ResilientCaller(hedge=True, hedge_delay_sec=0.02, sleep=lambda _: None)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: caller.call(client.retrieve), range(3)))
+    finally:
+        resilience._hedge_pool = original
+    assert len(results) == 3
+    stats = caller.stats()
+    assert stats["hedges"] == 1 and stats["hedgesSkipped"] == 2
+    assert client.calls == 4
+
+
+def test_hedge_waits_for_samples():
+    """遅延を固定しない場合、p95が求まるまではヘッジしないこと"""
+    print("=== ヘッジの遅延 ===")
+    caller = ResilientCaller(hedge=True, hedge_min_samples=3)
+    assert caller.current_hedge_delay() is None
+    for seconds in (0.1, 0.2, 0.3):
+        caller.latency.add(seconds)
+    assert caller.current_hedge_delay() == 0.3
+
+
+if __name__ == "__main__":
+    test_is_retryable()
+    test_retry_with_backoff()
+    test_non_retryable_is_not_retried()
+    test_deadline_stops_retry()
+    test_circuit_breaker()
+    test_half_open_failure_reopens()
+    test_hedged_request()
+    test_no_hedge_under_concurrency()
+    test_hedge_skipped_when_pool_is_full()
+    test_hedge_waits_for_samples()
+    print("✅ すべてのテストが完了しました")
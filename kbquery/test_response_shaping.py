@@ -0,0 +1,68 @@
+# kbquery/test_response_shaping.py
+"""
+レスポンスサイズ制御のローカルテスト（AWS不要）
+"""
+from response_shaping import extract_snippet, resolve_shaping, shape_results, truncate_text
+
+LONG_TEXT = "前置き" * 100 + "SAML の設定は管理画面から行います。" + "後書き" * 100
+
+
+def test_truncate_text():
+    """max_chars で切り詰め、0なら変更しないこと"""
+    print("=== truncate_text ===")
+    assert truncate_text("あいうえお", 3) == "あいう…"
+    assert truncate_text("あいうえお", 0) == "あいうえお"
+    assert truncate_text("あいう", 3) == "あいう"
+
+
+def test_extract_snippet():
+    """キーワードの前後だけを抜き出し、見つからなければ先頭を返すこと"""
+    print("=== extract_snippet ===")
+    snippet = extract_snippet(LONG_TEXT, ["saml"], window=10)
+    assert "SAML の設定" in snippet
+    assert snippet.startswith("…") and snippet.endswith("…")
+    assert len(snippet) < 40
+    
+    fallback = extract_snippet(LONG_TEXT, ["存在しない語"], window=10)
+    assert fallback == LONG_TEXT[:20] + "…"
+
+
+def test_shape_results_byte_budget():
+    """合計バイト数が上限に収まり、下位の結果から削られること"""
+    print("=== バイト数の上限 ===")
+    results = [
+        {"content": "あ" * 100, "score": 0.9, "source": "s3://a"},
+        {"content": "い" * 100, "score": 0.8, "source": "s3://b"},
+        {"content": "う" * 100, "score": 0.7, "source": "s3://c"},
+    ]
+    shaped, truncated = shape_results(results, [], max_bytes=450)
+    assert truncated
+    assert [r["source"] for r in shaped] == ["s3://a", "s3://b"]
+    assert sum(len(r["content"].encode("utf-8")) for r in shaped) <= 450
+    assert "truncated" not in shaped[0] and shaped[1]["truncated"]
+    # 元の結果は変更しない
+    assert results[1]["content"] == "い" * 100
+    
+    unchanged, truncated = shape_results(results, [])
+    assert unchanged is results and not truncated
+
+
+def test_resolve_shaping():
+    """リクエスト引数がKB設定より優先され、不明なモードはエラーになること"""
+    print("=== resolve_shaping ===")
+    kb_config = {"content_mode": "snippet", "max_chars_per_result": 300}
+    assert resolve_shaping(kb_config) == {"content_mode": "snippet", "max_chars": 300, "max_bytes": 0}
+    assert resolve_shaping(kb_config, "full", 0)["content_mode"] == "full"
+    try:
+        resolve_shaping(kb_config, "html")
+        assert False, "ValueError expected"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_truncate_text()
+    test_extract_snippet()
+    test_shape_results_byte_budget()
+    test_resolve_shaping()
+    print("✅ すべてのテストが完了しました")
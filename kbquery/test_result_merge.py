@@ -0,0 +1,107 @@
+# kbquery/test_result_merge.py
+"""
+マージエンジンのローカルテスト（AWS不要）
+"""
+from result_merge import merge_ranked_lists, rrf_score
+
+
+def item(source, content, score, chunk_id=None):
+    result = {"content": content, "score": score, "source": source}
+    if chunk_id:
+        result["chunkId"] = chunk_id
+    return result
+
+
+def test_max_strategy_keeps_best_score_per_chunk():
+    """max: 同じチャンクは最大スコアを残し、スコア順に並べる"""
+    print("=== max ===")
+    lists = [
+        [item("s3://a", "A1", 0.9), item("s3://b", "B1", 0.5)],
+        [item("s3://b", "B1", 0.7), item("s3://a", "A1", 0.4)],
+    ]
+    merged = merge_ranked_lists(lists, 5, "max")
+    assert [(r["source"], r["score"]) for r in merged] == [("s3://a", 0.9), ("s3://b", 0.7)]
+
+
+def test_distinct_chunks_of_same_document_are_kept():
+    """同じドキュメントの別チャンクはまとめられない"""
+    print("=== チャンク単位の重複判定 ===")
+    lists = [[
+        item("s3://a", "第1章", 0.9, "chunk-1"),
+        item("s3://a", "第2章", 0.8, "chunk-2"),
+        item("s3://a", "第1章", 0.7, "chunk-1"),
+    ]]
+    merged = merge_ranked_lists(lists, 5, "max")
+    assert [r["chunkId"] for r in merged] == ["chunk-1", "chunk-2"]
+
+
+def test_rrf_strategy_rewards_agreement():
+    """rrf: 複数のサブクエリで上位に出たチャンクが上に来る"""
+    print("=== rrf ===")
+    lists = [
+        [item("s3://a", "A", 0.99), item("s3://b", "B", 0.2)],
+        [item("s3://b", "B", 0.3), item("s3://c", "C", 0.1)],
+    ]
+    merged = merge_ranked_lists(lists, 2, "rrf")
+    assert merged[0]["source"] == "s3://b"
+    assert abs(merged[0]["score"] - (rrf_score(2) + rrf_score(1))) < 1e-12
+
+
+def test_weighted_strategy():
+    """weighted: サブクエリごとの重み付きスコア和（省略時は均等）"""
+    print("=== weighted ===")
+    lists = [
+        [item("s3://a", "A", 0.5)],
+        [item("s3://b", "B", 0.5)],
+    ]
+    merged = merge_ranked_lists(lists, 2, "weighted", weights=[1.0, 3.0])
+    assert [r["source"] for r in merged] == ["s3://b", "s3://a"]
+    assert merged[0]["score"] == 1.5
+    
+    merged = merge_ranked_lists(lists, 2, "weighted")
+    assert [r["score"] for r in merged] == [0.25, 0.25]
+    
+    try:
+        merge_ranked_lists(lists, 2, "weighted", weights=[1.0])
+    except ValueError as e:
+        print(f"想定どおりのエラー: {e}")
+    else:
+        raise AssertionError("weights of the wrong length should raise ValueError")
+
+
+def test_results_without_chunk_id():
+    """チャンクIDがない結果は、ソースURIと本文が同じものだけをまとめる"""
+    print("=== チャンクIDなし ===")
+    lists = [
+        [item("s3://a", "第1章", 0.9), item("s3://a", "第2章", 0.6)],
+        [item("s3://a", "第1章", 0.95), item("s3://b", "第1章", 0.5)],
+    ]
+    merged = merge_ranked_lists(lists, 5, "max")
+    assert [(r["source"], r["content"], r["score"]) for r in merged] == [
+        ("s3://a", "第1章", 0.95), ("s3://a", "第2章", 0.6), ("s3://b", "第1章", 0.5),
+    ]
+
+
+def test_top_k_and_unknown_strategy():
+    """max_resultsで件数が制限され、未知の戦略はエラーになる"""
+    print("=== top-k / エラー ===")
+    lists = [[item(f"s3://{i}", str(i), i / 10) for i in range(10)]]
+    merged = merge_ranked_lists(lists, 3, "max")
+    assert [r["score"] for r in merged] == [0.9, 0.8, 0.7]
+    
+    try:
+        merge_ranked_lists(lists, 3, "unknown")
+    except ValueError as e:
+        print(f"想定どおりのエラー: {e}")
+    else:
+        raise AssertionError("unknown strategy should raise ValueError")
+
+
+if __name__ == "__main__":
+    test_max_strategy_keeps_best_score_per_chunk()
+    test_distinct_chunks_of_same_document_are_kept()
+    test_rrf_strategy_rewards_agreement()
+    test_weighted_strategy()
+    test_results_without_chunk_id()
+    test_top_k_and_unknown_strategy()
+    print("✅ すべてのテストが完了しました")
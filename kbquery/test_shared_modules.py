@@ -0,0 +1,30 @@
+# kbquery/test_shared_modules.py
+"""
+agentcore/ にコミットしている共通モジュールのコピーが kbquery/ と同じかを確認する（AWS不要）
+
+AgentCore Runtime のコンテナは agentcore/ だけからビルドされるため、
+json_codec / structured_log / single_flight のコピーを agentcore/ に置いている。
+"""
+import os
+
+
+SHARED_MODULES = ("json_codec.py", "structured_log.py", "single_flight.py")
+
+KBQUERY_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENTCORE_DIR = os.path.join(KBQUERY_DIR, "..", "agentcore")
+
+
+def test_agentcore_copies_match():
+    """agentcore/ のコピーが kbquery/ の元のモジュールと一致すること（違えば deploy.ps1 で同期する）"""
+    print("=== 共通モジュールのコピー ===")
+    for name in SHARED_MODULES:
+        with open(os.path.join(KBQUERY_DIR, name), "rb") as f:
+            source = f.read()
+        with open(os.path.join(AGENTCORE_DIR, name), "rb") as f:
+            copy = f.read()
+        assert copy == source, f"agentcore/{name} is out of sync with kbquery/{name}"
+
+
+if __name__ == "__main__":
+    test_agentcore_copies_match()
+    print("✅ すべてのテストが完了しました")
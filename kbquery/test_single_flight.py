@@ -0,0 +1,97 @@
+# kbquery/test_single_flight.py
+"""
+single-flight（同一呼び出しのまとめ）のローカルテスト（AWS不要）
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from single_flight import SingleFlight, make_key
+
+
+def slow_call(calls, started, release, value="result"):
+    def fn():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return value
+    return fn
+
+
+def test_concurrent_calls_are_coalesced():
+    """同時に呼ばれた同じキーは1回だけ実行され、結果を共有すること"""
+    print("=== 同時呼び出しのまとめ ===")
+    flights = SingleFlight()
+    calls, started, release = [], threading.Event(), threading.Event()
+    fn = slow_call(calls, started, release)
+    
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flights.do, "k", fn)
+        started.wait(timeout=5)
+        followers = [executor.submit(flights.do, "k", fn) for _ in range(3)]
+        # フォロワーが登録されるまで待ってから完了させる
+        while flights.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+        outputs = [leader.result()] + [f.result() for f in followers]
+    
+    assert len(calls) == 1
+    assert outputs[0] == ("result", False)
+    assert all(output == ("result", True) for output in outputs[1:])
+    assert flights.stats() == {"calls": 4, "coalesced": 3, "inFlight": 0}
+
+
+def test_completed_calls_are_not_reused():
+    """retain=False では完了したキーを忘れ、次の呼び出しは新たに実行すること"""
+    print("=== 完了後の再実行 ===")
+    flights = SingleFlight()
+    counter = []
+    assert flights.do("k", lambda: counter.append(1) or len(counter)) == (1, False)
+    assert flights.do("k", lambda: counter.append(1) or len(counter)) == (2, False)
+    
+    retained = SingleFlight(retain=True)
+    assert retained.do("k", lambda: "first") == ("first", False)
+    assert retained.do("k", lambda: "second") == ("first", True)
+
+
+def test_error_is_shared():
+    """先行する呼び出しの例外がフォロワーにも伝わり、キーは解放されること"""
+    print("=== 例外の共有 ===")
+    flights = SingleFlight()
+    calls, started, release = [], threading.Event(), threading.Event()
+    
+    def failing():
+        slow_call(calls, started, release)()
+        raise RuntimeError("boom")
+    
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flights.do, "k", failing)
+        started.wait(timeout=5)
+        follower = executor.submit(flights.do, "k", failing)
+        while flights.coalesced < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in (leader, follower):
+            try:
+                future.result()
+                assert False, "RuntimeError expected"
+            except RuntimeError:
+                pass
+    assert len(calls) == 1
+    assert flights.do("k", lambda: "ok") == ("ok", False)
+
+
+def test_make_key():
+    """引数の順序が違っても同じキーになること"""
+    print("=== キー ===")
+    assert make_key("kb_search", {"query": "認証", "kb_name": "faq"}) == \
+        make_key("kb_search", {"kb_name": "faq", "query": "認証"})
+    assert make_key("kb_search", {"query": "認証"}) != make_key("auto_search", {"query": "認証"})
+
+
+if __name__ == "__main__":
+    test_concurrent_calls_are_coalesced()
+    test_completed_calls_are_not_reused()
+    test_error_is_shared()
+    test_make_key()
+    print("✅ すべてのテストが完了しました")
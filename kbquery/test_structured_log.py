@@ -0,0 +1,74 @@
+# kbquery/test_structured_log.py
+"""
+構造化ログのローカルテスト（AWS不要）
+"""
+import contextlib
+import io
+import json
+
+from structured_log import RequestLog, StructuredLogger
+
+
+def capture(fn) -> list:
+    """fn の標準出力をJSON行のリストとして返す"""
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        fn()
+    return [json.loads(line) for line in buffer.getvalue().splitlines()]
+
+
+def test_level_gating_is_lazy():
+    """無効なレベルでは遅延フィールドを評価しないこと"""
+    print("=== レベル制御 ===")
+    logger = StructuredLogger("test", level="INFO")
+    calls = []
+    
+    def payload():
+        calls.append(1)
+        return {"big": "event"}
+    
+    lines = capture(lambda: logger.debug("event", event=payload))
+    assert lines == [] and calls == []
+    
+    lines = capture(lambda: logger.info("event", event=payload))
+    assert lines[0]["event"] == {"big": "event"} and calls == [1]
+    assert lines[0]["level"] == "INFO" and lines[0]["logger"] == "test"
+
+
+def test_request_log():
+    """1リクエスト1行で、所要時間と段階ごとの時間を含むこと"""
+    print("=== リクエスト行 ===")
+    logger = StructuredLogger("test", level="INFO")
+    
+    def run():
+        request_log = RequestLog(logger, requestId="r1")
+        with request_log.stage("handler"):
+            pass
+        request_log.set(tool="kb_search")
+        request_log.emit(status=200)
+    
+    lines = capture(run)
+    assert len(lines) == 1
+    line = lines[0]
+    assert line["requestId"] == "r1" and line["tool"] == "kb_search" and line["status"] == 200
+    assert "handler" in line["timings"] and line["durationMs"] >= 0
+
+
+def test_sampling():
+    """サンプリング対象外でも WARNING 以上は出力すること"""
+    print("=== サンプリング ===")
+    logger = StructuredLogger("test", level="INFO", sample_rate=0.0)
+    
+    def run():
+        RequestLog(logger).emit(status=200)
+        RequestLog(logger).emit("WARNING", status=400)
+    
+    lines = capture(run)
+    assert [line["status"] for line in lines] == [400]
+
+
+if __name__ == "__main__":
+    test_level_gating_is_lazy()
+    test_request_log()
+    test_sampling()
+    print("✅ すべてのテストが完了しました")